@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'balanceapp.middleware.MetricsMiddleware',  # метрики для /metrics, должен быть первым
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -96,19 +97,112 @@ WSGI_APPLICATION = 'avito_tech_balance.wsgi.application'
 #     }
 # }
 
+# PostgreSQL через psycopg 3 с пулом соединений (balanceapp/db/base.py)
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'balanceapp.db',
         'NAME': 'balance_db',
         'USER': 'postgres',
         'PASSWORD': 'admin',
         'HOST': 'db',
         'PORT': '5432',
+        'OPTIONS': {
+            # параметры psycopg_pool.ConnectionPool
+            'pool': {'min_size': 2, 'max_size': 20, 'timeout': 10, 'max_idle': 600, 'max_lifetime': 3600},
+            # передача параметров на стороне сервера: нужна для подготовленных запросов
+            'server_side_binding': True,
+            # запрос становится подготовленным после стольких выполнений на одном соединении
+            'prepare_threshold': 5,
+            # True - при подключении через pgbouncer в режиме pool_mode = transaction
+            'pgbouncer': False,
+        },
     }
 }
 
+# Реплики для чтения (balanceapp.routers): алиасы из DATABASES, например
+# DATABASES['replica'] = {**DATABASES['default'], 'HOST': 'db-replica'} и 'REPLICAS': ['replica']
+DATABASE_ROUTERS = ['balanceapp.routers.ReplicaRouter']
+REPLICATION = {
+    'REPLICAS': [],
+    'MAX_LAG': 1.0,  # реплика с большим отставанием (в секундах) не используется
+    'CHECK_INTERVAL': 1.0,  # как часто проверять отставание реплик, секунды
+    'STICKY_TIMEOUT': 60,  # сколько секунд помнить момент записи по пользователю
+    'CACHE': 'shared',  # кэш с моментами записей, общий для всех воркеров
+}
+
+# Кэши: default - локальный для процесса, shared - общий для всех воркеров gunicorn
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/tmp/avito_tech_balance_cache',
+    },
+}
+
+# Кэш пользователей (balanceapp.customer_cache): локальный LRU и необязательный общий кэш
+CUSTOMER_CACHE = {
+    'LOCAL_SIZE': 10000,  # записей в памяти процесса
+    'LOCAL_TIMEOUT': 1.0,  # секунды: дольше другой воркер не увидит изменение без общего кэша
+    'SHARED': None,  # алиас из CACHES (Redis, Memcached), None - без общего кэша
+    'SHARED_TIMEOUT': 60,
+}
+
+# Групповая фиксация зачислений и списаний (balanceapp.group_commit)
+GROUP_COMMIT = {
+    'ENABLED': False,
+    'MAX_DELAY': 0.002,  # сколько секунд ведущий запрос собирает пакет
+    'MAX_SIZE': 500,  # операций в пакете
+}
+
+# Контроль допуска зачислений, списаний и переводов (balanceapp.admission)
+ADMISSION = {
+    'ENABLED': True,
+    'CLIENT_RATE': 200,  # операций в секунду на клиента (пользователя API или IP-адрес)
+    'CLIENT_BURST': 400,  # запас токенов клиента
+    'CUSTOMER_RATE': 50,  # операций в секунду на счет
+    'CUSTOMER_BURST': 100,
+    'MAX_IN_FLIGHT': 8,  # одновременных записей по счету
+    'SHARED': None,  # алиас из CACHES (Redis, Memcached), None - лимиты в памяти каждого воркера
+    'LOCAL_SIZE': 100000,  # корзин в памяти процесса
+}
+
+# Месячные секции журнала транзакций (balanceapp.partitions)
+TRANSACTION_PARTITIONS = {
+    'MONTHS_AHEAD': 3,  # на сколько месяцев вперед создавать секции
+    'RETENTION_MONTHS': None,  # сколько месяцев хранить секции (transaction_partitions --retention), None - все
+}
+
+# Архив старых месяцев журнала транзакций на диске (balanceapp.archive)
+TRANSACTION_ARCHIVE = {
+    'PATH': BASE_DIR / 'archive',
+    'AFTER_MONTHS': 12,  # месяцы старше этого переносятся в архив командой archive_transactions
+}
+
+# Сверка балансов с журналом транзакций (balanceapp.reconcile)
+RECONCILIATION = {
+    'WORKERS': 4,  # процессов, проверяющих части диапазона id пользователей
+    'CHUNK_SIZE': 100000,  # id пользователей в части
+}
+
+# Курсы валют ЦБ РФ (balanceapp.rates)
+RATES = {
+    'SOURCE': 'balanceapp.rates.CBRSource',
+    'SOURCE_OPTIONS': {},
+    'CACHE': 'shared',
+    'TTL': 60 * 60,  # через час таблица курсов обновляется в фоне
+    'LOCK_TIMEOUT': 10,
+}
+
 if 'test' in sys.argv or 'test_coverage' in sys.argv:
     DATABASES['default']['NAME'] = 'test_' + DATABASES['default']['NAME']
+    # в тестах курсы берутся из локального файла, а кэш не переживает перезапуск
+    RATES['SOURCE'] = 'balanceapp.rates.FixtureSource'
+    RATES['CACHE'] = 'default'
+    REPLICATION['CACHE'] = 'default'
+    # реплика в тестах - второе соединение с тестовой базой, включается в тестах роутера
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -17,7 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from balanceapp.views import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('balance/async/', include('balanceapp.async_urls')),  # асинхронные версии для ASGI
     path('balance/', include('balanceapp.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),  # для Prometheus
 ]
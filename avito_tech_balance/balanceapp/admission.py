@@ -0,0 +1,274 @@
+"""
+Контроль допуска записей: зачислений и списаний (POST customers/<id>/operations/), переводов (POST transfer/)
+и пакетов (POST batch/), в том числе асинхронных версий (async_views.py).
+
+Клиент, повторяющий операции с одним счетом в цикле, копит в Postgres ожидания блокировки строки
+пользователя, и время ответа растет у всех. Поэтому до обращения к базе запрос проверяется:
+- корзиной токенов клиента (пользователь API или IP-адрес, как в throttling DRF):
+  ADMISSION['CLIENT_RATE'] операций в секунду, запас CLIENT_BURST;
+- корзиной токенов каждого счета операции (у перевода - отправителя и получателя, у пакета - всех счетов
+  пакета): CUSTOMER_RATE, CUSTOMER_BURST;
+- числом одновременно выполняемых записей по счету: не больше MAX_IN_FLIGHT.
+При превышении лимита запрос сразу получает 429 с заголовком Retry-After (через сколько секунд
+появится токен) вместо ожидания блокировки в базе. Токены, взятые отклоненным запросом, возвращаются в корзины.
+
+Состояние по умолчанию хранится в памяти процесса (LocalBackend, не больше LOCAL_SIZE корзин), и лимиты
+действуют на каждый воркер отдельно. С ADMISSION['SHARED'] - алиасом из CACHES (Redis, Memcached) -
+состояние общее для всех воркеров (CacheBackend).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import ADMISSION_REJECTED
+
+KEY = 'balanceapp:admission:{}'
+
+
+class Rejected(Exception):
+    """
+    Запрос не допущен: reason - client, customer или in_flight, retry_after - секунды до повтора
+    """
+
+    def __init__(self, reason, retry_after, message):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def refill(state, rate, burst, now):
+    """
+    Взятие токена из корзины с состоянием state (токены, время обновления) или None для полной корзины.
+    Возвращает (новое состояние, секунды до появления токена - 0, если токен взят)
+    """
+    tokens, updated = state if state is not None else (burst, now)
+    tokens = min(burst, tokens + max(now - updated, 0) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class LocalBackend:
+    """
+    Корзины и счетчики одновременных записей в памяти процесса. Вытесняются давно не использованные корзины:
+    вытесненная корзина снова считается полной
+    """
+
+    def __init__(self, size=100000):
+        self.size = size
+        self._buckets = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        with self._lock:
+            self._buckets[key], wait = refill(self._buckets.get(key), rate, burst, time.monotonic())
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def refund(self, key, rate, burst):
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is not None:
+                self._buckets[key] = (min(burst, state[0] + 1), state[1])
+
+    def acquire(self, key, limit):
+        with self._lock:
+            count = self._in_flight.get(key, 0)
+            if count >= limit:
+                return False
+            self._in_flight[key] = count + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            count = self._in_flight.pop(key, 1) - 1
+            if count > 0:
+                self._in_flight[key] = count
+
+
+class CacheBackend:
+    """
+    Корзины и счетчики одновременных записей в кэше Django (общем для воркеров)
+    """
+    # счетчик записей воркера, завершившегося без release, сбрасывается не позже чем через столько секунд
+    IN_FLIGHT_TIMEOUT = 60
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def take(self, key, rate, burst):
+        key = KEY.format(key)
+        # чтение и запись не атомарны: одновременные запросы могут взять на несколько токенов больше
+        state, wait = refill(self.cache.get(key), rate, burst, time.time())
+        # через burst / rate секунд корзина снова полная, хранить ее дольше не нужно
+        self.cache.set(key, state, timeout=math.ceil(burst / rate) + 1)
+        return wait
+
+    def refund(self, key, rate, burst):
+        key = KEY.format(key)
+        state = self.cache.get(key)
+        if state is not None:
+            self.cache.set(key, (min(burst, state[0] + 1), state[1]), timeout=math.ceil(burst / rate) + 1)
+
+    def acquire(self, key, limit):
+        key = KEY.format(f'in_flight:{key}')
+        self.cache.add(key, 0, timeout=self.IN_FLIGHT_TIMEOUT)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:  # ключ истек между add и incr
+            self.cache.add(key, 1, timeout=self.IN_FLIGHT_TIMEOUT)
+            return True
+        if count > limit:
+            self.release_key(key)
+            return False
+        return True
+
+    def release(self, key):
+        self.release_key(KEY.format(f'in_flight:{key}'))
+
+    def release_key(self, key):
+        try:
+            self.cache.decr(key)
+        except ValueError:  # счетчик уже сброшен по IN_FLIGHT_TIMEOUT
+            pass
+
+
+class Admission:
+    """
+    Допущенная запись: занятые места одновременных записей освобождаются release
+    """
+
+    def __init__(self, backend, keys):
+        self.backend = backend
+        self.keys = keys
+
+    def release(self):
+        for key in self.keys:
+            self.backend.release(key)
+        self.keys = []
+
+    async def arelease(self):
+        """
+        release для асинхронных представлений: общий кэш освобождается в потоке, не в цикле событий
+        """
+        if isinstance(self.backend, LocalBackend):
+            return self.release()
+        return await sync_to_async(self.release)()
+
+
+class AdmissionControl:
+    """
+    Проверка лимитов записей клиента и счетов (см. описание модуля)
+    """
+
+    def __init__(self, backend, client_rate=200, client_burst=400, customer_rate=50, customer_burst=100,
+                 max_in_flight=8):
+        self.backend = backend
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.customer_rate = customer_rate
+        self.customer_burst = customer_burst
+        self.max_in_flight = max_in_flight
+
+    def admit(self, client, customer_ids):
+        """
+        Допуск записи клиента client по счетам customer_ids: Admission или исключение Rejected
+        """
+        customer_ids = sorted(set(customer_ids))
+        buckets = [(f'client:{client}', self.client_rate, self.client_burst, 'client', 'Too many requests')]
+        buckets += [(f'customer:{customer_id}', self.customer_rate, self.customer_burst, 'customer',
+                     'Too many requests for the customer') for customer_id in customer_ids]
+
+        # сначала места одновременных записей: их можно освободить, не трогая корзины
+        admission = Admission(self.backend, [])
+        taken = []
+        try:
+            for customer_id in customer_ids:
+                if not self.backend.acquire(f'customer:{customer_id}', self.max_in_flight):
+                    self.reject('in_flight', 1, 'Too many concurrent operations for the customer')
+                admission.keys.append(f'customer:{customer_id}')
+            for key, rate, burst, reason, message in buckets:
+                wait = self.backend.take(key, rate, burst)
+                if wait:
+                    self.reject(reason, wait, message)
+                taken.append((key, rate, burst))
+        except Rejected:
+            # отклоненный запрос не расходует токены и места
+            admission.release()
+            for key, rate, burst in taken:
+                self.backend.refund(key, rate, burst)
+            raise
+        return admission
+
+    async def aadmit(self, client, customer_ids):
+        """
+        admit для асинхронных представлений: общий кэш проверяется в потоке, не в цикле событий
+        """
+        if isinstance(self.backend, LocalBackend):
+            return self.admit(client, customer_ids)
+        return await sync_to_async(self.admit)(client, customer_ids)
+
+    @staticmethod
+    def reject(reason, wait, message):
+        ADMISSION_REJECTED.labels(reason=reason).inc()
+        raise Rejected(reason, max(1, math.ceil(wait)), message)
+
+
+async def aadmit(request, customer_ids):
+    """
+    Допуск записи асинхронного представления (см. async_views.py): Admission, None (контроль выключен)
+    или исключение Rejected
+    """
+    control = get_admission_control()
+    if control is None:
+        return None
+    return await control.aadmit(client_key(request, await request.auser()), customer_ids)
+
+
+def client_key(request, user=None):
+    """
+    Клиент API: пользователь Django (user или request.user) или IP-адрес (с учетом X-Forwarded-For,
+    как в throttling DRF)
+    """
+    user = user if user is not None else request.user
+    if user and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{BaseThrottle().get_ident(request)}'
+
+
+@lru_cache(maxsize=None)
+def get_admission_control():
+    """
+    Контроль допуска по settings.ADMISSION или None, если он выключен
+    """
+    config = getattr(settings, 'ADMISSION', {})
+    if not config.get('ENABLED'):
+        return None
+    backend = CacheBackend(config['SHARED']) if config.get('SHARED') else LocalBackend(config.get('LOCAL_SIZE', 100000))
+    return AdmissionControl(backend, client_rate=config.get('CLIENT_RATE', 200),
+                            client_burst=config.get('CLIENT_BURST', 400),
+                            customer_rate=config.get('CUSTOMER_RATE', 50),
+                            customer_burst=config.get('CUSTOMER_BURST', 100),
+                            max_in_flight=config.get('MAX_IN_FLIGHT', 8))
+
+
+@receiver(setting_changed)
+def reset_admission_control(setting, **kwargs):
+    if setting in ('ADMISSION', 'CACHES'):
+        get_admission_control.cache_clear()
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class BalanceappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'balanceapp'
+
+    def ready(self):
+        # подключение счетчика SQL-запросов к новым соединениям и сброса кэша пользователей при их изменении
+        from . import customer_cache, metrics  # noqa: F401
+        from .partitions import create_after_migrate
+
+        # секции журнала транзакций на следующие месяцы
+        post_migrate.connect(create_after_migrate, sender=self)
@@ -0,0 +1,477 @@
+"""
+Холодный архив журнала транзакций: месяцы старше TRANSACTION_ARCHIVE['AFTER_MONTHS'] переносятся из базы
+в сжатые файлы на локальном диске (python manage.py archive_transactions).
+
+Архив месяца - каталог TRANSACTION_ARCHIVE['PATH']/ГГГГММ: файл <id пользователя>.jsonl.gz с транзакциями
+пользователя (отправленными и полученными, по объекту JSON на строку в порядке времени и id) и index.json -
+индекс файлов месяца: число транзакций, время первой и последней из них и наименьшие и наибольшие id и суммы.
+index.json записывается последним, поэтому месяц без него считается неархивированным.
+
+Архивируется секция журнала (partitions.py): она отсоединяется, ее транзакции записываются в файлы,
+после записи индекса таблица секции удаляется. Если транзакции месяца попали в архив раньше (например,
+после сбоя между записью индекса и удалением таблицы), файлы дополняются без повторов.
+
+История транзакций и выгрузка читают архив, если запрошенный период захватывает архивированные месяцы:
+из архива читаются только файлы пользователя, попадающие в период по индексу. Страница истории
+(HistoryWithArchive) читает файл, только если по границам из индекса его строки могут попасть на страницу:
+новые страницы по убыванию времени архив не читают вовсе, а число строк берется из индекса.
+"""
+import gzip
+import heapq
+import json
+import operator
+import os
+import re
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from itertools import groupby, islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.utils import create_namedtuple_class
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import ledger, partitions
+from .models import Transaction
+
+INDEX_FILE = 'index.json'
+MONTH_RE = re.compile(r'^(\d{4})(\d{2})$')
+
+# транзакции таблицы секции по пользователям (перевод самому себе - один раз) в порядке (timestamp, id)
+CUSTOMER_ROWS_SQL = """
+    SELECT customer_id, id, amount, "timestamp", description, sender_id, recipient_id FROM (
+        SELECT sender_id AS customer_id, * FROM {table} WHERE sender_id IS NOT NULL
+        UNION ALL
+        SELECT recipient_id, * FROM {table}
+        WHERE recipient_id IS NOT NULL AND recipient_id IS DISTINCT FROM sender_id
+    ) AS moves
+    ORDER BY customer_id, "timestamp", id
+"""
+
+LOOKUPS = {'gt': operator.gt, 'gte': operator.ge, 'lt': operator.lt, 'lte': operator.le, 'exact': operator.eq}
+
+# транзакция из файла архива: поля называются как атрибуты Transaction
+Row = namedtuple('Row', ('id', 'amount', 'timestamp', 'description', 'sender_id', 'recipient_id'))
+
+# границы значений полей сортировки в записи индекса файла: (наименьшее, наибольшее, разбор значения)
+BOUNDS = {'timestamp': ('first', 'last', parse_datetime), 'id': ('min_id', 'max_id', int),
+          'amount': ('min_amount', 'max_amount', Decimal)}
+
+
+def get_config():
+    return {'PATH': settings.BASE_DIR / 'archive', 'AFTER_MONTHS': 12,
+            **getattr(settings, 'TRANSACTION_ARCHIVE', {})}
+
+
+def month_path(month):
+    return Path(get_config()['PATH']) / f'{month:%Y%m}'
+
+
+def encode_row(row):
+    """
+    Строка файла архива для транзакции (id, amount, timestamp, description, sender_id, recipient_id)
+    """
+    pk, amount, timestamp, description, sender, recipient = row
+    return json.dumps({'id': pk, 'amount': str(amount), 'timestamp': timestamp.isoformat(),
+                       'description': description, 'sender': sender, 'recipient': recipient},
+                      ensure_ascii=False) + '\n'
+
+
+def decode_row(line):
+    data = json.loads(line)
+    return Row(data['id'], Decimal(data['amount']), parse_datetime(data['timestamp']), data['description'],
+               data['sender'], data['recipient'])
+
+
+def read_file(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            yield decode_row(line)
+
+
+def write_file(path, rows):
+    """
+    Запись транзакций в файл архива (через временный файл), возвращает запись индекса для файла
+    """
+    entry = {'file': path.name, 'rows': 0, 'first': None, 'last': None}
+    ids, amounts = [], []
+    temporary = path.with_name(path.name + '.tmp')
+    with gzip.open(temporary, 'wt', encoding='utf-8') as file:
+        for row in rows:
+            file.write(encode_row(row))
+            entry['rows'] += 1
+            entry['first'] = entry['first'] or row[2].isoformat()
+            entry['last'] = row[2].isoformat()
+            ids.append(row[0])
+            amounts.append(row[1])
+    if ids:
+        entry.update(min_id=min(ids), max_id=max(ids), min_amount=str(min(amounts)), max_amount=str(max(amounts)))
+    os.replace(temporary, path)
+    return entry
+
+
+def write_index(directory, index):
+    temporary = directory / (INDEX_FILE + '.tmp')
+    temporary.write_text(json.dumps(index, indent=1), encoding='utf-8')
+    os.replace(temporary, directory / INDEX_FILE)
+
+
+@lru_cache(maxsize=256)
+def _cached_index(path, version):
+    return json.loads(Path(path).read_text(encoding='utf-8'))
+
+
+def read_index(directory):
+    """
+    Индекс архива месяца или None, если месяц не архивирован. Индекс перечитывается только после изменения файла
+    """
+    path = directory / INDEX_FILE
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return _cached_index(str(path), (stat.st_ino, stat.st_mtime_ns, stat.st_size))
+
+
+def archived_months():
+    """
+    Архивированные месяцы (первые дни месяцев) по порядку
+    """
+    root = Path(get_config()['PATH'])
+    if not root.is_dir():
+        return []
+    months = []
+    for directory in root.iterdir():
+        match = MONTH_RE.match(directory.name)
+        if match and (directory / INDEX_FILE).exists():
+            months.append(date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+def _unique(rows):
+    # после повторной архивации месяца транзакция может быть и в файле, и в таблице секции
+    previous = None
+    for row in rows:
+        if row[0] != previous:
+            yield row
+        previous = row[0]
+
+
+def archive_month(table, month):
+    """
+    Запись транзакций таблицы секции table за месяц month в архив. Возвращает число записанных строк
+    """
+    directory = month_path(month)
+    directory.mkdir(parents=True, exist_ok=True)
+    index = read_index(directory) or {'month': f'{month:%Y-%m}', 'customers': {}}
+    customers = dict(index['customers'])
+    written = 0
+    # курсор на стороне сервера внутри транзакции: таблица читается порциями
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(CUSTOMER_ROWS_SQL.format(table=table))
+        for customer_id, rows in groupby(cursor, key=operator.itemgetter(0)):
+            rows = (row[1:] for row in rows)
+            path = directory / f'{customer_id}.jsonl.gz'
+            if str(customer_id) in customers:
+                rows = _unique(heapq.merge(read_file(path), rows, key=lambda row: (row[2], row[0])))
+            customers[str(customer_id)] = write_file(path, rows)
+            written += customers[str(customer_id)]['rows']
+    write_index(directory, {'month': f'{month:%Y-%m}', 'customers': customers})
+    return written
+
+
+def archive_before(before):
+    """
+    Перенос в архив секций месяцев раньше before. Возвращает [(секция, число записанных строк)]
+    """
+    before = before.replace(day=1)
+    # старые транзакции из секции по умолчанию переходят в секции своих месяцев
+    partitions.ensure_partitions()
+    # балансы на границу архива: баланс на момент времени и сверка считают от них, а не по удаляемым секциям
+    ledger.create_boundary_checkpoints(before)
+    partitions.detach_partitions(before)
+    archived = []
+    for partition in partitions.detached_partitions():
+        if partition.month >= before:
+            continue
+        rows = archive_month(partition.name, partition.month)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {partition.name}')
+        archived.append((partition, rows))
+    return archived
+
+
+def first_stored_month():
+    """
+    Первый месяц журнала, который хранится в базе после архивированных месяцев, или None, если архива нет.
+    Транзакции раньше него - только в архиве
+    """
+    months = archived_months()
+    return partitions.add_months(months[-1], 1) if months else None
+
+
+def archive_boundary():
+    """
+    Первый месяц, который хранится в базе по TRANSACTION_ARCHIVE['AFTER_MONTHS']
+    """
+    return partitions.add_months(timezone.localdate().replace(day=1), -get_config()['AFTER_MONTHS'])
+
+
+def customer_files(customer_id, date_from=None, date_to=None):
+    """
+    Файлы архива пользователя, которые по индексу могут содержать транзакции за период, в порядке месяцев:
+    [(путь к файлу, запись индекса)]. date_from включительно, date_to не включительно
+    """
+    files = []
+    for month in archived_months():
+        start, end = partitions.month_start(month), partitions.month_start(partitions.add_months(month, 1))
+        if (date_from is not None and end <= date_from) or (date_to is not None and start >= date_to):
+            continue
+        directory = month_path(month)
+        entry = read_index(directory)['customers'].get(str(customer_id))
+        if entry is None or not entry['rows']:
+            continue
+        if (date_from is not None and parse_datetime(entry['last']) < date_from
+                or date_to is not None and parse_datetime(entry['first']) >= date_to):
+            continue
+        files.append((directory / entry['file'], entry))
+    return files
+
+
+def read_period(path, date_from=None, date_to=None):
+    for row in read_file(path):
+        if (date_from is None or row[2] >= date_from) and (date_to is None or row[2] < date_to):
+            yield row
+
+
+def iter_rows(customer_id, date_from=None, date_to=None):
+    """
+    Архивированные транзакции пользователя кортежами (id, amount, timestamp, description, sender_id, recipient_id)
+    в порядке (timestamp, id). date_from включительно, date_to не включительно
+    """
+    for path, _ in customer_files(customer_id, date_from, date_to):
+        yield from read_period(path, date_from, date_to)
+
+
+def history(queryset, customer_id, date_from=None, date_to=None):
+    """
+    История пользователя queryset с транзакциями архивированных месяцев периода (HistoryWithArchive)
+    или сам queryset, если в архиве за период у пользователя ничего нет. Файлы архива здесь не читаются
+    """
+    files = customer_files(customer_id, date_from, date_to)
+    if not files:
+        return queryset
+    return HistoryWithArchive(queryset, files, period=(date_from, date_to))
+
+
+def matches(row, condition):
+    """
+    Проверка транзакции row условием Q из сравнений полей (условия курсора в pagination.KeysetPagination)
+    """
+    results = []
+    for child in condition.children:
+        if isinstance(child, Q):
+            results.append(matches(row, child))
+            continue
+        lookup, value = child
+        name, _, operation = lookup.partition('__')
+        value = Transaction._meta.get_field(name).to_python(value)
+        results.append(LOOKUPS[operation or 'exact'](getattr(row, name), value))
+    result = all(results) if condition.connector == Q.AND else any(results)
+    return not result if condition.negated else result
+
+
+def required_comparisons(condition):
+    """
+    Сравнения (поле, операция, значение), обязательные для выполнения условия Q: дети верхнего уровня
+    условий, объединенных через AND
+    """
+    if condition.negated or (condition.connector != Q.AND and len(condition.children) > 1):
+        return []
+    comparisons = []
+    for child in condition.children:
+        if isinstance(child, Q):
+            comparisons += required_comparisons(child)
+            continue
+        lookup, value = child
+        name, _, operation = lookup.partition('__')
+        if name in BOUNDS:
+            comparisons.append((name, operation or 'exact', Transaction._meta.get_field(name).to_python(value)))
+    return comparisons
+
+
+def file_bounds(entry, field):
+    """
+    Наименьшее и наибольшее значения поля field в файле по записи индекса, (None, None) - если их нет
+    (индекс записан до появления границ поля)
+    """
+    low, high, parse = BOUNDS.get(field, (None, None, None))
+    if entry.get(low) is None or entry.get(high) is None:
+        return None, None
+    return parse(entry[low]), parse(entry[high])
+
+
+def may_match(entry, comparisons):
+    """
+    Может ли хоть одна строка файла выполнить сравнения comparisons по границам из индекса
+    """
+    for name, operation, value in comparisons:
+        low, high = file_bounds(entry, name)
+        if low is None:
+            continue
+        if (operation == 'gt' and high <= value or operation == 'gte' and high < value
+                or operation == 'lt' and low >= value or operation == 'lte' and low > value
+                or operation == 'exact' and not low <= value <= high):
+            return False
+    return True
+
+
+class HistoryWithArchive:
+    """
+    История пользователя из базы (queryset) и файлов архива (files - [(путь, запись индекса)], как
+    у customer_files) для пагинаторов: поддерживает count(), order_by(), filter(Q), values_list() и срезы.
+
+    Срез [a:b] читает из базы первые b строк и сливает их с архивными в порядке сортировки. Файлы архива
+    читаются по очереди в порядке границ поля сортировки из индекса и только пока их строки могут попасть
+    в срез: раньше b-й строки базы и с учетом условий курсора. count() берет число строк из индекса
+    и читает только файлы, частично попадающие в период
+    """
+
+    def __init__(self, queryset, files, ordering=None, conditions=(), fields=None, named=False, period=(None, None)):
+        self.queryset = queryset
+        self.files = files
+        self.ordering = list(ordering or queryset.query.order_by or Transaction._meta.ordering)
+        self.conditions = list(conditions)
+        self.fields = fields
+        self.named = named
+        self.period = period
+
+    def _clone(self, **changes):
+        params = {'queryset': self.queryset, 'files': self.files, 'ordering': self.ordering,
+                  'conditions': self.conditions, 'fields': self.fields, 'named': self.named, 'period': self.period}
+        return HistoryWithArchive(**{**params, **changes})
+
+    @property
+    def query(self):
+        return self.queryset.query
+
+    @property
+    def field(self):
+        return self.ordering[0].lstrip('-')
+
+    @property
+    def descending(self):
+        # направление у всех полей сортировки истории одинаковое (см. TransactionViewSet.order_queryset)
+        return self.ordering[0].startswith('-')
+
+    def key(self, row):
+        return tuple(getattr(row, field.lstrip('-')) for field in self.ordering)
+
+    def count(self):
+        archived = 0
+        comparisons = [comparison for condition in self.conditions for comparison in required_comparisons(condition)]
+        date_from, date_to = self.period
+        for path, entry in self.files:
+            if not may_match(entry, comparisons):
+                continue
+            inside = ((date_from is None or parse_datetime(entry['first']) >= date_from)
+                      and (date_to is None or parse_datetime(entry['last']) < date_to))
+            if inside and not self.conditions:
+                archived += entry['rows']
+            else:
+                archived += sum(1 for _ in self._read(path))
+        return self.queryset.count() + archived
+
+    def __len__(self):
+        return self.count()
+
+    def order_by(self, *ordering):
+        return self._clone(queryset=self.queryset.order_by(*ordering), ordering=ordering)
+
+    def filter(self, condition):
+        return self._clone(queryset=self.queryset.filter(condition), conditions=self.conditions + [condition])
+
+    def values_list(self, *fields, named=False):
+        """
+        Строки базы и архива кортежами полей fields. Сортировка и filter(Q) требуют named=True
+        """
+        return self._clone(queryset=self.queryset.values_list(*fields, named=named), fields=fields, named=named)
+
+    def _read(self, path):
+        """
+        Строки файла за период, выполняющие условия filter(Q)
+        """
+        for row in read_period(path, *self.period):
+            if all(matches(row, condition) for condition in self.conditions):
+                yield row
+
+    def _make(self, row):
+        if self.fields is None:
+            return Transaction(id=row.id, amount=row.amount, timestamp=row.timestamp, description=row.description,
+                               sender_id=row.sender_id, recipient_id=row.recipient_id)
+        values = [getattr(row, field) for field in self.fields]
+        return create_namedtuple_class(*self.fields)._make(values) if self.named else tuple(values)
+
+    def _before(self, value, bound):
+        """
+        Значение поля сортировки value идет в порядке сортировки раньше значения bound
+        """
+        return value > bound if self.descending else value < bound
+
+    def archived_rows(self, limit=None):
+        """
+        Строки архива в порядке сортировки. Файл читается, только когда граница его значений поля сортировки
+        достигнута; файлы, строки которых идут после limit (значение поля сортировки) или не выполняют
+        условия курсора, не читаются
+        """
+        comparisons = [comparison for condition in self.conditions for comparison in required_comparisons(condition)]
+        buffer, pending = [], []
+        for path, entry in self.files:
+            low, high = file_bounds(entry, self.field)
+            start = high if self.descending else low
+            if not may_match(entry, comparisons) or (limit is not None and start is not None
+                                                      and self._before(limit, start)):
+                continue
+            if start is None:
+                # в индексе нет границ поля сортировки: файл читается сразу
+                buffer = self._merge(buffer, path)
+            else:
+                pending.append((start, path))
+        pending.sort(key=operator.itemgetter(0), reverse=self.descending)
+
+        position = 0
+        while True:
+            while pending and (position == len(buffer)
+                               or not self._before(getattr(buffer[position], self.field), pending[0][0])):
+                buffer = self._merge(buffer[position:], pending.pop(0)[1])
+                position = 0
+            if position == len(buffer):
+                return
+            yield buffer[position]
+            position += 1
+
+    def _merge(self, rows, path):
+        """
+        Слияние отсортированных строк rows со строками файла path в порядке сортировки
+        """
+        return list(heapq.merge(rows, sorted(self._read(path), key=self.key, reverse=self.descending),
+                                key=self.key, reverse=self.descending))
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            return self[k:k + 1][0]
+        if k.stop is None:
+            primary = list(self.queryset)
+            limit = None
+        else:
+            primary = list(self.queryset[:k.stop])
+            # строки архива после последней строки базы в срез уже не попадут
+            limit = getattr(primary[-1], self.field) if len(primary) == k.stop else None
+        archived = (self._make(row) for row in self.archived_rows(limit))
+        rows = heapq.merge(primary, archived, key=self.key, reverse=self.descending)
+        return list(islice(rows, k.stop))[k]
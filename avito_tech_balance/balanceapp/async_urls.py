@@ -0,0 +1,12 @@
+from django.urls import path
+
+from .async_views import AsyncCustomerDetail, AsyncWithdrawDeposit, AsyncTransferView, AsyncTransactionList
+
+app_name = "balanceapp_async"
+
+urlpatterns = [
+    path('transfer/', AsyncTransferView.as_view(), name='transfer'),
+    path('customers/<int:pk>/', AsyncCustomerDetail.as_view(), name='customer-detail'),
+    path('customers/<int:customer_id>/operations/', AsyncWithdrawDeposit.as_view(), name='withdraw-deposit'),
+    path('customers/<int:customer_id>/transactions/', AsyncTransactionList.as_view(), name='transactions'),
+]
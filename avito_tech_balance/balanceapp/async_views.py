@@ -0,0 +1,218 @@
+"""
+Асинхронные версии основных эндпоинтов для запуска под ASGI-сервером (uvicorn).
+
+Ожидание базы и ЦБ РФ не занимает воркер: курсы валют запрашиваются через httpx,
+чтение - через асинхронный ORM Django, а операции с балансом (services.py) выполняются
+в потоке запроса через sync_to_async. Поэтому один процесс обслуживает много одновременных
+медленных запросов. Проверки и ответы - те же, что у синхронных представлений (views.py),
+тело запроса принимается только в JSON.
+"""
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage, Paginator
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import admission, archive, group_commit, rate_history, services
+from .customer_cache import get_customer_cache
+from .models import Customer, Transaction
+from .rates import RatesUnavailable
+from .serializers import CustomerSerializer, TransactionRowSerializer
+from .views import TransactionExportView, TransactionViewSet, TransferView, WithdrawDeposit, parse_customer_id
+
+NOT_FOUND = {"detail": "No Customer matches the given query."}
+
+
+def parse_body(request):
+    """
+    Тело запроса в JSON, возвращает (данные, None) или (None, ответ с ошибкой)
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError as exc:
+        return None, JsonResponse({"detail": f"JSON parse error - {exc}"}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(data, dict):
+        return None, JsonResponse({"error": "The request body must be an object"},
+                                  status=status.HTTP_400_BAD_REQUEST)
+    return data, None
+
+
+def admission_control(customers):
+    """
+    Контроль допуска POST-запроса (см. admission.py), как у views.AdmissionControlMixin:
+    customers(data, **kwargs) - id счетов, которые изменяет запрос с телом data
+    """
+    def decorator(post):
+        @wraps(post)
+        async def wrapper(self, request, **kwargs):
+            if admission.get_admission_control() is None:
+                return await post(self, request, **kwargs)
+            data, _ = parse_body(request)
+            try:
+                admitted = await admission.aadmit(request, customers(data or {}, **kwargs))
+            except admission.Rejected as exc:
+                return JsonResponse({"error": str(exc)}, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                                    headers={'Retry-After': str(exc.retry_after)})
+            try:
+                return await post(self, request, **kwargs)
+            finally:
+                await admitted.arelease()
+        return wrapper
+    return decorator
+
+
+class AsyncCustomerDetail(View):
+    """
+    Данные пользователя (pk, имя и баланс), баланс в валюте - ?currency=USD
+    GET запрос к http://127.0.0.1:8000/balance/async/customers/1/?currency=USD
+    """
+
+    async def get(self, request, pk):
+        customer_cache = get_customer_cache()
+        instance = await customer_cache.aget(pk)
+        if instance is None:
+            try:
+                instance = await Customer.objects.with_total_balance().aget(pk=pk)
+            except Customer.DoesNotExist:
+                return JsonResponse(NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+            await customer_cache.afill(instance)
+        data = CustomerSerializer(instance).data
+
+        currency = request.GET.get('currency')
+        if currency:
+            try:
+                value = await rate_history.acurrent_rate(currency)
+            except RatesUnavailable:
+                return JsonResponse({"error": "exchange rates are temporarily unavailable"},
+                                    status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            if value is None:
+                return JsonResponse({"error": "the currency was not found"}, status=status.HTTP_400_BAD_REQUEST)
+            # вычисляем баланс в валюте и переписываем обозначение валюты
+            data['balance'] = str(round(instance.total_balance / value, 2))
+            data['valute'] = currency
+        return JsonResponse(data, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')  # как у APIView: API без сессий и CSRF-токенов
+class AsyncWithdrawDeposit(View):
+    """
+    Зачисление/списание средств со счета пользователя
+    POST запрос к http://127.0.0.1:8000/balance/async/customers/1/operations/
+    Тело запроса - как у WithdrawDeposit
+    """
+
+    @admission_control(lambda data, customer_id: [customer_id])
+    async def post(self, request, customer_id):
+        data, error_response = parse_body(request)
+        if error_response is not None:
+            return error_response
+        error = WithdrawDeposit.validate(data)
+        if error is not None:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        change = group_commit.credit if data['operation'] == 'withdraw' else group_commit.debit
+        try:
+            # при групповой фиксации операции ждут пакет в разных потоках, а не по очереди в одном
+            await sync_to_async(change, thread_sensitive=not group_commit.enabled())(
+                customer_id, data['amount'], data.get('description'))
+        except Customer.DoesNotExist:
+            return JsonResponse(NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+        except services.InsufficientFunds:
+            return JsonResponse({"error": "There are not enough funds in the account"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({"OK": "The operation was successful"}, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncTransferView(View):
+    """
+    Перевод средств одного пользователя на счет другого пользователя
+    POST запрос к http://127.0.0.1:8000/balance/async/transfer/
+    Тело запроса - как у TransferView
+    """
+
+    @admission_control(TransferView.customer_ids)
+    async def post(self, request):
+        data, error_response = parse_body(request)
+        if error_response is not None:
+            return error_response
+        error = TransferView.validate(data)
+        if error is not None:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        sender_id, recipient_id = parse_customer_id(data['sender']), parse_customer_id(data['recipient'])
+        if sender_id is None or recipient_id is None:  # как get_object_or_404 для некорректных id
+            return JsonResponse(NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            result = await sync_to_async(services.transfer)(sender_id, recipient_id, data['amount'],
+                                                            data.get('description'))
+        except Customer.DoesNotExist:
+            return JsonResponse(NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+        except services.InsufficientFunds:
+            return JsonResponse({"error": "There are not enough funds in the account"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        response = JsonResponse({"OK": "The operation was successful"}, status=status.HTTP_200_OK)
+        # время ожидания блокировок строк пользователей, мс
+        response['Server-Timing'] = f'lock;dur={result.lock_wait * 1000:.2f}'
+        return response
+
+
+class AsyncTransactionList(View):
+    """
+    Список транзакций пользователя по страницам (?page=2), сортировка - ?order=-amount,
+    период - ?date_from=2024-07-01&date_to=2024-07-31
+    GET запрос к http://127.0.0.1:8000/balance/async/customers/1/transactions/?order=timestamp
+    Ответ - как у TransactionViewSet с навигацией по номеру страницы
+    """
+    page_size = api_settings.PAGE_SIZE
+
+    async def get(self, request, customer_id):
+        try:
+            period = (TransactionExportView.parse_bound(request.GET.get('date_from')),
+                      TransactionExportView.parse_bound(request.GET.get('date_to'), upper=True))
+        except ValueError:
+            return JsonResponse({"error": "Dates must be in ISO 8601 format"}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = TransactionViewSet.filter_period(Transaction.objects.for_customer(customer_id), *period)
+        queryset = await sync_to_async(archive.history)(queryset, customer_id, *period)
+        queryset = TransactionRowSerializer.rows(TransactionViewSet.order_queryset(queryset, request.GET.get('order')))
+        if isinstance(queryset, archive.HistoryWithArchive):
+            # история с архивом читается синхронно в отдельном потоке
+            count, fetch = sync_to_async(queryset.count), sync_to_async(queryset.__getitem__)
+        else:
+            count = queryset.acount  # подсчет без блокировки цикла событий
+
+            async def fetch(page_slice):
+                return [transaction async for transaction in queryset[page_slice]]
+
+        # номера страниц проверяются по числу строк, строки страницы читаются отдельно (fetch)
+        paginator = Paginator(range(await count()), self.page_size)
+        try:
+            page = paginator.page(request.GET.get('page', 1))
+        except InvalidPage:
+            return JsonResponse({"detail": "Invalid page."}, status=status.HTTP_404_NOT_FOUND)
+
+        offset = (page.number - 1) * self.page_size
+        rows = await fetch(slice(offset, offset + self.page_size))
+        url = request.build_absolute_uri()
+        return JsonResponse({
+            "count": paginator.count,
+            "next": replace_query_param(url, 'page', page.next_page_number()) if page.has_next() else None,
+            "previous": self.previous_link(url, page),
+            "results": TransactionRowSerializer.data(rows),
+        }, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def previous_link(url, page):
+        if not page.has_previous():
+            return None
+        if page.previous_page_number() == 1:
+            return remove_query_param(url, 'page')
+        return replace_query_param(url, 'page', page.previous_page_number())
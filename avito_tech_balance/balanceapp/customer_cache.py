@@ -0,0 +1,221 @@
+"""
+Кэш данных пользователей (имя, баланс) для чтения без обращения к базе.
+
+Два уровня: локальный LRU в памяти процесса (CUSTOMER_CACHE['LOCAL_SIZE'] записей, каждая живет
+LOCAL_TIMEOUT секунд) и необязательный общий кэш Django (CUSTOMER_CACHE['SHARED'], например Redis или Memcached),
+в котором записи живут SHARED_TIMEOUT секунд.
+
+Операции с балансом (services.py) изменяют Customer.version тем же запросом, что и баланс,
+и после фиксации транзакции записывают новые данные в оба уровня (write-through). Запись в кэш
+выполняется, только если ее версия новее сохраненной, поэтому запоздавшая запись или заполнение кэша
+прочитанными раньше данными не перезаписывают более новые. Изменение пользователя через ORM (например,
+имени через API) тоже увеличивает версию тем же UPDATE (Customer.save) и записывается в кэш так же. До фиксации
+запись в локальном уровне удаляется.
+
+Пользователи со слотами баланса (slots.py) не кэшируются.
+
+Кэш используется только для отображения данных пользователя. Проверка средств и изменение баланса
+всегда выполняются в базе под блокировкой строки, поэтому устаревшая запись не влияет на операции.
+Без общего уровня другой воркер может видеть старые данные не дольше LOCAL_TIMEOUT секунд.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import CUSTOMER_CACHE
+from .models import Customer
+
+KEY = 'balanceapp:customer:{}'
+
+
+class LocalTier:
+    """
+    LRU в памяти процесса: customer_id -> (срок годности, version, name, balance)
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, customer_id):
+        with self._lock:
+            entry = self._entries.get(customer_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[customer_id]
+                return None
+            self._entries.move_to_end(customer_id)
+            return entry[1:]
+
+    def put(self, customer_id, version, name, balance):
+        with self._lock:
+            current = self._entries.get(customer_id)
+            # запись с более новой версией не перезаписывается (устаревшая по времени - перезаписывается)
+            if current is not None and current[1] > version and current[0] >= time.monotonic():
+                return False
+            self._entries[customer_id] = (time.monotonic() + self.timeout, version, name, balance)
+            self._entries.move_to_end(customer_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            return True
+
+    def delete(self, customer_id):
+        with self._lock:
+            self._entries.pop(customer_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CustomerCache:
+    """
+    Двухуровневый кэш пользователей (см. описание модуля)
+    """
+
+    def __init__(self, local_size=10000, local_timeout=1.0, shared=None, shared_timeout=60):
+        self.local = LocalTier(local_size, local_timeout)
+        self.shared_alias = shared
+        self.shared_timeout = shared_timeout
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def get(self, customer_id):
+        """
+        Пользователь из кэша (несохраняемый экземпляр Customer) или None
+        """
+        customer_id = int(customer_id)
+        entry = self.local.get(customer_id)
+        CUSTOMER_CACHE.labels(tier='local', result='hit' if entry is not None else 'miss').inc()
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(KEY.format(customer_id))
+            CUSTOMER_CACHE.labels(tier='shared', result='hit' if entry is not None else 'miss').inc()
+            if entry is not None:
+                self.local.put(customer_id, *entry)
+        if entry is None:
+            return None
+        version, name, balance = entry
+        return Customer(id=customer_id, name=name, balance=balance, version=version)
+
+    async def aget(self, customer_id):
+        """
+        get для асинхронных представлений: обращение к общему уровню выполняется в потоке, не в цикле событий
+        """
+        if self.shared is None:
+            return self.get(customer_id)
+        return await sync_to_async(self.get)(customer_id)
+
+    def load(self, customer_id):
+        """
+        Пользователь из кэша, при промахе - из базы с заполнением кэша.
+        Если пользователя нет, выбрасывает Customer.DoesNotExist
+        """
+        customer = self.get(customer_id)
+        if customer is None:
+            customer = Customer.objects.with_total_balance().get(pk=customer_id)
+            self.fill(customer)
+        return customer
+
+    def fill(self, customer):
+        """
+        Заполнение кэша прочитанным из базы пользователем
+        """
+        # зачисления в слоты баланса (slots.py) не меняют версию, такие пользователи не кэшируются
+        if not customer.balance_slots:
+            self.put(customer.pk, customer.version, customer.name, customer.balance)
+
+    async def afill(self, customer):
+        if self.shared is None:
+            self.fill(customer)
+        else:
+            await sync_to_async(self.fill)(customer)
+
+    def put(self, customer_id, version, name, balance):
+        """
+        Сохранение данных пользователя в оба уровня, если версия не старше сохраненной
+        """
+        self.local.put(customer_id, version, name, balance)
+        if self.shared is not None:
+            key = KEY.format(customer_id)
+            current = self.shared.get(key)
+            # сравнение и запись не атомарны: гонка двух записей ограничена SHARED_TIMEOUT
+            if current is None or current[0] <= version:
+                self.shared.set(key, (version, name, balance), timeout=self.shared_timeout)
+
+    def invalidate(self, customer_ids):
+        for customer_id in customer_ids:
+            self.local.delete(int(customer_id))
+        if self.shared is not None:
+            self.shared.delete_many([KEY.format(customer_id) for customer_id in customer_ids])
+
+    def write_through(self, rows):
+        """
+        Новые данные пользователей после изменения баланса: rows - (id, balance, version, name).
+        Локальная запись удаляется сразу, новые данные записываются после фиксации транзакции
+        """
+        rows = list(rows)
+        for customer_id, *_ in rows:
+            self.local.delete(customer_id)
+
+        def save():
+            for customer_id, balance, version, name in rows:
+                self.put(customer_id, version, name, balance)
+        transaction.on_commit(save)
+
+
+@lru_cache(maxsize=None)
+def get_customer_cache():
+    """
+    Кэш пользователей, настроенный через settings.CUSTOMER_CACHE
+    """
+    config = getattr(settings, 'CUSTOMER_CACHE', {})
+    return CustomerCache(local_size=config.get('LOCAL_SIZE', 10000), local_timeout=config.get('LOCAL_TIMEOUT', 1.0),
+                         shared=config.get('SHARED'), shared_timeout=config.get('SHARED_TIMEOUT', 60))
+
+
+@receiver(setting_changed)
+def reset_customer_cache(setting, **kwargs):
+    if setting in ('CUSTOMER_CACHE', 'CACHES'):
+        get_customer_cache.cache_clear()
+
+
+@receiver(post_save, sender=Customer)
+def write_customer(sender, instance, created, **kwargs):
+    """
+    Изменение пользователя через ORM: запись новой версии (ее увеличивает Customer.save) в кэш после фиксации,
+    как у операций с балансом. Без новой версии заполнение кэша данными, прочитанными до изменения,
+    вернуло бы в общий уровень старое имя
+    """
+    if created:
+        return
+    customer_cache = get_customer_cache()
+    if instance.balance_slots:
+        # пользователи со слотами баланса не кэшируются
+        customer_cache.invalidate([instance.pk])
+    else:
+        customer_cache.write_through([(instance.pk, instance.balance, instance.version, instance.name)])
+
+
+@receiver(post_delete, sender=Customer)
+def invalidate_customer(sender, instance, **kwargs):
+    # запись удаляется сразу и еще раз после фиксации, чтобы не остались данные, прочитанные до фиксации
+    customer_cache = get_customer_cache()
+    customer_cache.invalidate([instance.pk])
+    transaction.on_commit(lambda: customer_cache.invalidate([instance.pk]))
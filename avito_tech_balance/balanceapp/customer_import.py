@@ -0,0 +1,222 @@
+"""
+Загрузка пользователей с начальными балансами из CSV (python manage.py import_customers и
+POST /balance/customers/import/).
+
+Файл - CSV в UTF-8 с заголовком name,balance; balance - неотрицательная сумма с точностью до копеек,
+пустой баланс - 0. Загрузка идет в три шага, каждый - в базе, без разбора строк в Python:
+
+1. Файл целиком потоком передается командой COPY в промежуточную таблицу balanceapp_customer_import_<id>
+   (UNLOGGED, все поля - текст) и проверяется одним UPDATE: в поле error строки записывается ошибка.
+   Шаг выполняется в одной транзакции: при ошибке формата файла промежуточной таблицы не остается.
+2. Если в файле есть ошибки, загрузка завершается со статусом invalid (или, с skip_invalid, строки
+   с ошибками пропускаются).
+3. Строки переносятся частями по batch_size: один запрос создает пользователей и транзакции начального
+   баланса (зачисление без отправителя), в той же транзакции обновляются итоги выписок (statements.py)
+   и номер последней перенесенной строки (CustomerImport.merged_line).
+
+Поэтому прерванная загрузка продолжается с первой неперенесенной части: повторный запуск с тем же
+файлом (та же контрольная сумма) находит незавершенную загрузку, строки не создаются дважды. Незавершенная
+загрузка файла - одна (частичное уникальное ограничение на checksum): одновременные запуски с тем же файлом
+продолжают одну загрузку.
+"""
+import hashlib
+
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .ledger import CUSTOMER_TABLE, TRANSACTION_TABLE
+from .models import CustomerImport
+from .statements import ADD_TRANSACTIONS_SQL, rollup_params
+
+BATCH_SIZE = 10000
+BLOCK_SIZE = 1 << 20
+DESCRIPTION = 'Opening balance'
+ERRORS_LIMIT = 20
+
+CREATE_STAGING_SQL = """
+    CREATE UNLOGGED TABLE {staging} (
+        line bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        name text,
+        balance text,
+        error text
+    )
+"""
+
+# HEADER MATCH: заголовок файла должен совпадать с именами полей
+COPY_SQL = """
+    COPY {staging} (name, balance) FROM STDIN WITH (FORMAT csv, HEADER MATCH, ENCODING 'UTF8')
+"""
+
+VALIDATE_SQL = """
+    UPDATE {staging} SET error = CASE
+        WHEN name IS NULL OR btrim(name) = '' THEN 'Name is required'
+        WHEN length(name) > 100 THEN 'Name is longer than 100 characters'
+        WHEN balance IS NOT NULL AND balance !~ '^[0-9]{{1,97}}(\\.[0-9]{{1,2}})?$'
+            THEN 'The balance must be non-negative number with at most 2 decimal places'
+    END
+"""
+
+COUNT_SQL = """
+    SELECT count(*), count(error) FROM {staging}
+"""
+
+ERRORS_SQL = """
+    SELECT line, error FROM {staging} WHERE error IS NOT NULL ORDER BY line LIMIT %s
+"""
+
+# перенос строк (after, until]: пользователи и транзакции начального баланса одним запросом
+MERGE_SQL = f"""
+    WITH batch AS (
+        SELECT line, name, COALESCE(balance, '0')::numeric(99, 2) AS balance FROM {{staging}}
+        WHERE line > %(after)s AND line <= %(until)s AND error IS NULL
+    ), created AS (
+        INSERT INTO {CUSTOMER_TABLE} (name, balance, version, balance_slots)
+        SELECT name, balance, 0, 0 FROM batch ORDER BY line
+        RETURNING id, balance
+    ), ledger AS (
+        INSERT INTO {TRANSACTION_TABLE} (amount, "timestamp", description, recipient_id, sender_id)
+        SELECT balance, %(timestamp)s, %(description)s, id, NULL FROM created WHERE balance > 0
+        RETURNING id
+    )
+    SELECT (SELECT count(*) FROM created), (SELECT COALESCE(array_agg(id), '{{{{}}}}') FROM ledger)
+"""
+
+DROP_STAGING_SQL = """
+    DROP TABLE IF EXISTS {staging}
+"""
+
+
+class ImportFailed(Exception):
+    """
+    Файл не удалось загрузить: неверный формат CSV или заголовок
+    """
+
+
+def staging_table(customer_import):
+    return f'balanceapp_customer_import_{customer_import.pk}'
+
+
+def checksum(file):
+    """
+    SHA-256 файла (открытого в двоичном режиме), после подсчета файл читается с начала
+    """
+    digest = hashlib.sha256()
+    while block := file.read(BLOCK_SIZE):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def describe_errors(customer_import, limit=ERRORS_LIMIT):
+    """
+    Первые limit ошибок в строках файла текстом, по строке на ошибку (номер строки - с учетом заголовка)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(ERRORS_SQL.format(staging=staging_table(customer_import)), [limit])
+        lines = [f'Line {line + 1}: {error}' for line, error in cursor.fetchall()]
+    if customer_import.invalid > limit:
+        lines.append(f'... {customer_import.invalid - limit} more')
+    return '\n'.join(lines)
+
+
+def load(customer_import, file, size=None, progress=None):
+    """
+    Шаг 1: COPY файла в промежуточную таблицу и проверка строк.
+    progress('load', прочитано байт, size) вызывается после каждого блока
+    """
+    staging = staging_table(customer_import)
+    read = 0
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # одновременный запуск с тем же файлом ждет окончания загрузки и не загружает файл повторно
+            locked = CustomerImport.objects.select_for_update().get(pk=customer_import.pk)
+            if locked.status != 'loading':
+                customer_import.status, customer_import.rows = locked.status, locked.rows
+                customer_import.invalid = locked.invalid
+                return
+            cursor.execute(DROP_STAGING_SQL.format(staging=staging))
+            cursor.execute(CREATE_STAGING_SQL.format(staging=staging))
+            with cursor.copy(COPY_SQL.format(staging=staging)) as copy:
+                while block := file.read(BLOCK_SIZE):
+                    copy.write(block)
+                    read += len(block)
+                    if progress is not None:
+                        progress('load', read, size)
+            cursor.execute(VALIDATE_SQL.format(staging=staging))
+            cursor.execute(COUNT_SQL.format(staging=staging))
+            customer_import.rows, customer_import.invalid = cursor.fetchone()
+            customer_import.status = 'merging'
+            customer_import.save(update_fields=['rows', 'invalid', 'status'])
+    except (DatabaseError, connection.Database.Error) as exc:  # ошибки COPY psycopg передает без обертки Django
+        customer_import.status, customer_import.error = 'invalid', str(exc).strip()
+        customer_import.finished = timezone.now()
+        customer_import.save(update_fields=['status', 'error', 'finished'])
+        raise ImportFailed(customer_import.error) from exc
+
+
+def merge(customer_import, batch_size=BATCH_SIZE, progress=None):
+    """
+    Шаг 3: перенос строк частями с места остановки.
+    progress('merge', перенесено строк, всего строк) вызывается после каждой части
+    """
+    staging = staging_table(customer_import)
+    while customer_import.merged_line < customer_import.rows:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # одновременный запуск с тем же файлом ждет блокировки и продолжает после этой части
+            locked = CustomerImport.objects.select_for_update().get(pk=customer_import.pk)
+            if locked.merged_line < locked.rows:
+                until = min(locked.merged_line + batch_size, locked.rows)
+                cursor.execute(MERGE_SQL.format(staging=staging), {
+                    'after': locked.merged_line, 'until': until, 'timestamp': timezone.now(),
+                    'description': DESCRIPTION})
+                created, ids = cursor.fetchone()
+                if ids:
+                    cursor.execute(ADD_TRANSACTIONS_SQL, {'ids': ids, **rollup_params()})
+                locked.merged_line, locked.customers = until, locked.customers + created
+                locked.save(update_fields=['merged_line', 'customers'])
+        customer_import.merged_line, customer_import.customers = locked.merged_line, locked.customers
+        if progress is not None:
+            progress('merge', customer_import.merged_line, customer_import.rows)
+
+
+def finish(customer_import, status):
+    """
+    Завершение загрузки: ошибки в строках сохраняются в CustomerImport.error, промежуточная таблица удаляется
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        locked = CustomerImport.objects.select_for_update().get(pk=customer_import.pk)
+        if locked.finished is None:  # загрузку могли завершить одновременным запуском
+            if locked.invalid:
+                locked.error = describe_errors(locked)
+            locked.status, locked.finished = status, timezone.now()
+            locked.save(update_fields=['status', 'error', 'finished'])
+            cursor.execute(DROP_STAGING_SQL.format(staging=staging_table(locked)))
+    customer_import.status, customer_import.finished = locked.status, locked.finished
+    customer_import.error = locked.error
+
+
+def import_customers(file, source='', skip_invalid=False, batch_size=BATCH_SIZE, size=None, progress=None):
+    """
+    Загрузка пользователей из CSV-файла file (открытого в двоичном режиме) или продолжение незавершенной
+    загрузки того же файла. Возвращает CustomerImport: status done - строки перенесены, invalid - в файле
+    есть ошибки и ничего не перенесено (при skip_invalid строки с ошибками пропускаются), первые ошибки -
+    в поле error. При неверном формате файла выбрасывает ImportFailed
+    """
+    digest = checksum(file)
+    customer_import = CustomerImport.objects.filter(checksum=digest, finished=None).first()
+    if customer_import is None:
+        try:
+            with transaction.atomic():
+                customer_import = CustomerImport.objects.create(source=source, checksum=digest)
+        except IntegrityError:
+            # загрузку того же файла одновременно начал другой запуск: продолжается она
+            customer_import = CustomerImport.objects.get(checksum=digest, finished=None)
+    if customer_import.status == 'loading':
+        load(customer_import, file, size, progress)
+    # при продолжении загрузки строки уже проверены
+    if customer_import.invalid and not skip_invalid and not customer_import.merged_line:
+        finish(customer_import, 'invalid')
+        return customer_import
+    merge(customer_import, batch_size, progress)
+    finish(customer_import, 'done')
+    return customer_import
@@ -0,0 +1,7 @@
+"""
+Бэкенд PostgreSQL с пулом соединений (psycopg 3 + psycopg_pool).
+
+Подключается в settings.DATABASES: 'ENGINE': 'balanceapp.db'. Параметры пула задаются
+в OPTIONS['pool'] (аргументы psycopg_pool.ConnectionPool: min_size, max_size, timeout, max_idle, ...),
+OPTIONS['pgbouncer'] = True включает режим совместимости с pgbouncer в режиме pool_mode = transaction.
+"""
@@ -0,0 +1,151 @@
+"""
+Соединения берутся из пула psycopg_pool, общего для всех потоков процесса, и возвращаются в него
+при закрытии соединения Django (в конце запроса при CONN_MAX_AGE = 0), поэтому запрос не тратит время
+на установку соединения с базой. Пул проверяет соединение перед выдачей (check_connection)
+и заменяет разорванные и слишком старые соединения.
+
+Соединения живут долго, поэтому часто выполняемые запросы (поиск пользователя, изменение баланса,
+запись в журнал) после OPTIONS['prepare_threshold'] выполнений становятся подготовленными на сервере
+(prepared statements) и не разбираются и не планируются заново. Для этого нужна передача параметров
+на стороне сервера (OPTIONS['server_side_binding'] = True).
+
+В режиме pgbouncer подготовленные запросы отключаются: в режиме pool_mode = transaction
+следующий запрос может попасть на другое соединение сервера, где такого запроса нет.
+"""
+import threading
+
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base, creation, operations
+from django.db.utils import DEFAULT_DB_ALIAS
+from django.utils.asyncio import async_unsafe
+from psycopg import IsolationLevel
+from psycopg_pool import ConnectionPool
+
+# предел числа параметров одного запроса в протоколе PostgreSQL
+MAX_QUERY_PARAMS = 65535
+
+POOL_DEFAULTS = {
+    'min_size': 2,
+    'max_size': 20,
+    'timeout': 10,  # сколько секунд запрос ждет свободное соединение
+}
+
+
+class DatabaseOperations(operations.DatabaseOperations):
+    def bulk_batch_size(self, fields, objs):
+        # при передаче параметров на стороне сервера bulk_create делится на запросы по MAX_QUERY_PARAMS параметров
+        if fields:
+            return max(MAX_QUERY_PARAMS // len(fields), 1)
+        return len(objs)
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """
+    Перед созданием и удалением тестовой базы пулы закрываются: их соединения мешают DROP DATABASE.
+    Закрываются пулы всех alias, в том числе зеркал (TEST['MIRROR']) этой базы
+    """
+
+    def _create_test_db(self, *args, **kwargs):
+        self.connection.close_pools(all_aliases=True)
+        return super()._create_test_db(*args, **kwargs)
+
+    def _destroy_test_db(self, *args, **kwargs):
+        self.connection.close_pools(all_aliases=True)
+        return super()._destroy_test_db(*args, **kwargs)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    ops_class = DatabaseOperations
+
+    # пулы процесса по (alias, имя базы): имя базы меняется при запуске тестов
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        if params.pop('pgbouncer', False):
+            params['prepare_threshold'] = None
+        return params
+
+    def get_pool(self):
+        """
+        Пул соединений с текущей базой (создается при первом обращении) или None, если пул не настроен
+        """
+        options = self.settings_dict['OPTIONS'].get('pool')
+        if not options or self.alias == NO_DB_ALIAS:
+            return None
+        params = self.get_connection_params()
+        key = (self.alias, params['dbname'])
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool_options = {**POOL_DEFAULTS, **(options if isinstance(options, dict) else {})}
+                pool = ConnectionPool(kwargs=params, open=False, name=f'{self.alias}:{params["dbname"]}',
+                                      check=ConnectionPool.check_connection, **pool_options)
+                pool.open()
+                self._pools[key] = pool
+        return pool
+
+    def close_pools(self, all_aliases=False):
+        """
+        Закрытие всех пулов этого alias (all_aliases - пулов всех alias процесса)
+        """
+        with self._pools_lock:
+            for key in [key for key in self._pools if all_aliases or key[0] == self.alias]:
+                self._pools.pop(key).close()
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool()
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = IsolationLevel(options.get('isolation_level', IsolationLevel.READ_COMMITTED))
+        connection = pool.getconn()
+        if 'isolation_level' in options:
+            connection.isolation_level = self.isolation_level
+        self._connection_pool = pool  # соединение возвращается в тот пул, из которого взято
+        return connection
+
+    def _close(self):
+        pool = getattr(self, '_connection_pool', None)
+        if self.connection is None or pool is None:
+            return super()._close()
+        self._connection_pool = None
+        with self.wrap_database_errors:
+            pool.putconn(self.connection)
+
+
+def pool_stats(alias=DEFAULT_DB_ALIAS):
+    """
+    Статистика пулов alias: размер, занятые соединения, насыщение (доля занятых от max_size),
+    число выдач соединений (checkouts), ожидание свободного соединения и ошибки
+    """
+    stats = {}
+    for (pool_alias, dbname), pool in list(DatabaseWrapper._pools.items()):
+        if pool_alias != alias:
+            continue
+        raw = pool.get_stats()
+        size, available = raw.get('pool_size', 0), raw.get('pool_available', 0)
+        checkouts = raw.get('requests_num', 0)
+        stats[dbname] = {
+            'min_size': pool.min_size,
+            'max_size': pool.max_size,
+            'size': size,
+            'in_use': size - available,
+            'saturation': round((size - available) / pool.max_size, 3),
+            'checkouts': checkouts,
+            'waiting': raw.get('requests_waiting', 0),
+            'queued': raw.get('requests_queued', 0),
+            'wait_ms_total': raw.get('requests_wait_ms', 0),
+            'wait_ms_avg': round(raw.get('requests_wait_ms', 0) / checkouts, 3) if checkouts else 0,
+            'timeouts': raw.get('requests_errors', 0),
+            'connections_opened': raw.get('connections_num', 0),
+            'connections_errors': raw.get('connections_errors', 0),
+            'connections_lost': raw.get('connections_lost', 0),
+            'returns_bad': raw.get('returns_bad', 0),
+        }
+    return stats
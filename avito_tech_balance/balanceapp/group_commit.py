@@ -0,0 +1,162 @@
+"""
+Групповая фиксация (group commit) одиночных зачислений и списаний.
+
+Включается настройкой GROUP_COMMIT['ENABLED']. Операции из одновременных запросов процесса собираются
+в очередь: первый запрос становится ведущим, ждет до GROUP_COMMIT['MAX_DELAY'] секунд (или пока
+не наберется MAX_SIZE операций) и применяет все собранные операции одной транзакцией через
+services.apply_batch: одна блокировка строк, один UPDATE ... FROM (VALUES ...) и один bulk_create журнала.
+Остальные запросы ждут результата своей операции, поэтому каждый получает свой ответ: успех,
+нет пользователя или недостаточно средств. Пока ведущий фиксирует пакет, следующий запрос
+уже собирает новый.
+
+Операции объединяются только внутри процесса, поэтому режим имеет смысл для многопоточных воркеров
+(gunicorn --threads) и ASGI. Внутри внешней транзакции операция выполняется сразу, без очереди:
+ее результат должен быть зафиксирован вместе с этой транзакцией.
+"""
+import copy
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+
+from . import services
+from .metrics import GROUP_COMMIT_SIZE
+from .models import Transaction
+
+
+class _Waiter:
+    """
+    Операция в очереди и ее результат
+    """
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.error = None
+        self.failure = None  # ошибка всего пакета, общая для всех его операций
+        self.lead = False  # запрос стал ведущим и должен собрать следующий пакет
+        self.done = threading.Event()
+
+
+class GroupCommit:
+    """
+    Очередь операций с фиксацией пакетами (см. описание модуля)
+    """
+
+    def __init__(self, max_delay=0.002, max_size=500):
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self._pending = []
+        self._leading = False  # пакет уже собирается ведущим
+        self._condition = threading.Condition()
+
+    def submit(self, entry):
+        """
+        Применение операции (несохраненная Transaction, как в services.apply_batch) в составе пакета.
+        Выбрасывает Customer.DoesNotExist или InsufficientFunds, как services.credit и services.debit
+        """
+        waiter = _Waiter(entry)
+        with self._condition:
+            self._pending.append(waiter)
+            if not self._leading:
+                self._leading = waiter.lead = True
+            elif len(self._pending) >= self.max_size:
+                self._condition.notify_all()
+        if not waiter.lead:
+            waiter.done.wait()
+        if waiter.lead:
+            self._lead()
+        if waiter.failure is not None:
+            raise _batch_error(waiter.failure) from waiter.failure
+        if waiter.error is not None:
+            raise waiter.error
+
+    def _lead(self):
+        deadline = time.monotonic() + self.max_delay
+        with self._condition:
+            while len(self._pending) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+            if self._pending:
+                # не поместившиеся в пакет операции собирает следующий ведущий
+                successor = self._pending[0]
+                successor.lead = True
+                successor.done.set()
+            else:
+                self._leading = False
+        self._commit(batch)
+
+    @staticmethod
+    def _commit(batch):
+        GROUP_COMMIT_SIZE.observe(len(batch))
+        try:
+            errors = services.apply_batch([waiter.entry for waiter in batch], atomic=False)
+        except Exception as exc:
+            # ошибка базы: ни одна операция пакета не применена
+            for waiter in batch:
+                waiter.failure = exc
+                waiter.done.set()
+            return
+        for waiter, error in zip(batch, errors):
+            waiter.error = error
+            waiter.done.set()
+
+
+def _batch_error(exc):
+    """
+    Новый экземпляр ошибки пакета для одного ожидающего запроса: при выбросе одного общего экземпляра
+    в нескольких потоках их трассировки перемешивались бы в его __traceback__
+    """
+    try:
+        return copy.copy(exc)
+    except Exception:
+        return RuntimeError(f'Group commit batch failed: {exc!r}')
+
+
+@lru_cache(maxsize=None)
+def get_group_commit():
+    """
+    Очередь групповой фиксации по settings.GROUP_COMMIT или None, если режим выключен
+    """
+    config = getattr(settings, 'GROUP_COMMIT', {})
+    if not config.get('ENABLED'):
+        return None
+    return GroupCommit(max_delay=config.get('MAX_DELAY', 0.002), max_size=config.get('MAX_SIZE', 500))
+
+
+@receiver(setting_changed)
+def reset_group_commit(setting, **kwargs):
+    if setting == 'GROUP_COMMIT':
+        get_group_commit.cache_clear()
+
+
+def enabled():
+    return get_group_commit() is not None
+
+
+def credit(customer_id, amount, description=None):
+    """
+    Зачисление средств: services.credit или операция в составе пакета
+    """
+    group_commit = get_group_commit()
+    if group_commit is None or connection.in_atomic_block:
+        services.credit(customer_id, amount, description)
+    else:
+        group_commit.submit(Transaction(amount=amount, description=description, recipient_id=int(customer_id)))
+
+
+def debit(customer_id, amount, description=None):
+    """
+    Списание средств: services.debit или операция в составе пакета
+    """
+    group_commit = get_group_commit()
+    if group_commit is None or connection.in_atomic_block:
+        services.debit(customer_id, amount, description)
+    else:
+        group_commit.submit(Transaction(amount=amount, description=description, sender_id=int(customer_id)))
@@ -0,0 +1,194 @@
+"""
+Баланс пользователя на произвольный момент времени.
+
+Журнал транзакций периодически сворачивается в снимки балансов (BalanceCheckpoint).
+Баланс на момент времени считается от ближайшего снимка и короткого диапазона транзакций
+между снимком и этим моментом, который читается по составным индексам (sender_id/recipient_id, timestamp, id),
+поэтому время ответа не зависит от длины истории пользователя.
+
+Снимок для пользователя, у которого еще нет снимков, считается в обратную сторону - от текущего
+баланса за вычетом транзакций после момента снимка, поэтому начальный баланс, заданный не через журнал,
+тоже учитывается.
+
+Перед переносом месяцев в архив (archive.py) на начало первого месяца, оставшегося в базе, делаются снимки
+всех пользователей с транзакциями в переносимых месяцах. Баланс на момент внутри архивированных месяцев
+считается назад от баланса на эту границу по транзакциям из файлов архива.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import archive, partitions
+from .models import BalanceCheckpoint, Customer, Transaction
+from .slots import TOTAL_BALANCE_SQL
+
+CUSTOMER_TABLE = Customer._meta.db_table
+TRANSACTION_TABLE = Transaction._meta.db_table
+CHECKPOINT_TABLE = BalanceCheckpoint._meta.db_table
+
+# дата транзакции назначается до записи в журнал, поэтому снимок делается с отставанием:
+# к этому времени все транзакции с датой не позже момента снимка уже зафиксированы
+CHECKPOINT_DELAY = timedelta(minutes=1)
+# ключ pg_advisory_xact_lock: снимки создает только один процесс одновременно
+CHECKPOINT_LOCK_ID = 0x62616c63
+
+# баланс пользователя {customer_id} на момент moment: от ближайшего предшествующего снимка вперед,
+# иначе от ближайшего последующего снимка или текущего баланса назад
+BALANCE_AS_OF_TEMPLATE = f"""
+    WITH anchor AS (
+        (SELECT 1 AS preference, "timestamp", balance FROM {CHECKPOINT_TABLE}
+         WHERE customer_id = {{customer_id}} AND "timestamp" <= %(moment)s
+         ORDER BY "timestamp" DESC LIMIT 1)
+        UNION ALL
+        (SELECT 2, "timestamp", balance FROM {CHECKPOINT_TABLE}
+         WHERE customer_id = {{customer_id}} AND "timestamp" > %(moment)s
+         ORDER BY "timestamp" LIMIT 1)
+        UNION ALL
+        SELECT 3, 'infinity', {TOTAL_BALANCE_SQL.format(customer='customer')} FROM {CUSTOMER_TABLE} AS customer
+        WHERE id = {{customer_id}}
+        ORDER BY preference LIMIT 1
+    )
+    SELECT anchor.balance + CASE WHEN anchor.preference = 1 THEN 1 ELSE -1 END * (
+        COALESCE((SELECT SUM(amount) FROM {TRANSACTION_TABLE}
+                  WHERE recipient_id = {{customer_id}}
+                  AND "timestamp" > LEAST(anchor."timestamp", %(moment)s)
+                  AND "timestamp" <= GREATEST(anchor."timestamp", %(moment)s)), 0)
+        - COALESCE((SELECT SUM(amount) FROM {TRANSACTION_TABLE}
+                    WHERE sender_id = {{customer_id}}
+                    AND "timestamp" > LEAST(anchor."timestamp", %(moment)s)
+                    AND "timestamp" <= GREATEST(anchor."timestamp", %(moment)s)), 0)
+    ) AS balance
+    FROM anchor
+"""
+
+BALANCE_AS_OF_SQL = BALANCE_AS_OF_TEMPLATE.format(customer_id='%(customer_id)s')
+
+# снимки на момент moment (начало первого месяца, остающегося в базе) для пользователей с транзакциями
+# раньше moment, которые переносятся в архив. Уже сделанные снимки на этот момент не меняются
+BOUNDARY_CHECKPOINTS_SQL = f"""
+    INSERT INTO {CHECKPOINT_TABLE} (customer_id, "timestamp", transaction_id, balance)
+    SELECT owner.id, %(moment)s, last_transaction.id, as_of.balance
+    FROM (
+        SELECT recipient_id AS id FROM {TRANSACTION_TABLE}
+        WHERE recipient_id IS NOT NULL AND "timestamp" < %(moment)s
+        UNION
+        SELECT sender_id FROM {TRANSACTION_TABLE}
+        WHERE sender_id IS NOT NULL AND "timestamp" < %(moment)s
+    ) AS owner
+    CROSS JOIN LATERAL ({BALANCE_AS_OF_TEMPLATE.format(customer_id='owner.id')}) AS as_of
+    LEFT JOIN LATERAL (
+        SELECT id FROM (
+            (SELECT "timestamp", id FROM {TRANSACTION_TABLE}
+             WHERE recipient_id = owner.id AND "timestamp" <= %(moment)s
+             ORDER BY "timestamp" DESC, id DESC LIMIT 1)
+            UNION ALL
+            (SELECT "timestamp", id FROM {TRANSACTION_TABLE}
+             WHERE sender_id = owner.id AND "timestamp" <= %(moment)s
+             ORDER BY "timestamp" DESC, id DESC LIMIT 1)
+        ) AS latest
+        ORDER BY "timestamp" DESC, id DESC LIMIT 1
+    ) AS last_transaction ON true
+    ON CONFLICT (customer_id, "timestamp") DO NOTHING
+"""
+
+# снимки на момент cutoff для пользователей, у которых были транзакции после предыдущего снимка (since),
+# и для пользователей без снимков. Читаются только транзакции с датой после since
+CREATE_CHECKPOINTS_SQL = f"""
+    WITH move AS (
+        SELECT recipient_id AS customer_id, amount, "timestamp", id FROM {TRANSACTION_TABLE}
+        WHERE recipient_id IS NOT NULL AND "timestamp" > %(since)s
+        UNION ALL
+        SELECT sender_id, 0 - amount, "timestamp", id FROM {TRANSACTION_TABLE}
+        WHERE sender_id IS NOT NULL AND "timestamp" > %(since)s
+    ), moves AS (
+        SELECT customer_id,
+               COALESCE(SUM(amount) FILTER (WHERE "timestamp" <= %(cutoff)s), 0) AS amount,
+               COALESCE(SUM(amount) FILTER (WHERE "timestamp" > %(cutoff)s), 0) AS later_amount,
+               (array_agg(id ORDER BY "timestamp" DESC, id DESC)
+                    FILTER (WHERE "timestamp" <= %(cutoff)s))[1] AS last_id
+        FROM move
+        GROUP BY customer_id
+    )
+    INSERT INTO {CHECKPOINT_TABLE} (customer_id, "timestamp", transaction_id, balance)
+    SELECT customer.id, %(cutoff)s,
+           COALESCE(moves.last_id, previous.transaction_id, last_transaction.id),
+           CASE WHEN previous.customer_id IS NULL
+                THEN {TOTAL_BALANCE_SQL.format(customer='customer')} - COALESCE(moves.later_amount, 0)
+                ELSE previous.balance + moves.amount END
+    FROM {CUSTOMER_TABLE} AS customer
+    LEFT JOIN moves ON moves.customer_id = customer.id
+    LEFT JOIN LATERAL (
+        SELECT customer_id, balance, transaction_id FROM {CHECKPOINT_TABLE}
+        WHERE customer_id = customer.id
+        ORDER BY "timestamp" DESC LIMIT 1
+    ) AS previous ON true
+    LEFT JOIN LATERAL (
+        -- последняя транзакция первого снимка, если она была до since
+        SELECT id FROM (
+            (SELECT "timestamp", id FROM {TRANSACTION_TABLE}
+             WHERE recipient_id = customer.id AND "timestamp" <= %(cutoff)s
+             ORDER BY "timestamp" DESC, id DESC LIMIT 1)
+            UNION ALL
+            (SELECT "timestamp", id FROM {TRANSACTION_TABLE}
+             WHERE sender_id = customer.id AND "timestamp" <= %(cutoff)s
+             ORDER BY "timestamp" DESC, id DESC LIMIT 1)
+        ) AS latest
+        WHERE previous.customer_id IS NULL AND moves.last_id IS NULL
+        ORDER BY "timestamp" DESC, id DESC LIMIT 1
+    ) AS last_transaction ON true
+    WHERE previous.customer_id IS NULL OR moves.last_id IS NOT NULL
+"""
+
+
+def balance_as_of(customer_id, moment):
+    """
+    Баланс пользователя с учетом всех транзакций с датой не позже moment.
+    Если пользователя нет, выбрасывает Customer.DoesNotExist
+    """
+    month = archive.first_stored_month()
+    boundary = partitions.month_start(month) if month is not None else None
+    archived = boundary is not None and moment < boundary
+    with connection.cursor() as cursor:
+        cursor.execute(BALANCE_AS_OF_SQL, {'customer_id': customer_id, 'moment': boundary if archived else moment})
+        row = cursor.fetchone()
+    if row is None:
+        raise Customer.DoesNotExist(f'Customer {customer_id} does not exist')
+    balance = row[0]
+    if archived:
+        # момент внутри архивированных месяцев: назад от границы по транзакциям архива после moment
+        for row in archive.iter_rows(customer_id, moment, boundary):
+            if row.timestamp > moment:
+                balance -= row.amount if row.recipient_id == int(customer_id) else 0
+                balance += row.amount if row.sender_id == int(customer_id) else 0
+    return balance
+
+
+def create_boundary_checkpoints(month):
+    """
+    Снимки на начало месяца month для пользователей с транзакциями раньше него - перед переносом
+    этих транзакций в архив (archive.py). Возвращает число созданных снимков
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CHECKPOINT_LOCK_ID])
+        cursor.execute(BOUNDARY_CHECKPOINTS_SQL, {'moment': partitions.month_start(month)})
+        return cursor.rowcount
+
+
+def create_checkpoints(cutoff=None):
+    """
+    Снимки балансов на момент cutoff (по умолчанию - текущее время минус CHECKPOINT_DELAY),
+    возвращает число созданных снимков. Снимок создается, только если с предыдущего у пользователя
+    были транзакции; cutoff должен быть позже предыдущего снимка, иначе ничего не создается
+    """
+    if cutoff is None:
+        cutoff = timezone.now() - CHECKPOINT_DELAY
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CHECKPOINT_LOCK_ID])
+        since = BalanceCheckpoint.objects.aggregate(since=Max('timestamp'))['since']
+        if since is not None and since >= cutoff:
+            return 0
+        # при первом запуске все снимки считаются назад от текущих балансов
+        cursor.execute(CREATE_CHECKPOINTS_SQL, {'since': since or cutoff, 'cutoff': cutoff})
+        return cursor.rowcount
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from balanceapp import archive
+
+
+class Command(BaseCommand):
+    """
+    Перенос старых месяцев журнала транзакций в архив на диске. Запускается периодически
+    (например, раз в месяц из cron): python manage.py archive_transactions
+    Архивация до определенного месяца: python manage.py archive_transactions --before 2024-01
+    """
+    help = 'Move monthly ledger partitions older than TRANSACTION_ARCHIVE["AFTER_MONTHS"] to compressed files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='archive months before YYYY-MM '
+                                             '(default: TRANSACTION_ARCHIVE["AFTER_MONTHS"] months ago)')
+
+    def handle(self, *args, before=None, **options):
+        if before is not None:
+            try:
+                before = datetime.strptime(before, '%Y-%m').date()
+            except ValueError:
+                raise CommandError(f'Invalid --before value: {before}')
+        else:
+            before = archive.archive_boundary()
+
+        archived = archive.archive_before(before)
+        for partition, rows in archived:
+            self.stdout.write(f'Archived {partition.month:%Y-%m}: {rows} row(s)')
+        self.stdout.write(f'Archived {len(archived)} month(s) before {before:%Y-%m}')
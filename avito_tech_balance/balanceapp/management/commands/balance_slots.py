@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from balanceapp import slots
+from balanceapp.models import Customer
+
+
+class Command(BaseCommand):
+    """
+    Включение слотов баланса для счета с частыми зачислениями: python manage.py balance_slots 1 --slots 16
+    Отключение (балансы слотов переносятся в основной баланс): python manage.py balance_slots 1 --slots 0
+    """
+    help = 'Spread the balance of a hot customer account over N slot rows (0 disables slots)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('customer', type=int)
+        parser.add_argument('--slots', type=int, required=True, dest='count', help='number of slot rows, 0 to disable')
+
+    def handle(self, *args, customer, count, **options):
+        if not 0 <= count <= 1024:
+            raise CommandError('--slots must be between 0 and 1024')
+        try:
+            updated = slots.set_slots(customer, count)
+        except Customer.DoesNotExist:
+            raise CommandError(f'Customer {customer} does not exist')
+        self.stdout.write(f'Customer {updated.pk} now has {updated.balance_slots} balance slot(s)')
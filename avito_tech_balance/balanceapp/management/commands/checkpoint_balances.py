@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from balanceapp import ledger
+
+
+class Command(BaseCommand):
+    """
+    Снимки балансов пользователей для запросов баланса на момент времени.
+    Запускается периодически (например, раз в час из cron): python manage.py checkpoint_balances
+    """
+    help = 'Snapshot customer balances into ledger checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cutoff', help='ISO 8601 moment of the snapshot '
+                                             '(default: now minus ledger.CHECKPOINT_DELAY)')
+
+    def handle(self, *args, cutoff=None, **options):
+        if cutoff is not None:
+            moment = parse_datetime(cutoff)
+            if moment is None:
+                raise CommandError(f'Invalid --cutoff value: {cutoff}')
+            cutoff = moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+        created = ledger.create_checkpoints(cutoff)
+        self.stdout.write(f'Created {created} checkpoint(s)')
@@ -0,0 +1,50 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from balanceapp import customer_import
+
+
+class Command(BaseCommand):
+    """
+    Загрузка пользователей с начальными балансами из CSV с заголовком name,balance:
+    python manage.py import_customers partner.csv
+    python manage.py import_customers partner.csv --skip-invalid --batch-size 50000 - без строк с ошибками.
+    Прерванная загрузка продолжается повторным запуском с тем же файлом
+    """
+    help = 'Import customers with opening balances from a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV file with header name,balance')
+        parser.add_argument('--skip-invalid', action='store_true', help='import valid rows if some rows are invalid')
+        parser.add_argument('--batch-size', type=int, default=customer_import.BATCH_SIZE,
+                            help=f'rows per transaction (default: {customer_import.BATCH_SIZE})')
+
+    def handle(self, *args, file, skip_invalid=False, batch_size=customer_import.BATCH_SIZE, verbosity=1,
+               **options):
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        def progress(stage, done, total):
+            if verbosity < 1:
+                return
+            if stage == 'load':
+                self.stderr.write(f'Loaded {done * 100 // (total or 1)}% of the file')
+            else:
+                self.stderr.write(f'Imported {done}/{total} rows')
+
+        try:
+            with open(file, 'rb') as source:
+                result = customer_import.import_customers(
+                    source, os.path.basename(file), skip_invalid, batch_size, os.fstat(source.fileno()).st_size,
+                    progress)
+        except OSError as exc:
+            raise CommandError(exc)
+        except customer_import.ImportFailed as exc:
+            raise CommandError(f'Invalid CSV file: {exc}')
+
+        if result.status == 'invalid':
+            raise CommandError(f'{result.invalid} invalid row(s), nothing imported:\n{result.error}')
+        if result.invalid:
+            self.stderr.write(f'Skipped {result.invalid} invalid row(s):\n{result.error}')
+        self.stdout.write(f'Import {result.pk}: created {result.customers} customer(s) from {result.rows} row(s)')
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from django.utils.module_loading import import_string
+
+from balanceapp import rate_history
+from balanceapp.rates import FETCH_ERRORS, FixtureSource
+
+
+class Command(BaseCommand):
+    """
+    Загрузка курсов ЦБ РФ в таблицу ExchangeRate с дня после последней загруженной даты.
+    Запускается периодически (например, раз в день из cron): python manage.py import_rates
+    Первая загрузка истории: python manage.py import_rates --since 2024-01-01
+    """
+    help = 'Import CBR daily exchange rates into the ExchangeRate table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='first date to import (default: the day after the last imported date)')
+        parser.add_argument('--until', help='last date to import (default: today)')
+        parser.add_argument('--offline', action='store_true',
+                            help='read rates from the bundled fixture feed instead of settings.RATES source')
+
+    def handle(self, *args, since=None, until=None, offline=False, **options):
+        bounds = {}
+        for name, value in (('since', since), ('until', until)):
+            if value is not None:
+                bounds[name] = parse_date(value)
+                if bounds[name] is None:
+                    raise CommandError(f'Invalid --{name} value: {value}')
+
+        if offline:
+            source = FixtureSource()
+        else:
+            source = import_string(settings.RATES['SOURCE'])(**settings.RATES.get('SOURCE_OPTIONS', {}))
+        try:
+            days, imported = rate_history.import_rates(source, **bounds)
+        except FETCH_ERRORS as exc:
+            raise CommandError(f'Failed to fetch exchange rates: {exc}')
+        self.stdout.write(f'Imported {imported} rate(s) for {days} day(s)')
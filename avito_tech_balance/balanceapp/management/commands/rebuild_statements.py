@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from balanceapp import statements
+
+
+class Command(BaseCommand):
+    """
+    Пересчет итогов для выписок по журналу транзакций, например после переноса данных
+    в журнал в обход API: python manage.py rebuild_statements [--customer 1 --customer 2]
+    """
+    help = 'Rebuild daily and monthly statement rollups from the transaction ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer', type=int, action='append', dest='customers',
+                            help='Rebuild only this customer (can be repeated)')
+
+    def handle(self, *args, customers=None, **options):
+        rows = statements.rebuild(customers)
+        self.stdout.write(f'Rebuilt {rows} statement rollup(s)')
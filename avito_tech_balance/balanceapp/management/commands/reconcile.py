@@ -0,0 +1,53 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from balanceapp import reconcile
+
+
+class Command(BaseCommand):
+    """
+    Сверка балансов пользователей с журналом транзакций. Запускается периодически (например, раз в час из cron):
+    python manage.py reconcile - пользователи с транзакциями после предыдущей сверки,
+    python manage.py reconcile --full --workers 8 --report discrepancies.csv - все пользователи.
+    Расхождения (id, баланс, ожидаемый баланс, разница) выводятся в CSV, при расхождениях код завершения - 1
+    """
+    help = 'Check customer balances against the transaction ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='check all customers, not only changed ones')
+        parser.add_argument('--workers', type=int, help='worker processes (default: RECONCILIATION["WORKERS"])')
+        parser.add_argument('--chunk-size', type=int,
+                            help='customer ids per worker task (default: RECONCILIATION["CHUNK_SIZE"])')
+        parser.add_argument('--report', help='CSV file for discrepancies (default: stdout)')
+
+    def handle(self, *args, full=False, workers=None, chunk_size=None, report=None, verbosity=1, **options):
+        if workers is not None and workers < 1:
+            raise CommandError('--workers must be positive')
+        if chunk_size is not None and chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        def progress(low, high, checked):
+            if verbosity > 1:
+                self.stderr.write(f'Customers {low}-{high - 1}: checked {checked}')
+
+        reconciliation, discrepancies = reconcile.run(full, workers, chunk_size, progress)
+        if discrepancies or report:
+            file = open(report, 'w', newline='') if report else self.stdout
+            try:
+                writer = csv.writer(file)
+                writer.writerow(['customer_id', 'balance', 'expected', 'difference'])
+                writer.writerows((customer_id, balance, expected, balance - expected)
+                                 for customer_id, balance, expected in discrepancies)
+            finally:
+                if report:
+                    file.close()
+
+        elapsed = (reconciliation.finished - reconciliation.started).total_seconds()
+        summary = (f'{"Full" if reconciliation.full else "Incremental"} reconciliation: checked '
+                   f'{reconciliation.customers} customer(s) in {elapsed:.1f}s, '
+                   f'{reconciliation.discrepancies} discrepancy(ies)')
+        # при выводе отчета в stdout итог - в stderr, чтобы не смешивать его с CSV
+        (self.stderr if discrepancies and not report else self.stdout).write(summary)
+        if discrepancies:
+            raise CommandError(f'{len(discrepancies)} balance(s) do not match the ledger')
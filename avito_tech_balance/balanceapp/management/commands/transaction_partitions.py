@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from balanceapp import partitions
+
+
+class Command(BaseCommand):
+    """
+    Месячные секции журнала транзакций. Запускается периодически (например, раз в день из cron):
+    python manage.py transaction_partitions
+    Отсоединение старых секций для архивации: python manage.py transaction_partitions --detach-before 2024-01
+    или по TRANSACTION_PARTITIONS['RETENTION_MONTHS']: python manage.py transaction_partitions --retention
+    """
+    help = 'Create upcoming monthly partitions of the transaction ledger and detach old ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, help='months ahead to create partitions for '
+                                                      '(default: TRANSACTION_PARTITIONS["MONTHS_AHEAD"])')
+        parser.add_argument('--detach-before', help='detach partitions of months before YYYY-MM')
+        parser.add_argument('--retention', action='store_true',
+                            help='detach partitions older than TRANSACTION_PARTITIONS["RETENTION_MONTHS"]')
+        parser.add_argument('--list', action='store_true', dest='show', help='list attached partitions')
+
+    def handle(self, *args, ahead=None, detach_before=None, retention=False, show=False, **options):
+        if ahead is not None and ahead < 0:
+            raise CommandError('--ahead must not be negative')
+        if detach_before is not None:
+            try:
+                before = datetime.strptime(detach_before, '%Y-%m').date()
+            except ValueError:
+                raise CommandError(f'Invalid --detach-before value: {detach_before}')
+        elif retention:
+            before = partitions.retention_boundary()
+            if before is None:
+                raise CommandError('TRANSACTION_PARTITIONS["RETENTION_MONTHS"] is not set')
+        else:
+            before = None
+
+        created = partitions.ensure_partitions(ahead)
+        self.stdout.write(f'Created {len(created)} partition(s)')
+        if before is not None:
+            detached = partitions.detach_partitions(before)
+            for partition in detached:
+                self.stdout.write(f'Detached {partition.name}')
+            self.stdout.write(f'Detached {len(detached)} partition(s) before {before:%Y-%m}')
+        if show:
+            for partition in partitions.list_partitions():
+                self.stdout.write(f'{partition.name}\t{partition.month:%Y-%m}' if partition.month
+                                  else f'{partition.name}\tDEFAULT')
@@ -0,0 +1,202 @@
+"""
+Метрики приложения в текстовом формате Prometheus (GET /metrics).
+
+Для каждого маршрута (view_name и HTTP-метод) записываются время ответа, число SQL-запросов и время
+в базе, а также ожидание блокировок строк пользователей (services.py). Для курсов ЦБ - время запросов
+к источнику и попадания в кэш таблицы курсов, для пула соединений - его состояние на момент сбора.
+
+Метрики - объекты prometheus_client в реестре REGISTRY в памяти процесса, запись - несколько операций
+под блокировкой, поэтому сбор можно не отключать под нагрузкой. Каждый воркер отдает свои значения;
+при нескольких воркерах Prometheus должен опрашивать каждый из них.
+"""
+import contextvars
+import time
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from .db.base import pool_stats
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# счетчики текущего запроса: число SQL-запросов, время в базе и ожидание блокировок
+request_costs = contextvars.ContextVar('request_costs', default=None)
+
+# реестр приложения: без метрик процесса и платформы из реестра prometheus_client по умолчанию
+REGISTRY = CollectorRegistry()
+
+REQUESTS = Counter('http_requests_total', 'Запросы по маршрутам и кодам ответа', ('route', 'method', 'status'),
+                   registry=REGISTRY)
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Время ответа', ('route', 'method'),
+                            buckets=LATENCY_BUCKETS, registry=REGISTRY)
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'Число SQL-запросов на запрос', ('route', 'method'),
+                            buckets=COUNT_BUCKETS, registry=REGISTRY)
+REQUEST_DB_TIME = Histogram('http_request_db_duration_seconds', 'Время SQL-запросов на запрос', ('route', 'method'),
+                            buckets=LATENCY_BUCKETS, registry=REGISTRY)
+REQUEST_LOCK_WAIT = Histogram('http_request_lock_wait_seconds', 'Ожидание блокировок строк на запрос',
+                              ('route', 'method'), buckets=LATENCY_BUCKETS, registry=REGISTRY)
+LOCK_WAIT = Histogram('balance_lock_wait_seconds', 'Ожидание блокировок строк пользователей', ('operation',),
+                      buckets=LATENCY_BUCKETS, registry=REGISTRY)
+RATES_FETCH = Histogram('cbr_fetch_duration_seconds', 'Время загрузки таблицы курсов', ('source', 'result'),
+                        buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10), registry=REGISTRY)
+RATES_CACHE = Counter('rates_cache_requests_total', 'Обращения к таблице курсов: hit, stale (устарела) или miss',
+                      ('result',), registry=REGISTRY)
+
+CUSTOMER_CACHE = Counter('customer_cache_requests_total', 'Обращения к кэшу пользователей по уровням: hit или miss',
+                         ('tier', 'result'), registry=REGISTRY)
+DB_READS = Counter('db_reads_total', 'Чтения по базам: основная (default) или реплика', ('database',),
+                   registry=REGISTRY)
+ADMISSION_REJECTED = Counter('admission_rejected_total',
+                             'Записи, не допущенные контролем допуска: client, customer или in_flight', ('reason',),
+                             registry=REGISTRY)
+GROUP_COMMIT_SIZE = Histogram('group_commit_batch_size', 'Число операций в пакете групповой фиксации',
+                              buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000), registry=REGISTRY)
+
+# состояние пулов соединений (balanceapp.db): имя метрики, тип, поле pool_stats, множитель
+POOL_METRICS = [
+    ('db_pool_size', 'gauge', 'size', 1),
+    ('db_pool_max_size', 'gauge', 'max_size', 1),
+    ('db_pool_in_use', 'gauge', 'in_use', 1),
+    ('db_pool_saturation', 'gauge', 'saturation', 1),
+    ('db_pool_waiting', 'gauge', 'waiting', 1),
+    ('db_pool_checkouts_total', 'counter', 'checkouts', 1),
+    ('db_pool_wait_seconds_total', 'counter', 'wait_ms_total', 0.001),
+    ('db_pool_timeouts_total', 'counter', 'timeouts', 1),
+    ('db_pool_connection_errors_total', 'counter', 'connections_errors', 1),
+]
+
+
+class PoolCollector(Collector):
+    """
+    Состояние пулов соединений на момент сбора метрик
+    """
+
+    def collect(self):
+        pools = pool_stats()
+        for name, metric_type, field, scale in POOL_METRICS:
+            family = (GaugeMetricFamily if metric_type == 'gauge' else CounterMetricFamily)(
+                name, f'Пул соединений: {field}', labels=('database',))
+            for database, stats in sorted(pools.items()):
+                family.add_metric((database,), stats[field] * scale)
+            yield family
+
+
+REGISTRY.register(PoolCollector())
+
+
+def record_lock_wait(operation, seconds):
+    """
+    Ожидание блокировок строк пользователей операцией operation (в том числе в счет текущего запроса)
+    """
+    LOCK_WAIT.labels(operation=operation).observe(seconds)
+    costs = request_costs.get()
+    if costs is not None:
+        costs['lock_wait'] += seconds
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL (connection.execute_wrapper): число запросов и время в базе текущего запроса
+    """
+    costs = request_costs.get()
+    if costs is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        costs['queries'] += 1
+        costs['db_time'] += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def start_request():
+    """
+    Начало учета запроса, возвращает токен для finish_request
+    """
+    return request_costs.set({'queries': 0, 'db_time': 0.0, 'lock_wait': 0.0}), time.perf_counter()
+
+
+def finish_request(state, request, response):
+    """
+    Конец учета запроса. Тело потокового ответа (StreamingHttpResponse) формируется уже после выхода
+    из middleware: его SQL-запросы учитываются при чтении тела, а время ответа записывается при закрытии ответа
+    """
+    token, started = state
+    costs = request_costs.get()
+    request_costs.reset(token)
+
+    match = getattr(request, 'resolver_match', None)
+    # маршрут, а не путь: иначе каждый id пользователя стал бы отдельной серией
+    labels = {'route': match.view_name if match is not None else 'unmatched', 'method': request.method}
+    REQUESTS.labels(status=response.status_code, **labels).inc()
+
+    def observe():
+        REQUEST_LATENCY.labels(**labels).observe(time.perf_counter() - started)
+        REQUEST_QUERIES.labels(**labels).observe(costs['queries'])
+        REQUEST_DB_TIME.labels(**labels).observe(costs['db_time'])
+        REQUEST_LOCK_WAIT.labels(**labels).observe(costs['lock_wait'])
+
+    if not response.streaming:
+        observe()
+    elif response.is_async:
+        response.streaming_content = _measure_async(response.streaming_content, observe)
+    else:
+        response.streaming_content = MeasuredContent(response.streaming_content, costs, observe)
+
+
+class MeasuredContent:
+    """
+    Тело потокового ответа: SQL-запросы при его чтении относятся к запросу, on_close вызывается один раз -
+    после последнего фрагмента или при закрытии ответа (клиент отключился)
+    """
+
+    def __init__(self, content, costs, on_close):
+        self.iterator = iter(content)
+        self.costs = costs
+        self.on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = request_costs.set(self.costs)
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            request_costs.reset(token)
+
+    def close(self):
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+
+async def _measure_async(content, on_close):
+    # асинхронное тело: время ответа записывается после последнего фрагмента
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        on_close()
+
+
+def render():
+    """
+    Все метрики в текстовом формате Prometheus
+    """
+    return generate_latest(REGISTRY).decode('utf-8')
@@ -0,0 +1,35 @@
+"""
+Промежуточные обработчики (middleware) приложения
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+
+class MetricsMiddleware:
+    """
+    Время ответа, число SQL-запросов, время в базе и ожидание блокировок по маршрутам (см. metrics.py).
+    Подключается первым в MIDDLEWARE, чтобы учитывать и время остальных обработчиков
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = metrics.start_request()
+        response = self.get_response(request)
+        metrics.finish_request(state, request, response)
+        return response
+
+    async def __acall__(self, request):
+        state = metrics.start_request()
+        response = await self.get_response(request)
+        metrics.finish_request(state, request, response)
+        return response
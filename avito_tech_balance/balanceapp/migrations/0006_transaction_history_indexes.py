@@ -0,0 +1,51 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:15
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индексы строятся без блокировки записи в журнал транзакций
+    atomic = False
+
+    dependencies = [
+        ('balanceapp', '0005_alter_transaction_recipient_alter_transaction_sender'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['sender', 'id'], name='tx_sender_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['sender', 'timestamp', 'id'], name='tx_sender_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['sender', 'amount', 'id'], name='tx_sender_amount_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['recipient', 'id'], name='tx_recipient_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['recipient', 'timestamp', 'id'], name='tx_recipient_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['recipient', 'amount', 'id'], name='tx_recipient_amount_idx'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='recipient',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='received_transactions', to='balanceapp.customer'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='sender',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sent_transactions', to='balanceapp.customer'),
+        ),
+    ]
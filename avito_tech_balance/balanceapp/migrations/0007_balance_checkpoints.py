@@ -0,0 +1,37 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:20
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индекс журнала транзакций строится без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('balanceapp', '0006_transaction_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('transaction_id', models.BigIntegerField(blank=True, null=True)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=99)),
+                ('customer', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='balanceapp.customer')),
+            ],
+            options={
+                'ordering': ['customer', 'timestamp'],
+                'indexes': [models.Index(fields=['timestamp'], name='checkpoint_time_idx')],
+                'constraints': [models.UniqueConstraint(fields=('customer', 'timestamp'), name='checkpoint_customer_time_uniq')],
+            },
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['timestamp'], name='tx_timestamp_brin'),
+        ),
+    ]
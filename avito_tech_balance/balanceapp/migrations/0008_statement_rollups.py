@@ -0,0 +1,34 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balanceapp', '0007_balance_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'day'), ('month', 'month')], max_length=5)),
+                ('start', models.DateField()),
+                ('inflow', models.DecimalField(decimal_places=2, default=0, max_digits=99)),
+                ('outflow', models.DecimalField(decimal_places=2, default=0, max_digits=99)),
+                ('inflow_count', models.IntegerField(default=0)),
+                ('outflow_count', models.IntegerField(default=0)),
+                ('customer', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='statements', to='balanceapp.customer')),
+            ],
+            options={
+                'ordering': ['customer', 'period', 'start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='statementrollup',
+            constraint=models.UniqueConstraint(fields=('customer', 'period', 'start'), name='rollup_customer_period_uniq'),
+        ),
+    ]
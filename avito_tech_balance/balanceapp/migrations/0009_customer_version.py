@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balanceapp', '0008_statement_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balanceapp', '0010_exchange_rates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=99)),
+            ],
+            options={
+                'ordering': ['customer', 'slot'],
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='statementrollup',
+            options={'ordering': ['customer', 'period', 'start', 'slot']},
+        ),
+        migrations.RemoveConstraint(
+            model_name='statementrollup',
+            name='rollup_customer_period_uniq',
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='balance_slots',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statementrollup',
+            name='slot',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='statementrollup',
+            constraint=models.UniqueConstraint(fields=('customer', 'period', 'start', 'slot'), name='rollup_customer_period_uniq'),
+        ),
+        migrations.AddField(
+            model_name='balanceslot',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='balanceapp.customer'),
+        ),
+        migrations.AddConstraint(
+            model_name='balanceslot',
+            constraint=models.UniqueConstraint(fields=('customer', 'slot'), name='balance_slot_customer_slot_uniq'),
+        ),
+    ]
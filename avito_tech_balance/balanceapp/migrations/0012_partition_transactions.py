@@ -0,0 +1,113 @@
+"""
+Секционирование журнала транзакций по месяцам (см. balanceapp/partitions.py).
+
+Таблица пересоздается как секционированная с теми же столбцами, индексами и внешними ключами, существующие
+транзакции копируются в секции своих месяцев, последовательность id продолжает прежнюю. Состояние моделей
+Django не меняется. Миграция копирует весь журнал под блокировкой таблицы: на большой базе ее нужно
+применять в окно обслуживания. Откат собирает все присоединенные секции обратно в обычную таблицу.
+"""
+from datetime import date, datetime, time
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+TABLE = 'balanceapp_transaction'
+OLD_TABLE = 'balanceapp_transaction_old'
+
+INDEXES = [
+    ('tx_sender_id_idx', 'btree (sender_id, id)'),
+    ('tx_sender_time_idx', 'btree (sender_id, "timestamp", id)'),
+    ('tx_sender_amount_idx', 'btree (sender_id, amount, id)'),
+    ('tx_recipient_id_idx', 'btree (recipient_id, id)'),
+    ('tx_recipient_time_idx', 'btree (recipient_id, "timestamp", id)'),
+    ('tx_recipient_amount_idx', 'btree (recipient_id, amount, id)'),
+    ('tx_timestamp_brin', 'brin ("timestamp")'),
+]
+
+FOREIGN_KEYS = [
+    ('balanceapp_transacti_recipient_id_327b5bb3_fk_balanceap', 'recipient_id'),
+    ('balanceapp_transacti_sender_id_cfa0067b_fk_balanceap', 'sender_id'),
+]
+
+COLUMNS = 'id, amount, "timestamp", description, recipient_id, sender_id'
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE {table} (
+        id bigint GENERATED BY DEFAULT AS IDENTITY,
+        amount numeric(99, 2) NOT NULL,
+        "timestamp" timestamp with time zone NOT NULL,
+        description varchar(150),
+        recipient_id bigint,
+        sender_id bigint,
+        CONSTRAINT {table}_pkey PRIMARY KEY ({key})
+    ) {partitioning}
+"""
+
+
+def rename_old_table(schema_editor, name):
+    """
+    Переименование текущей таблицы журнала в name: ее индексы и последовательность освобождают имена
+    """
+    schema_editor.execute(f'ALTER TABLE {TABLE} RENAME TO {name}')
+    schema_editor.execute(f'ALTER TABLE {name} DROP CONSTRAINT {TABLE}_pkey')
+    for index, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX {index}')
+    schema_editor.execute(f'ALTER SEQUENCE {TABLE}_id_seq RENAME TO {name}_id_seq')
+
+
+def create_table(schema_editor, partitioned):
+    key, partitioning = ('id, "timestamp"', 'PARTITION BY RANGE ("timestamp")') if partitioned else ('id', '')
+    schema_editor.execute(CREATE_TABLE_SQL.format(table=TABLE, key=key, partitioning=partitioning))
+    for index, definition in INDEXES:
+        schema_editor.execute(f'CREATE INDEX {index} ON {TABLE} USING {definition}')
+    for constraint, column in FOREIGN_KEYS:
+        schema_editor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) '
+                              f'REFERENCES balanceapp_customer (id) DEFERRABLE INITIALLY DEFERRED')
+
+
+def copy_rows(schema_editor, source):
+    """
+    Копирование транзакций из source и продолжение ее последовательности id
+    """
+    schema_editor.execute(f'INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {source}')
+    schema_editor.execute(f"""
+        SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), last_value, is_called) FROM {source}_id_seq
+    """)
+    schema_editor.execute(f'DROP TABLE {source}')
+
+
+def partition(apps, schema_editor):
+    rename_old_table(schema_editor, OLD_TABLE)
+    create_table(schema_editor, partitioned=True)
+    schema_editor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+    # секции месяцев существующих транзакций, следующие создаются после migrate (partitions.ensure_partitions)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"""SELECT DISTINCT date_trunc('month', "timestamp" AT TIME ZONE %s)::date FROM {OLD_TABLE}""",
+                       [settings.TIME_ZONE])
+        months = sorted(month for month, in cursor.fetchall())
+    for month in months:
+        following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        start, end = (timezone.make_aware(datetime.combine(day, time.min)) for day in (month, following))
+        schema_editor.execute(f"CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} "
+                              f"FOR VALUES FROM ('{start.isoformat(' ')}') TO ('{end.isoformat(' ')}')")
+    copy_rows(schema_editor, OLD_TABLE)
+
+
+def unpartition(apps, schema_editor):
+    # отсоединенные секции (partitions.detach_partitions) остаются отдельными таблицами
+    rename_old_table(schema_editor, OLD_TABLE)
+    create_table(schema_editor, partitioned=False)
+    copy_rows(schema_editor, OLD_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balanceapp', '0011_balance_slots'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
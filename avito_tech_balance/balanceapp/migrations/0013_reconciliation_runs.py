@@ -0,0 +1,28 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balanceapp', '0012_partition_transactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('last_transaction_id', models.BigIntegerField(blank=True, null=True)),
+                ('customers', models.BigIntegerField(default=0)),
+                ('discrepancies', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['started'],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balanceapp', '0013_reconciliation_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('source', models.CharField(blank=True, max_length=255)),
+                ('checksum', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('loading', 'loading'), ('merging', 'merging'), ('done', 'done'), ('invalid', 'invalid')], default='loading', max_length=8)),
+                ('rows', models.BigIntegerField(default=0)),
+                ('invalid', models.BigIntegerField(default=0)),
+                ('merged_line', models.BigIntegerField(default=0)),
+                ('customers', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['created'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('finished', None)), fields=('checksum',),
+                                                        name='customer_import_unfinished_uniq')],
+            },
+        ),
+    ]
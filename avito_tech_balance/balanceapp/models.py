@@ -1,14 +1,118 @@
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 
 
+class CustomerQuerySet(models.QuerySet):
+    def with_total_balance(self):
+        """
+        Пользователи с суммой слотов баланса (slots_balance) для Customer.total_balance без отдельного запроса.
+        Слоты читаются только у пользователей, у которых они включены
+        """
+        slots = BalanceSlot.objects.filter(customer=models.OuterRef('pk')).order_by().values('customer')
+        return self.annotate(slots_balance=models.Case(models.When(
+            balance_slots__gt=0, then=models.Subquery(slots.annotate(total=models.Sum('balance')).values('total')))))
+
+
 class Customer(models.Model):
     """
     Модель пользователя (для создания schema.sql)
     """
+    objects = CustomerQuerySet.as_manager()
+
     class Meta:
         ordering = ['id']
     name = models.CharField(max_length=100, blank=False)
     balance = models.DecimalField(max_digits=99, decimal_places=2, blank=False, null=False, default=0)
+    # увеличивается при каждом изменении баланса, по нему кэш пользователей (customer_cache.py) отбрасывает старые данные
+    version = models.BigIntegerField(default=0)
+    # число слотов баланса (BalanceSlot) у счета с частыми зачислениями, 0 - весь баланс в поле balance
+    balance_slots = models.PositiveSmallIntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        # сохранение прочитанного раньше экземпляра не должно возвращать версию назад, поэтому она увеличивается
+        # в базе тем же UPDATE (version = version + 1), а новое значение перечитывается для кэша пользователей.
+        # Если update_fields содержит version, версию задает вызывающий код (slots.py)
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding or (update_fields is not None and (not update_fields or 'version' in update_fields)):
+            return super().save(*args, **kwargs)
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        kwargs['update_fields'] = {*update_fields, 'version'}
+        self.version = models.F('version') + 1
+        super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        updated = super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        # новая версия перечитывается до сигнала post_save, по которому данные записываются в кэш
+        if updated and isinstance(self.version, models.Expression):
+            self.refresh_from_db(using=using, fields=['name', 'balance', 'version', 'balance_slots'])
+        return updated
+
+    @property
+    def total_balance(self):
+        """
+        Баланс пользователя: поле balance и сумма слотов (см. slots.py)
+        """
+        if not self.balance_slots:
+            return self.balance
+        slots_balance = getattr(self, 'slots_balance', None)
+        if slots_balance is None:
+            slots_balance = self.slots.aggregate(total=models.Sum('balance'))['total']
+        return self.balance + (slots_balance or 0)
+
+
+class BalanceSlot(models.Model):
+    """
+    Часть баланса пользователя с включенными слотами (Customer.balance_slots).
+    Зачисления распределяются по слотам, чтобы не блокировать одну строку пользователя (см. slots.py)
+    """
+    class Meta:
+        ordering = ['customer', 'slot']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'slot'], name='balance_slot_customer_slot_uniq'),
+        ]
+    # индекс внешнего ключа заменен уникальным ограничением (customer, slot)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False, related_name='slots')
+    slot = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=99, decimal_places=2, default=0)
+
+
+class TransactionQuerySet(models.QuerySet):
+    def for_customer(self, customer_id):
+        """
+        Транзакции пользователя (отправленные и полученные) в виде UNION ALL двух выборок.
+        При срезе (странице) каждая выборка сортируется и ограничивается отдельно, поэтому читается
+        по своему составному индексу уже в нужном порядке, и сортируются только первые строки обеих выборок
+        """
+        sent = self.filter(sender=customer_id).order_by()
+        # перевод самому себе попадает только в первую выборку
+        received = self.filter(recipient=customer_id).exclude(sender=customer_id).order_by()
+        return sent.union(received, all=True).order_by(*self.model._meta.ordering)
+
+    def filter(self, *args, **kwargs):
+        """
+        Для UNION условие применяется к каждой выборке (например, условие курсора при навигации),
+        чтобы оно попадало в условие сканирования индекса
+        """
+        if self.query.combinator != 'union':
+            return super().filter(*args, **kwargs)
+        clone = self._chain()
+        clone.query.combined_queries = tuple(
+            models.QuerySet(self.model, query=query.chain()).filter(*args, **kwargs).query
+            for query in self.query.combined_queries
+        )
+        return clone
+
+    def __getitem__(self, k):
+        result = super().__getitem__(k)
+        if (isinstance(k, slice) and k.stop is not None and isinstance(result, TransactionQuerySet)
+                and result.query.combinator == 'union'):
+            # строки среза могут прийти из любой выборки, поэтому каждой достаточно первых k.stop строк
+            for query in result.query.combined_queries:
+                query.clear_ordering(force=True)
+                query.add_ordering(*result.query.order_by)
+                query.set_limits(high=k.stop)
+        return result
 
 
 class Transaction(models.Model):
@@ -17,13 +121,126 @@ class Transaction(models.Model):
     """
     class Meta:
         ordering = ['id']
+        # составные индексы под выборки истории пользователя для каждой сортировки (см. for_customer)
+        indexes = [
+            models.Index(fields=['sender', 'id'], name='tx_sender_id_idx'),
+            models.Index(fields=['sender', 'timestamp', 'id'], name='tx_sender_time_idx'),
+            models.Index(fields=['sender', 'amount', 'id'], name='tx_sender_amount_idx'),
+            models.Index(fields=['recipient', 'id'], name='tx_recipient_id_idx'),
+            models.Index(fields=['recipient', 'timestamp', 'id'], name='tx_recipient_time_idx'),
+            models.Index(fields=['recipient', 'amount', 'id'], name='tx_recipient_amount_idx'),
+            # журнал пишется в порядке времени, поэтому BRIN-индекс почти ничего не весит
+            # и позволяет читать только транзакции за интервал (см. ledger.create_checkpoints)
+            BrinIndex(fields=['timestamp'], name='tx_timestamp_brin'),
+        ]
     amount = models.DecimalField(max_digits=99, decimal_places=2)
     timestamp = models.DateTimeField(auto_now=True)
     description = models.CharField(max_length=150, blank=True, null=True)
-    sender = models.ForeignKey(Customer, on_delete=models.CASCADE, blank=True, null=True,
+    # одиночные индексы внешних ключей заменены составными индексами из Meta.indexes
+    sender = models.ForeignKey(Customer, on_delete=models.CASCADE, blank=True, null=True, db_index=False,
                                related_name='sent_transactions')  # отправитель
-    recipient = models.ForeignKey(Customer, on_delete=models.CASCADE, blank=True, null=True,
+    recipient = models.ForeignKey(Customer, on_delete=models.CASCADE, blank=True, null=True, db_index=False,
                                   related_name='received_transactions')  # получатель
 
-# python manage.py sqlmigrate balanceapp > schema.sql
+    objects = TransactionQuerySet.as_manager()
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Снимок баланса пользователя на момент timestamp: учтены все транзакции с датой не позже timestamp,
+    transaction - последняя из них (в порядке даты и id)
+    """
+    class Meta:
+        ordering = ['customer', 'timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='checkpoint_time_idx'),  # время последнего снимка
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'timestamp'], name='checkpoint_customer_time_uniq'),
+        ]
+    # индекс внешнего ключа заменен уникальным ограничением (customer, timestamp)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False, related_name='checkpoints')
+    timestamp = models.DateTimeField()
+    transaction_id = models.BigIntegerField(blank=True, null=True)
+    balance = models.DecimalField(max_digits=99, decimal_places=2)
+
 
+class StatementRollup(models.Model):
+    """
+    Итоги движения средств пользователя за день или месяц (period), начинающийся с даты start.
+    Обновляются вместе с записью транзакций в журнал (см. statements.py). У пользователя со слотами баланса
+    итоги периода разделены на строки по слотам (slot), у остальных slot = 0
+    """
+    PERIODS = [('day', 'day'), ('month', 'month')]
+
+    class Meta:
+        ordering = ['customer', 'period', 'start', 'slot']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'period', 'start', 'slot'], name='rollup_customer_period_uniq'),
+        ]
+    # индекс внешнего ключа заменен уникальным ограничением (customer, period, start, slot)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False, related_name='statements')
+    period = models.CharField(max_length=5, choices=PERIODS)
+    start = models.DateField()
+    slot = models.PositiveSmallIntegerField(default=0)
+    inflow = models.DecimalField(max_digits=99, decimal_places=2, default=0)  # зачисления
+    outflow = models.DecimalField(max_digits=99, decimal_places=2, default=0)  # списания
+    inflow_count = models.IntegerField(default=0)
+    outflow_count = models.IntegerField(default=0)
+
+
+class ExchangeRate(models.Model):
+    """
+    Курс валюты ЦБ РФ на дату: рублей за одну единицу валюты (Value / Nominal).
+    Загружается командой python manage.py import_rates (см. rate_history.py)
+    """
+    class Meta:
+        ordering = ['code', 'date']
+        constraints = [
+            # индекс (code, date) - поиск курса на дату: последний курс не позже даты
+            models.UniqueConstraint(fields=['code', 'date'], name='exchange_rate_code_date_uniq'),
+        ]
+    code = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=20, decimal_places=8)
+
+
+class ReconciliationRun(models.Model):
+    """
+    Запуск сверки балансов с журналом транзакций (см. reconcile.py). Следующий запуск без --full проверяет только
+    пользователей с транзакциями после last_transaction_id
+    """
+    class Meta:
+        ordering = ['started']
+    started = models.DateTimeField()
+    finished = models.DateTimeField(blank=True, null=True)  # None - запуск не завершился
+    full = models.BooleanField(default=False)  # проверялись все пользователи
+    last_transaction_id = models.BigIntegerField(blank=True, null=True)
+    customers = models.BigIntegerField(default=0)  # проверено пользователей
+    discrepancies = models.BigIntegerField(default=0)
+
+
+class CustomerImport(models.Model):
+    """
+    Загрузка пользователей с начальными балансами из CSV (см. customer_import.py). Незавершенная загрузка
+    того же файла (с той же контрольной суммой) продолжается с места остановки
+    """
+    STATUSES = [('loading', 'loading'), ('merging', 'merging'), ('done', 'done'), ('invalid', 'invalid')]
+
+    class Meta:
+        ordering = ['created']
+        constraints = [
+            # незавершенная загрузка файла - одна
+            models.UniqueConstraint(fields=['checksum'], condition=models.Q(finished=None),
+                                    name='customer_import_unfinished_uniq'),
+        ]
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    source = models.CharField(max_length=255, blank=True)  # имя файла
+    checksum = models.CharField(max_length=64)  # SHA-256 файла
+    status = models.CharField(max_length=8, choices=STATUSES, default='loading')
+    rows = models.BigIntegerField(default=0)  # строк в файле
+    invalid = models.BigIntegerField(default=0)  # строк с ошибками
+    merged_line = models.BigIntegerField(default=0)  # строки файла до этой включительно перенесены
+    customers = models.BigIntegerField(default=0)  # создано пользователей
+    error = models.TextField(blank=True)  # ошибка формата файла
@@ -0,0 +1,145 @@
+"""
+Постраничная навигация по курсору (keyset pagination).
+
+Вместо OFFSET страница начинается с позиции последней строки предыдущей страницы -
+пары (значение поля сортировки, id), поэтому стоимость страницы не зависит от того,
+насколько далеко пролистал клиент.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Навигация по курсору для queryset, отсортированного по одному полю (id добавляется для однозначности).
+    ?cursor=<курсор> - позиция страницы, ?count=false - не считать общее число строк
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        self.field = ordering[0].lstrip('-')
+        self.model_field = queryset.query.model._meta.get_field(self.field)
+        self.descending = ordering[0].startswith('-')
+
+        position = self.decode_cursor(request)
+        reverse = position is not None and position['reverse']
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, 'true').lower() not in ('false', '0'):
+            self.count = queryset.count()
+
+        queryset = queryset.order_by(*self.get_ordering(reverse))
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_condition(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:  # страница "назад" выбирается в обратном порядке
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+
+        self.page = rows
+        return rows
+
+    def get_ordering(self, reverse=False):
+        descending = self.descending != reverse
+        fields = [self.field, 'id'] if self.field != 'id' else ['id']
+        return ['-' + field if descending else field for field in fields]
+
+    def get_seek_condition(self, position, reverse=False):
+        """
+        Условие "строго после позиции" в порядке сортировки.
+        Избыточное условие field >= value позволяет базе начать сканирование индекса сразу с позиции
+        """
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        if self.field == 'id':
+            return Q(**{f'id__{lookup}': position['id']})
+        return (Q(**{f'{self.field}__{lookup}e': position['value']}) &
+                (Q(**{f'{self.field}__{lookup}': position['value']}) | Q(**{f'id__{lookup}': position['id']})))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            return {'value': self.parse_value(position.get('value')), 'id': int(position['id']),
+                    'reverse': bool(position['reverse'])}
+        except (BinasciiError, UnicodeError, ValueError, TypeError, KeyError, AttributeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def parse_value(self, value):
+        """
+        Значение поля сортировки из курсора в типе поля. Без значения (или с подмененным) курсор некорректен
+        """
+        if self.field == 'id':
+            return None
+        if value is None:
+            raise ValueError('Cursor has no value')
+        value = self.model_field.to_python(value)
+        if value is None:
+            raise ValueError('Cursor has no value')
+        if isinstance(value, datetime) and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def encode_cursor(self, row, reverse):
+        # row - экземпляр модели или строка values_list(named=True)
+        value = getattr(row, self.field)
+        position = {'value': value.isoformat() if hasattr(value, 'isoformat') else str(value),
+                    'id': row.id, 'reverse': reverse}
+        encoded = urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True, 'example': 123},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
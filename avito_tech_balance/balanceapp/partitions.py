@@ -0,0 +1,224 @@
+"""
+Журнал транзакций, разбитый на месячные секции по времени транзакции (PARTITION BY RANGE ("timestamp")).
+
+Таблица balanceapp_transaction секционирована миграцией 0012: секция balanceapp_transaction_pГГГГММ хранит
+транзакции за месяц (границы - начало месяца в settings.TIME_ZONE), секция balanceapp_transaction_default -
+транзакции, для месяца которых секции еще нет. Первичный ключ - (id, "timestamp"): уникальный ключ
+секционированной таблицы должен содержать ключ секционирования, id по-прежнему выдает одна последовательность.
+
+Запросы с условием на время (история с date_from и date_to, выгрузка, баланс на момент времени, снимки
+балансов) читают только секции нужных месяцев (partition pruning).
+
+Секции на TRANSACTION_PARTITIONS['MONTHS_AHEAD'] месяцев вперед создаются после migrate и командой
+python manage.py transaction_partitions (ее нужно запускать хотя бы раз в месяц, например из cron).
+Если в секцию по умолчанию уже попали транзакции, при создании секции их месяца они переносятся в нее.
+
+Старые секции отсоединяются (DETACH PARTITION) командой transaction_partitions --detach-before ГГГГ-ММ
+или по TRANSACTION_PARTITIONS['RETENTION_MONTHS']: отсоединенная секция остается отдельной таблицей
+с прежним именем, ее выгружает в архив на диске и удаляет archive.py. Ее транзакции читаются из архива
+(история, выгрузка, баланс на момент времени), снимки балансов (ledger.py) и итоги выписок (statements.py)
+хранятся отдельно и не меняются.
+"""
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import Transaction
+
+PARENT_TABLE = Transaction._meta.db_table
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+PARTITION_RE = re.compile(rf'^{PARENT_TABLE}_p(\d{{4}})(\d{{2}})$')
+
+# секции таблицы (в том числе секция по умолчанию) и их границы
+PARTITIONS_SQL = """
+    SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+    FROM pg_inherits
+    JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = %s AND parent.relnamespace = 'public'::regnamespace
+    ORDER BY child.relname
+"""
+
+# отсоединенные секции: таблицы с именами секций, не входящие в секционированную таблицу
+DETACHED_PARTITIONS_SQL = """
+    SELECT relname FROM pg_class
+    WHERE relkind = 'r' AND NOT relispartition AND relnamespace = 'public'::regnamespace AND relname LIKE %s
+"""
+
+# месяцы транзакций, попавших в секцию по умолчанию
+DEFAULT_MONTHS_SQL = f"""
+    SELECT DISTINCT date_trunc('month', "timestamp" AT TIME ZONE %s)::date FROM {DEFAULT_PARTITION}
+"""
+
+CREATE_PARTITION_SQL = """
+    CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+"""
+
+# перенос транзакций месяца из секции по умолчанию в новую (еще не присоединенную) секцию
+MOVE_FROM_DEFAULT_SQL = """
+    WITH moved AS (
+        DELETE FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s
+        RETURNING *
+    )
+    INSERT INTO {name} SELECT * FROM moved
+"""
+
+ATTACH_PARTITION_SQL = """
+    ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')
+"""
+
+DETACH_PARTITION_SQL = """
+    ALTER TABLE {parent} DETACH PARTITION {name}
+"""
+
+
+@dataclass
+class Partition:
+    """
+    Секция журнала: month - первый день месяца (None для секции по умолчанию)
+    """
+    name: str
+    month: date = None
+
+    @property
+    def start(self):
+        return month_start(self.month) if self.month else None
+
+    @property
+    def end(self):
+        return month_start(add_months(self.month, 1)) if self.month else None
+
+
+def get_config():
+    return {'MONTHS_AHEAD': 3, 'RETENTION_MONTHS': None, **getattr(settings, 'TRANSACTION_PARTITIONS', {})}
+
+
+def add_months(month, count):
+    """
+    Первый день месяца, отстоящего от month на count месяцев
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(month):
+    """
+    Начало месяца month в settings.TIME_ZONE
+    """
+    return timezone.make_aware(datetime.combine(month.replace(day=1), time.min))
+
+
+def partition_name(month):
+    return f'{PARENT_TABLE}_p{month:%Y%m}'
+
+
+def list_partitions(using='default'):
+    """
+    Присоединенные секции журнала по порядку месяцев, секция по умолчанию - последней
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, [PARENT_TABLE])
+        rows = cursor.fetchall()
+    partitions, default = [], []
+    for name, bound in rows:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions.append(Partition(name, date(int(match[1]), int(match[2]), 1)))
+        elif bound == 'DEFAULT':
+            default.append(Partition(name))
+    return sorted(partitions, key=lambda partition: partition.month) + default
+
+
+def detached_partitions(using='default'):
+    """
+    Отсоединенные и еще не удаленные секции журнала по порядку месяцев
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(DETACHED_PARTITIONS_SQL, [f'{PARENT_TABLE}\\_p%'])
+        names = [name for name, in cursor.fetchall()]
+    detached = []
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            detached.append(Partition(name, date(int(match[1]), int(match[2]), 1)))
+    return sorted(detached, key=lambda partition: partition.month)
+
+
+def create_partition(month, using='default'):
+    """
+    Создание секции месяца month с переносом его транзакций из секции по умолчанию.
+    Возвращает False, если секция уже есть
+    """
+    month = month.replace(day=1)
+    name = partition_name(month)
+    start, end = month_start(month), month_start(add_months(month, 1))
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+        if cursor.fetchone()[0]:
+            return False
+        # новые транзакции этого месяца не должны попасть в секцию по умолчанию до присоединения
+        cursor.execute(f'LOCK TABLE {DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE')
+        cursor.execute(CREATE_PARTITION_SQL.format(name=name, parent=PARENT_TABLE))
+        cursor.execute(MOVE_FROM_DEFAULT_SQL.format(default=DEFAULT_PARTITION, name=name), [start, end])
+        cursor.execute(ATTACH_PARTITION_SQL.format(parent=PARENT_TABLE, name=name,
+                                                   start=start.isoformat(' '), end=end.isoformat(' ')))
+    return True
+
+
+def ensure_partitions(months_ahead=None, using='default'):
+    """
+    Секции с текущего месяца на months_ahead (по умолчанию TRANSACTION_PARTITIONS['MONTHS_AHEAD']) месяцев вперед
+    и секции месяцев транзакций из секции по умолчанию. Возвращает имена созданных секций
+    """
+    if months_ahead is None:
+        months_ahead = get_config()['MONTHS_AHEAD']
+    current = timezone.localdate().replace(day=1)
+    with connections[using].cursor() as cursor:
+        cursor.execute(DEFAULT_MONTHS_SQL, [settings.TIME_ZONE])
+        months = {month for month, in cursor.fetchall()}
+    months.update(add_months(current, count) for count in range(months_ahead + 1))
+    return [partition_name(month) for month in sorted(months) if create_partition(month, using)]
+
+
+def detach_partitions(before, using='default'):
+    """
+    Отсоединение секций месяцев раньше before (первый день месяца). Возвращает отсоединенные секции
+    """
+    before = before.replace(day=1)
+    detached = []
+    for partition in list_partitions(using):
+        if partition.month is None or partition.month >= before:
+            continue
+        with connections[using].cursor() as cursor:
+            cursor.execute(DETACH_PARTITION_SQL.format(parent=PARENT_TABLE, name=partition.name))
+        detached.append(partition)
+    return detached
+
+
+def retention_boundary():
+    """
+    Первый месяц, секции которого хранятся по TRANSACTION_PARTITIONS['RETENTION_MONTHS'] (None - хранятся все)
+    """
+    retention = get_config()['RETENTION_MONTHS']
+    if retention is None:
+        return None
+    return add_months(timezone.localdate().replace(day=1), -retention)
+
+
+def create_after_migrate(using='default', **kwargs):
+    """
+    Обработчик post_migrate: секции на TRANSACTION_PARTITIONS['MONTHS_AHEAD'] месяцев вперед
+    """
+    if not router.allow_migrate_model(using, Transaction):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [DEFAULT_PARTITION])
+        partitioned = cursor.fetchone()[0]
+    # до миграции 0012 (например, при откате) таблица не секционирована
+    if partitioned:
+        ensure_partitions(using=using)
@@ -0,0 +1,106 @@
+"""
+История курсов ЦБ РФ (таблица ExchangeRate) и пересчет сумм в валюту по курсу на дату.
+
+Курсы загружаются командой python manage.py import_rates: с дня после последней загруженной даты
+по текущий день. Курсом на дату считается последний курс, установленный не позже этой даты
+(ЦБ не устанавливает курсы на выходные и праздники).
+
+Для страницы списка курсы на все даты ее строк читаются одним запросом по индексу (code, date).
+Текущий курс (current_rate) - курс на сегодня из истории, а пока он не загружен - от поставщика курсов
+(rates.py); оба источника хранят курс за единицу валюты.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connections, router
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ExchangeRate
+from .rates import get_rate_provider
+
+RATE_TABLE = ExchangeRate._meta.db_table
+
+# последний курс не позже каждой из дат
+RATES_FOR_DAYS_SQL = f"""
+    SELECT day, (SELECT rate FROM {RATE_TABLE}
+                 WHERE code = %(code)s AND date <= day
+                 ORDER BY date DESC LIMIT 1)
+    FROM unnest(%(days)s::date[]) AS day
+"""
+
+
+def import_rates(source, since=None, until=None):
+    """
+    Загрузка курсов за дни с since по until включительно (по умолчанию - с дня после последней
+    загруженной даты по текущий день). Возвращает (число дней с новыми курсами, число курсов)
+    """
+    until = until or timezone.localdate()
+    if since is None:
+        last = ExchangeRate.objects.aggregate(last=Max('date'))['last']
+        since = last + timedelta(days=1) if last is not None else until
+
+    imported_days, imported = set(), 0
+    day = since
+    while day <= until:
+        result = source.fetch_daily(day)
+        day += timedelta(days=1)
+        if result is None:
+            continue
+        rate_date, rates = result
+        # в выходные источник отдает курсы предыдущего рабочего дня: они уже загружены
+        if rate_date in imported_days or ExchangeRate.objects.filter(date=rate_date).exists():
+            continue
+        ExchangeRate.objects.bulk_create(
+            [ExchangeRate(code=code, date=rate_date, rate=rate) for code, rate in rates.items()],
+            ignore_conflicts=True)
+        imported_days.add(rate_date)
+        imported += len(rates)
+    return len(imported_days), imported
+
+
+def rates_for_days(code, days):
+    """
+    Курсы валюты code на даты days: {дата: курс или None, если курса не позже этой даты нет}
+    """
+    days = sorted(set(days))
+    if not days:
+        return {}
+    with connections[router.db_for_read(ExchangeRate)].cursor() as cursor:
+        cursor.execute(RATES_FOR_DAYS_SQL, {'code': code, 'days': days})
+        return dict(cursor.fetchall())
+
+
+def current_rate(code):
+    """
+    Текущий курс валюты code за единицу или None, если такой валюты нет.
+    Выбрасывает RatesUnavailable, если курса на сегодня нет в истории, а ЦБ недоступен
+    """
+    rate = ExchangeRate.objects.filter(code=code, date=timezone.localdate()).values_list('rate', flat=True).first()
+    if rate is None:
+        rate = get_rate_provider().get_rate(code)
+    return rate
+
+
+async def acurrent_rate(code):
+    """
+    current_rate для асинхронных представлений
+    """
+    rate = await ExchangeRate.objects.filter(code=code, date=timezone.localdate()).values_list(
+        'rate', flat=True).afirst()
+    if rate is None:
+        rate = await get_rate_provider().aget_rate(code)
+    return rate
+
+
+def has_currency(code):
+    return ExchangeRate.objects.filter(code=code).exists()
+
+
+def convert(amount, rate):
+    """
+    Сумма в рублях в валюте по курсу rate, строка с двумя знаками после запятой (None, если курса нет)
+    """
+    if rate is None:
+        return None
+    return str(round(Decimal(amount) / rate, 2))
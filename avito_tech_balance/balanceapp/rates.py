@@ -0,0 +1,326 @@
+"""
+Курсы валют Центрального Банка России.
+
+Таблица курсов (XML_daily.asp) разбирается один раз в словарь {код валюты: курс за единицу валюты с учетом
+Nominal} и хранится
+в общем для всех воркеров кэше (настройка RATES['CACHE']). Устаревшая таблица обновляется в фоне,
+одновременные обновления схлопываются в один запрос к ЦБ, а при недоступности ЦБ отдается
+последняя успешно полученная таблица.
+
+Для асинхронных представлений (ASGI) есть неблокирующие варианты методов с префиксом "a":
+запрос к ЦБ выполняется через httpx и не занимает поток на время ожидания ответа.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .metrics import RATES_CACHE, RATES_FETCH
+
+logger = logging.getLogger(__name__)
+
+CBR_DAILY_URL = 'http://www.cbr.ru/scripts/XML_daily.asp'
+FIXTURE_PATH = Path(__file__).resolve().parent / 'fixtures' / 'cbr_daily.xml'
+# ответы XML_daily.asp за несколько дней (файлы ГГГГ-ММ-ДД.xml), значения - для тестов и работы без сети
+FIXTURE_HISTORY_PATH = Path(__file__).resolve().parent / 'fixtures' / 'cbr_history'
+
+RATES_KEY = 'balanceapp:rates'
+LOCK_KEY = 'balanceapp:rates:lock'
+
+# ошибки источника, при которых отдается последняя известная таблица
+FETCH_ERRORS = (requests.RequestException, httpx.HTTPError, ET.ParseError, OSError)
+
+
+class RatesUnavailable(Exception):
+    """
+    Курсы валют не удалось получить и нет ни одной ранее полученной таблицы
+    """
+
+
+def parse_daily(content):
+    """
+    Разбор ответа XML_daily.asp в словарь {код валюты: рублей за единицу валюты}
+    """
+    return parse_daily_units(content)[1]
+
+
+def parse_daily_units(content):
+    """
+    Разбор ответа XML_daily.asp в (дата курсов, {код валюты: рублей за единицу валюты}).
+    Ответ без даты или с некорректными Value/Nominal считается неразборчивым (ET.ParseError)
+    """
+    root = ET.fromstring(content)
+    try:
+        day = datetime.strptime(root.get('Date'), '%d.%m.%Y').date()
+        return day, {valute.findtext('CharCode'): Decimal(valute.findtext('Value').replace(',', '.')) /
+                     Decimal(valute.findtext('Nominal'))
+                     for valute in root.iter('Valute')}
+    except (TypeError, ValueError, AttributeError, ArithmeticError) as exc:
+        raise ET.ParseError(f'malformed XML_daily.asp response: {exc!r}') from exc
+
+
+class CBRSource:
+    """
+    Источник курсов - официальный сайт ЦБ РФ
+    """
+
+    def __init__(self, url=CBR_DAILY_URL, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_daily(response.content)
+
+    async def afetch(self):
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(self.url)
+        response.raise_for_status()
+        return parse_daily(response.content)
+
+    def fetch_daily(self, day):
+        """
+        Курсы на дату day: (дата, на которую установлены курсы, {код валюты: рублей за единицу}).
+        В выходные и праздники ЦБ отдает курсы последнего рабочего дня
+        """
+        response = requests.get(self.url, params={'date_req': day.strftime('%d/%m/%Y')}, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_daily_units(response.content)
+
+
+class FixtureSource:
+    """
+    Локальная замена ЦБ РФ (для тестов и работы без сети) - файл в формате XML_daily.asp
+    """
+
+    def __init__(self, path=FIXTURE_PATH, history_path=FIXTURE_HISTORY_PATH):
+        self.path = Path(path)
+        self.history_path = Path(history_path)
+
+    def fetch(self):
+        return parse_daily(self.path.read_bytes())
+
+    async def afetch(self):
+        return self.fetch()  # файл небольшой, читается без ожидания
+
+    def fetch_daily(self, day):
+        """
+        Курсы из последнего файла истории не позже day (как ЦБ в выходные), None - если такого файла нет
+        """
+        files = sorted(path for path in self.history_path.glob('*.xml') if path.stem <= day.isoformat())
+        if not files:
+            return None
+        return parse_daily_units(files[-1].read_bytes())
+
+
+class RateProvider:
+    """
+    Кэширующий поставщик курсов валют.
+
+    ttl - через сколько секунд таблица считается устаревшей и обновляется в фоне,
+    lock_timeout - сколько секунд действует межпроцессная блокировка обновления
+    (и сколько ждет запрос, если таблицы в кэше еще нет, а ее уже загружает другой воркер).
+    """
+
+    def __init__(self, source, cache_alias='default', ttl=3600, lock_timeout=10):
+        self.source = source
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()  # схлопывает обновления внутри процесса
+        self._last_good = None  # последняя удачная таблица на случай потери общего кэша
+        self._async_locks = weakref.WeakKeyDictionary()  # то же, что _lock, для каждого цикла событий
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_rates(self):
+        """
+        Таблица курсов {код валюты: курс}
+        """
+        entry = self.cache.get(RATES_KEY) or self._last_good
+        if entry is None:
+            RATES_CACHE.labels(result='miss').inc()
+            return self._load()['rates']
+        if time.time() - entry['fetched_at'] > self.ttl:
+            RATES_CACHE.labels(result='stale').inc()
+            self._refresh_in_background()
+        else:
+            RATES_CACHE.labels(result='hit').inc()
+        return entry['rates']
+
+    def get_rate(self, code):
+        """
+        Курс валюты или None, если ЦБ не публикует курс для такого кода
+        """
+        return self.get_rates().get(code)
+
+    def refresh(self):
+        """
+        Загрузка таблицы из источника и сохранение ее в кэш
+        """
+        started = time.perf_counter()
+        try:
+            rates = self.source.fetch()
+        except Exception:
+            self._observe_fetch(started, 'error')
+            raise
+        self._observe_fetch(started, 'ok')
+        entry = {'rates': rates, 'fetched_at': time.time()}
+        # таблица хранится без срока годности: устаревание определяется по fetched_at,
+        # поэтому при недоступности ЦБ в кэше остается последняя удачная таблица
+        self.cache.set(RATES_KEY, entry, timeout=None)
+        self._last_good = entry
+        return entry
+
+    def _load(self):
+        """
+        Синхронная загрузка при пустом кэше: запрос к ЦБ выполняет только один поток одного воркера,
+        остальные дожидаются результата
+        """
+        with self._lock:
+            entry = self.cache.get(RATES_KEY) or self._last_good
+            if entry is not None:
+                return entry
+
+            deadline = time.monotonic() + self.lock_timeout
+            locked = self.cache.add(LOCK_KEY, 1, timeout=self.lock_timeout)
+            while not locked and time.monotonic() < deadline:
+                # таблицу уже загружает другой воркер
+                time.sleep(0.05)
+                entry = self.cache.get(RATES_KEY)
+                if entry is not None:
+                    return entry
+                locked = self.cache.add(LOCK_KEY, 1, timeout=self.lock_timeout)
+
+            try:
+                return self.refresh()
+            except FETCH_ERRORS as exc:
+                raise RatesUnavailable(str(exc)) from exc
+            finally:
+                if locked:
+                    self.cache.delete(LOCK_KEY)
+
+    async def aget_rates(self):
+        """
+        Таблица курсов {код валюты: курс} без блокировки цикла событий
+        """
+        entry = await self.cache.aget(RATES_KEY) or self._last_good
+        if entry is None:
+            RATES_CACHE.labels(result='miss').inc()
+            return (await self._aload())['rates']
+        if time.time() - entry['fetched_at'] > self.ttl:
+            RATES_CACHE.labels(result='stale').inc()
+            await sync_to_async(self._refresh_in_background, thread_sensitive=False)()
+        else:
+            RATES_CACHE.labels(result='hit').inc()
+        return entry['rates']
+
+    async def aget_rate(self, code):
+        """
+        Курс валюты или None, если ЦБ не публикует курс для такого кода
+        """
+        return (await self.aget_rates()).get(code)
+
+    async def arefresh(self):
+        """
+        Загрузка таблицы из источника и сохранение ее в кэш без блокировки цикла событий
+        """
+        afetch = getattr(self.source, 'afetch', None)
+        started = time.perf_counter()
+        try:
+            if afetch is not None:
+                rates = await afetch()
+            else:  # у источника нет асинхронного варианта - запрос выполняется в отдельном потоке
+                rates = await sync_to_async(self.source.fetch, thread_sensitive=False)()
+        except Exception:
+            self._observe_fetch(started, 'error')
+            raise
+        self._observe_fetch(started, 'ok')
+        entry = {'rates': rates, 'fetched_at': time.time()}
+        await self.cache.aset(RATES_KEY, entry, timeout=None)
+        self._last_good = entry
+        return entry
+
+    async def _aload(self):
+        """
+        Асинхронный вариант _load: одновременные запросы одного цикла событий ждут одну загрузку
+        """
+        loop = asyncio.get_running_loop()
+        lock = self._async_locks.setdefault(loop, asyncio.Lock())
+        async with lock:
+            entry = await self.cache.aget(RATES_KEY) or self._last_good
+            if entry is not None:
+                return entry
+
+            deadline = time.monotonic() + self.lock_timeout
+            locked = await self.cache.aadd(LOCK_KEY, 1, timeout=self.lock_timeout)
+            while not locked and time.monotonic() < deadline:
+                # таблицу уже загружает другой воркер
+                await asyncio.sleep(0.05)
+                entry = await self.cache.aget(RATES_KEY)
+                if entry is not None:
+                    return entry
+                locked = await self.cache.aadd(LOCK_KEY, 1, timeout=self.lock_timeout)
+
+            try:
+                return await self.arefresh()
+            except FETCH_ERRORS as exc:
+                raise RatesUnavailable(str(exc)) from exc
+            finally:
+                if locked:
+                    await self.cache.adelete(LOCK_KEY)
+
+    def _observe_fetch(self, started, result):
+        RATES_FETCH.labels(source=type(self.source).__name__, result=result).observe(time.perf_counter() - started)
+
+    def _refresh_in_background(self):
+        if not self._lock.acquire(blocking=False):
+            return  # обновление уже идет в этом процессе
+        if not self.cache.add(LOCK_KEY, 1, timeout=self.lock_timeout):
+            self._lock.release()
+            return  # обновление уже идет в другом воркере
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except FETCH_ERRORS:
+            logger.warning('Failed to refresh CBR exchange rates, serving the last known table', exc_info=True)
+        finally:
+            self.cache.delete(LOCK_KEY)
+            self._lock.release()
+
+
+@lru_cache(maxsize=None)
+def get_rate_provider():
+    """
+    Поставщик курсов, настроенный через settings.RATES
+    """
+    config = settings.RATES
+    source = import_string(config['SOURCE'])(**config.get('SOURCE_OPTIONS', {}))
+    return RateProvider(source, cache_alias=config['CACHE'], ttl=config['TTL'],
+                        lock_timeout=config['LOCK_TIMEOUT'])
+
+
+@receiver(setting_changed)
+def reset_rate_provider(setting, **kwargs):
+    if setting in ('RATES', 'CACHES'):
+        get_rate_provider.cache_clear()
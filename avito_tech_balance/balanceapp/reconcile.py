@@ -0,0 +1,175 @@
+"""
+Сверка балансов пользователей с журналом транзакций (python manage.py reconcile).
+
+Ожидаемый баланс пользователя - последний снимок баланса (BalanceCheckpoint, см. ledger.py) плюс чистый итог
+транзакций после момента снимка (полученные минус отправленные), у пользователя без снимков - итог всех
+его транзакций. Поэтому начальный баланс, заданный не через журнал, учитывается, если был сделан снимок
+(python manage.py checkpoint_balances). Перед переносом месяцев в архив (archive.py) снимки на границу архива
+делаются для всех пользователей с транзакциями в этих месяцах, поэтому их транзакции в базе не нужны.
+Фактический баланс - поле balance вместе со слотами (slots.py).
+
+Диапазон id пользователей делится на части по RECONCILIATION['CHUNK_SIZE'], части проверяются параллельно
+в пуле процессов (RECONCILIATION['WORKERS']). Каждая часть - один SQL-запрос: итоги считаются в базе
+группировкой, а баланс и журнал читаются из одного снимка данных, поэтому операции, выполняемые во время
+сверки, расхождений не дают.
+
+Без --full проверяются только пользователи с транзакциями после last_transaction_id последней завершенной
+сверки (ReconciliationRun). Граница следующей сверки - последняя транзакция старше ledger.CHECKPOINT_DELAY:
+транзакции новее могут быть еще не зафиксированы, поэтому их пользователи проверяются еще раз.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .ledger import CHECKPOINT_DELAY, CHECKPOINT_TABLE, CUSTOMER_TABLE, TRANSACTION_TABLE
+from .models import ReconciliationRun
+from .slots import TOTAL_BALANCE_SQL
+from .workers import setup as workers_setup
+
+# пользователи части: все или только с транзакциями после границы предыдущей сверки
+ALL_CUSTOMERS_SQL = f"""
+    SELECT id FROM {CUSTOMER_TABLE} WHERE id >= %(low)s AND id < %(high)s
+"""
+
+CHANGED_CUSTOMERS_SQL = f"""
+    SELECT recipient_id AS id FROM {TRANSACTION_TABLE}
+    WHERE id > %(after)s AND recipient_id >= %(low)s AND recipient_id < %(high)s
+    UNION
+    SELECT sender_id FROM {TRANSACTION_TABLE}
+    WHERE id > %(after)s AND sender_id >= %(low)s AND sender_id < %(high)s
+"""
+
+# число проверенных пользователей части и расхождения: id, фактический и ожидаемый баланс
+RECONCILE_SQL = f"""
+    WITH scope AS (
+        {{scope}}
+    ), anchor AS (
+        SELECT DISTINCT ON (customer_id) customer_id, "timestamp", balance FROM {CHECKPOINT_TABLE}
+        WHERE customer_id >= %(low)s AND customer_id < %(high)s AND customer_id IN (SELECT id FROM scope)
+        ORDER BY customer_id, "timestamp" DESC
+    ), move AS (
+        SELECT recipient_id AS customer_id, amount, "timestamp" FROM {TRANSACTION_TABLE}
+        WHERE recipient_id >= %(low)s AND recipient_id < %(high)s AND recipient_id IN (SELECT id FROM scope)
+        UNION ALL
+        SELECT sender_id, 0 - amount, "timestamp" FROM {TRANSACTION_TABLE}
+        WHERE sender_id >= %(low)s AND sender_id < %(high)s AND sender_id IN (SELECT id FROM scope)
+    ), net AS (
+        SELECT move.customer_id, SUM(move.amount) AS amount
+        FROM move LEFT JOIN anchor ON anchor.customer_id = move.customer_id
+        WHERE anchor.customer_id IS NULL OR move."timestamp" > anchor."timestamp"
+        GROUP BY move.customer_id
+    ), result AS (
+        SELECT customer.id, {TOTAL_BALANCE_SQL.format(customer='customer')} AS balance,
+               COALESCE(anchor.balance, 0) + COALESCE(net.amount, 0) AS expected
+        FROM {CUSTOMER_TABLE} AS customer
+        LEFT JOIN anchor ON anchor.customer_id = customer.id
+        LEFT JOIN net ON net.customer_id = customer.id
+        WHERE customer.id >= %(low)s AND customer.id < %(high)s AND customer.id IN (SELECT id FROM scope)
+    )
+    SELECT count(*),
+           COALESCE(array_agg(id ORDER BY id) FILTER (WHERE balance <> expected), '{{{{}}}}'),
+           COALESCE(array_agg(balance ORDER BY id) FILTER (WHERE balance <> expected), '{{{{}}}}'),
+           COALESCE(array_agg(expected ORDER BY id) FILTER (WHERE balance <> expected), '{{{{}}}}')
+    FROM result
+"""
+
+BOUNDS_SQL = f"""
+    SELECT min(id), max(id) FROM {CUSTOMER_TABLE}
+"""
+
+LAST_TRANSACTION_SQL = f"""
+    SELECT max(id) FROM {TRANSACTION_TABLE} WHERE "timestamp" <= %s
+"""
+
+
+def get_config():
+    return {'WORKERS': os.cpu_count() or 1, 'CHUNK_SIZE': 100000, **getattr(settings, 'RECONCILIATION', {})}
+
+
+def reconcile_range(low, high, after=None):
+    """
+    Сверка пользователей с id из [low, high), при after - только с транзакциями после after.
+    Возвращает (число проверенных пользователей, [(id, фактический баланс, ожидаемый баланс)])
+    """
+    scope = ALL_CUSTOMERS_SQL if after is None else CHANGED_CUSTOMERS_SQL
+    with connection.cursor() as cursor:
+        cursor.execute(RECONCILE_SQL.format(scope=scope), {'low': low, 'high': high, 'after': after})
+        checked, ids, balances, expected = cursor.fetchone()
+    return checked, list(zip(ids, balances, expected))
+
+
+def chunks(chunk_size):
+    """
+    Диапазоны [low, high) id пользователей по chunk_size
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(BOUNDS_SQL)
+        first, last = cursor.fetchone()
+    if first is None:
+        return []
+    return [(low, min(low + chunk_size, last + 1)) for low in range(first, last + 1, chunk_size)]
+
+
+def check_ranges(ranges, after, workers):
+    """
+    Сверка частей в пуле из workers процессов (при одном - в текущем процессе).
+    Возвращает (low, high, число проверенных, расхождения) по мере завершения частей
+    """
+    if workers == 1 or len(ranges) <= 1:
+        for low, high in ranges:
+            yield (low, high, *reconcile_range(low, high, after))
+        return
+    # процессы запускаются через spawn, а не fork: соединения пула (db/base.py) не наследуются,
+    # Django настраивается в процессе заново до загрузки этого модуля
+    with ProcessPoolExecutor(min(workers, len(ranges)), mp_context=get_context('spawn'), initializer=workers_setup,
+                             initargs=({'default': connection.settings_dict['NAME']},)) as pool:
+        futures = {pool.submit(reconcile_range, low, high, after): (low, high) for low, high in ranges}
+        for future in as_completed(futures):
+            yield (*futures[future], *future.result())
+
+
+def last_reconciled():
+    """
+    Последняя завершенная сверка или None
+    """
+    return ReconciliationRun.objects.exclude(finished=None).order_by('-started').first()
+
+
+def run(full=False, workers=None, chunk_size=None, progress=None):
+    """
+    Сверка балансов: всех пользователей (full или если сверок еще не было) или только изменившихся после
+    предыдущей сверки. Возвращает (ReconciliationRun, расхождения по id пользователей).
+    progress(low, high, checked) вызывается после проверки каждой части
+    """
+    config = get_config()
+    workers = workers or config['WORKERS']
+    chunk_size = chunk_size or config['CHUNK_SIZE']
+
+    previous = None if full else last_reconciled()
+    after = previous.last_transaction_id if previous is not None else None
+    started = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(LAST_TRANSACTION_SQL, [started - CHECKPOINT_DELAY])
+        last_transaction_id = cursor.fetchone()[0]
+    if after is not None:
+        last_transaction_id = max(after, last_transaction_id or 0)
+    # без границы предыдущей сверки проверяются все пользователи
+    reconciliation = ReconciliationRun.objects.create(started=started, full=after is None,
+                                                      last_transaction_id=last_transaction_id)
+
+    discrepancies = []
+    for low, high, checked, rows in check_ranges(chunks(chunk_size), after, workers):
+        reconciliation.customers += checked
+        discrepancies.extend(rows)
+        if progress is not None:
+            progress(low, high, checked)
+
+    discrepancies.sort()
+    reconciliation.discrepancies = len(discrepancies)
+    reconciliation.finished = timezone.now()
+    reconciliation.save(update_fields=['customers', 'discrepancies', 'finished'])
+    return reconciliation, discrepancies
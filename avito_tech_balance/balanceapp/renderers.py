@@ -0,0 +1,42 @@
+"""
+JSON-рендерер на orjson для списков (история транзакций, пользователи).
+
+Ответ совпадает с rest_framework.renderers.JSONRenderer побайтно при настройках DRF по умолчанию
+(COMPACT_JSON, UNICODE_JSON, STRICT_JSON): те же разделители, символы не экранируются, кроме управляющих,
+\\u2028 и \\u2029. Дата и время передаются в JSONEncoder DRF. Числа с плавающей точкой orjson записывает
+короче (1e16 вместо 1e+16), поэтому рендерер подключается только к представлениям без них в ответе.
+
+Если orjson не установлен, запрошен отступ (Accept: application/json; indent=4) или в данных есть то, что
+orjson не записывает так же, как json (Decimal, нестроковые ключи, целые больше 64 бит), ответ строит JSONRenderer.
+"""
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него работает JSONRenderer
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer с записью через orjson
+    """
+
+    def default(self, obj):
+        # Decimal JSONEncoder записывает числом с плавающей точкой - только через json
+        if isinstance(obj, Decimal):
+            raise TypeError('Decimal is rendered by JSONRenderer')
+        return self.encoder_class().default(obj)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact or not self.strict
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # как у JSONRenderer: ответ - строгое подмножество JavaScript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
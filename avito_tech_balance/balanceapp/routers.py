@@ -0,0 +1,203 @@
+"""
+Чтение с реплик PostgreSQL для эндпоинтов только для чтения.
+
+Запросы на чтение уходят на реплику только внутри replica_reads() - его открывают представления
+списка и данных пользователей и списка транзакций. Все остальное, в том числе чтение внутри операций
+с балансом (services.py), выполняется на основной базе.
+
+Реплика используется, только если ее отставание не больше REPLICATION['MAX_LAG'] секунд.
+Отставание проверяется не чаще раза в REPLICATION['CHECK_INTERVAL'] секунд в каждом процессе;
+недоступная реплика исключается до следующей проверки.
+
+Чтение своих записей (read-your-writes): после записи по пользователю (services.py, создание и изменение
+пользователя) позиция журнала WAL основной базы после фиксации (pg_current_wal_lsn) сохраняется в общем
+кэше (REPLICATION['CACHE']). Чтение данных этого пользователя идет на реплику, только если она уже
+воспроизвела журнал до этой позиции (pg_last_wal_replay_lsn), иначе - на основную базу. Позиции, а не время,
+сравниваются потому, что реплика без отставания по времени может еще не получить только что записанный WAL.
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+from .metrics import DB_READS
+
+WRITE_KEY = 'balanceapp:written:{}'
+
+# отставание реплики в секундах (0 - если база не в режиме восстановления, то есть не реплика)
+# и позиция воспроизведенного журнала в байтах
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END,
+    CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END - '0/0'::pg_lsn
+"""
+
+# позиция журнала основной базы в байтах
+WAL_POSITION_SQL = """
+    SELECT pg_current_wal_lsn() - '0/0'::pg_lsn
+"""
+
+_lags = {}  # alias -> (время проверки, отставание в секундах, позиция воспроизведенного журнала)
+_lags_lock = threading.Lock()
+_reads = contextvars.ContextVar('replica_reads', default=None)
+
+
+def get_config():
+    return {'REPLICAS': [], 'MAX_LAG': 1.0, 'CHECK_INTERVAL': 1.0, 'STICKY_TIMEOUT': 60, 'CACHE': 'default',
+            **getattr(settings, 'REPLICATION', {})}
+
+
+@dataclass
+class ReplicaReads:
+    """
+    Выбранная для чтения база и позиция журнала, до которой на ней есть все записи (для основной базы - None)
+    """
+    database: str
+    replayed: int = None
+
+    def is_stale(self, customer_ids):
+        """
+        На выбранной реплике может не быть последней записи по одному из пользователей customer_ids
+        """
+        return self.replayed is not None and last_write(customer_ids) > self.replayed
+
+
+def replica_state(alias):
+    """
+    Отставание реплики в секундах и позиция журнала, до которой на ней есть все записи (по результату
+    проверки не старше CHECK_INTERVAL), или (None, None), если реплика недоступна
+    """
+    now = time.monotonic()
+    with _lags_lock:
+        checked = _lags.get(alias)
+    if checked is not None and now - checked[0] < get_config()['CHECK_INTERVAL']:
+        return checked[1:]
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag, replayed = cursor.fetchone()
+        state = (float(lag), int(replayed))
+    except DatabaseError:
+        state = (None, None)
+    with _lags_lock:
+        _lags[alias] = (now, *state)
+    return state
+
+
+def reset_lags():
+    with _lags_lock:
+        _lags.clear()
+
+
+def choose_database(customer_ids=()):
+    """
+    Реплика с отставанием не больше MAX_LAG, на которой уже есть последние записи по пользователям
+    customer_ids, иначе основная база
+    """
+    config = get_config()
+    written = last_write(customer_ids)
+    candidates = []
+    for alias in config['REPLICAS']:
+        lag, replayed = replica_state(alias)
+        if lag is not None and lag <= config['MAX_LAG'] and replayed >= written:
+            candidates.append((alias, replayed))
+    if not candidates:
+        return ReplicaReads(DEFAULT_DB_ALIAS)
+    return ReplicaReads(*random.choice(candidates))
+
+
+@contextmanager
+def replica_reads(customer_ids=()):
+    """
+    Чтение внутри блока - с реплики (см. choose_database)
+    """
+    reads = choose_database(customer_ids)
+    token = _reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _reads.reset(token)
+
+
+def current_reads():
+    """
+    ReplicaReads текущего блока replica_reads() или None
+    """
+    return _reads.get()
+
+
+@contextmanager
+def primary_reads():
+    """
+    Чтение внутри блока - с основной базы
+    """
+    token = _reads.set(None)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+def note_write(customer_ids):
+    """
+    Запись по пользователям customer_ids: после фиксации транзакции их данные читаются с основной базы,
+    пока реплики не воспроизведут журнал до позиции после записи
+    """
+    customer_ids = [customer_id for customer_id in customer_ids if customer_id is not None]
+    if not customer_ids:
+        return
+    config = get_config()
+
+    def save():
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(WAL_POSITION_SQL)
+            position = int(cursor.fetchone()[0])
+        caches[config['CACHE']].set_many({WRITE_KEY.format(customer_id): position for customer_id in customer_ids},
+                                         timeout=config['STICKY_TIMEOUT'])
+    # без реплик записывать нечего; вне транзакции on_commit выполняется сразу
+    if config['REPLICAS']:
+        transaction.on_commit(save)
+
+
+def last_write(customer_ids):
+    """
+    Позиция журнала основной базы после последней записи по пользователям customer_ids
+    (0, если записей не было в течение STICKY_TIMEOUT)
+    """
+    customer_ids = [customer_id for customer_id in customer_ids if customer_id is not None]
+    if not customer_ids:
+        return 0
+    written = caches[get_config()['CACHE']].get_many([WRITE_KEY.format(customer_id) for customer_id in customer_ids])
+    return max(written.values(), default=0)
+
+
+class ReplicaRouter:
+    """
+    Роутер баз данных: чтение внутри replica_reads() - с выбранной реплики, остальное - с основной базы.
+    Миграции выполняются только на основной базе, на реплики они приходят через репликацию
+    """
+
+    def db_for_read(self, model, **hints):
+        reads = _reads.get()
+        database = reads.database if reads is not None else DEFAULT_DB_ALIAS
+        DB_READS.labels(database=database).inc()
+        return database
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_config()['REPLICAS']
@@ -1,11 +1,15 @@
+from django.utils import timezone
 from rest_framework import serializers
-from balanceapp.models import Customer, Transaction
+from balanceapp.export import format_amount, format_timestamp
+from balanceapp.models import Customer, StatementRollup, Transaction
 
 
 class CustomerSerializer(serializers.ModelSerializer):
     """
     Сериализатор пользователей
     """
+    # баланс вместе со слотами (см. slots.py)
+    balance = serializers.DecimalField(source='total_balance', max_digits=99, decimal_places=2, read_only=True)
     valute = serializers.SerializerMethodField()
 
     def get_valute(self, obj):
@@ -16,6 +20,13 @@ class CustomerSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'balance', 'valute']
         read_only_fields = ('balance', 'valute')
 
+    def update(self, instance, validated_data):
+        # сохраняются только переданные поля: баланс меняют операции (services.py) под блокировкой строки
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
 
 class TransactionSerializer(serializers.ModelSerializer):
     """
@@ -25,3 +36,63 @@ class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = "__all__"
+
+
+class CustomerRowSerializer:
+    """
+    Быстрая сериализация списка пользователей: строки values_list вместо экземпляров Customer и полей DRF.
+    Результат совпадает с CustomerSerializer(many=True).data
+    """
+    columns = ('id', 'name', 'balance', 'balance_slots', 'slots_balance')
+
+    @classmethod
+    def rows(cls, queryset):
+        """
+        Строки queryset пользователей (с with_total_balance) именованными кортежами для пагинаторов
+        """
+        return queryset.values_list(*cls.columns, named=True)
+
+    @staticmethod
+    def data(rows):
+        # баланс - как Customer.total_balance
+        return [{'id': pk, 'name': name,
+                 'balance': format_amount(balance + (slots_balance or 0) if balance_slots else balance),
+                 'valute': 'RUB'}
+                for pk, name, balance, balance_slots, slots_balance in rows]
+
+
+class TransactionRowSerializer:
+    """
+    Быстрая сериализация списка транзакций: строки values_list вместо экземпляров Transaction и полей DRF,
+    сумма и время форматируются напрямую. Результат совпадает с TransactionSerializer(many=True).data
+    """
+    columns = ('id', 'amount', 'timestamp', 'description', 'sender_id', 'recipient_id')
+
+    @classmethod
+    def rows(cls, queryset):
+        """
+        Строки queryset транзакций (или archive.HistoryWithArchive) именованными кортежами:
+        у них есть поля сортировки для KeysetPagination и HistoryWithArchive
+        """
+        return queryset.values_list(*cls.columns, named=True)
+
+    @staticmethod
+    def data(rows):
+        zone = timezone.get_current_timezone()
+        return [{'id': pk, 'amount': format_amount(amount), 'timestamp': format_timestamp(timestamp, zone),
+                 'description': description, 'sender': sender, 'recipient': recipient}
+                for pk, amount, timestamp, description, sender, recipient in rows]
+
+
+class StatementSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор итогов выписки за период
+    """
+    net = serializers.SerializerMethodField()
+
+    def get_net(self, obj):
+        return f'{obj.inflow - obj.outflow:.2f}'
+
+    class Meta:
+        model = StatementRollup
+        fields = ['start', 'inflow', 'outflow', 'net', 'inflow_count', 'outflow_count']
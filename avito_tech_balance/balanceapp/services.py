@@ -0,0 +1,423 @@
+"""
+Операции с балансом пользователей.
+
+Зачисление и списание - один SQL-запрос: условный UPDATE баланса и запись транзакции в журнал
+выполняются в одном выражении (data-modifying CTE), поэтому конкурентные запросы
+не теряют обновления, а проверка достаточности средств выполняется самой базой.
+
+Перевод блокирует строки обоих пользователей всегда в порядке возрастания id, поэтому
+встречные переводы A->B и B->A не взаимоблокируются; при ошибках сериализации
+транзакция повторяется с ограниченной экспоненциальной задержкой.
+
+Пакет операций блокирует все затронутые строки одним запросом (в том же порядке),
+применяет изменения балансов одним UPDATE ... FROM (VALUES ...) и пишет журнал одним bulk_create.
+
+У пользователей со слотами баланса (slots.py) зачисления идут в случайный слот, а списания
+берут средства из строки пользователя и слотов под блокировкой всех слотов.
+
+Вместе с журналом обновляются итоги по дням и месяцам для выписок (см. statements.py),
+а новые балансы после фиксации записываются в кэш пользователей (см. customer_cache.py).
+"""
+import logging
+import random
+import time
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from . import slots
+from .customer_cache import get_customer_cache
+from .metrics import record_lock_wait
+from .models import Customer, Transaction
+from .routers import note_write
+from .statements import ROLLUP_CTE, add_transactions, rollup_params
+
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientFunds(Exception):
+    """
+    На счете пользователя недостаточно средств
+    """
+
+
+CUSTOMER_TABLE = Customer._meta.db_table
+TRANSACTION_TABLE = Transaction._meta.db_table
+
+# зачисление: баланс увеличивается, в журнал пишется транзакция с получателем
+CREDIT_SQL = f"""
+    WITH updated AS (
+        UPDATE {CUSTOMER_TABLE} SET balance = balance + %(amount)s, version = version + 1
+        WHERE id = %(customer_id)s AND balance_slots = 0
+        RETURNING id, balance, version, name
+    ), ledger AS (
+        INSERT INTO {TRANSACTION_TABLE} (amount, "timestamp", description, recipient_id, sender_id)
+        SELECT %(amount)s, %(timestamp)s, %(description)s, id, NULL FROM updated
+        RETURNING id, amount, "timestamp", recipient_id, sender_id
+    ), {ROLLUP_CTE}
+    SELECT updated.id, updated.balance, updated.version, updated.name FROM updated, ledger
+"""
+
+# списание: баланс уменьшается, только если на счете достаточно средств
+DEBIT_SQL = f"""
+    WITH updated AS (
+        UPDATE {CUSTOMER_TABLE} SET balance = balance - %(amount)s, version = version + 1
+        WHERE id = %(customer_id)s AND balance >= %(amount)s AND balance_slots = 0
+        RETURNING id, balance, version, name
+    ), ledger AS (
+        INSERT INTO {TRANSACTION_TABLE} (amount, "timestamp", description, recipient_id, sender_id)
+        SELECT %(amount)s, %(timestamp)s, %(description)s, NULL, id FROM updated
+        RETURNING id, amount, "timestamp", recipient_id, sender_id
+    ), {ROLLUP_CTE}
+    SELECT updated.id, updated.balance, updated.version, updated.name FROM updated, ledger
+"""
+
+
+# блокировка строк пользователей в едином порядке. FOR NO KEY UPDATE не конфликтует с FOR KEY SHARE
+# внешних ключей журнала и зачислений в слоты баланса
+LOCK_CUSTOMERS_SQL = f"""
+    SELECT id, balance, balance_slots FROM {CUSTOMER_TABLE}
+    WHERE id = ANY(%(ids)s)
+    ORDER BY id
+    FOR NO KEY UPDATE
+"""
+
+# блокировка отправителя и получателя перевода; получатель со слотами баланса не блокируется
+LOCK_TRANSFER_SQL = f"""
+    SELECT id, balance, balance_slots FROM {CUSTOMER_TABLE}
+    WHERE id IN (%(sender_id)s, %(recipient_id)s) AND (balance_slots = 0 OR id = %(sender_id)s)
+    ORDER BY id
+    FOR NO KEY UPDATE
+"""
+
+# получатель со слотами баланса: блокировка только от удаления и изменения числа слотов
+SHARE_CUSTOMER_SQL = f"""
+    SELECT id, balance, balance_slots FROM {CUSTOMER_TABLE}
+    WHERE id = %(customer_id)s
+    FOR KEY SHARE
+"""
+
+# изменение баланса пользователя без слотов
+ADD_BALANCE_SQL = f"""
+    UPDATE {CUSTOMER_TABLE} SET balance = balance + %(amount)s, version = version + 1
+    WHERE id = %(customer_id)s
+    RETURNING id, balance, version, name
+"""
+
+# изменение обоих балансов и запись в журнал одним выражением
+TRANSFER_SQL = f"""
+    WITH updated AS (
+        UPDATE {CUSTOMER_TABLE}
+        SET balance = balance + CASE
+            WHEN %(sender_id)s = %(recipient_id)s THEN 0
+            WHEN id = %(sender_id)s THEN 0 - %(amount)s
+            ELSE %(amount)s
+        END, version = version + 1
+        WHERE id IN (%(sender_id)s, %(recipient_id)s)
+        RETURNING id, balance, version, name
+    ), ledger AS (
+        INSERT INTO {TRANSACTION_TABLE} (amount, "timestamp", description, recipient_id, sender_id)
+        VALUES (%(amount)s, %(timestamp)s, %(description)s, %(recipient_id)s, %(sender_id)s)
+        RETURNING id, amount, "timestamp", recipient_id, sender_id
+    ), {ROLLUP_CTE}
+    SELECT updated.id, updated.balance, updated.version, updated.name FROM updated, ledger
+"""
+
+# перевод получателю со слотами баланса: зачисление в слот %(slot)s, строка получателя не изменяется.
+# Возвращает новые данные отправителя и баланс получателя после зачисления
+SLOT_TRANSFER_SQL = f"""
+    WITH updated AS (
+        UPDATE {CUSTOMER_TABLE} SET balance = balance - %(amount)s, version = version + 1
+        WHERE id = %(sender_id)s
+        RETURNING id, balance, version, name
+    ), slot AS (
+        UPDATE {slots.SLOT_TABLE} SET balance = balance + %(amount)s
+        WHERE customer_id = %(recipient_id)s AND slot = %(slot)s
+    ), ledger AS (
+        INSERT INTO {TRANSACTION_TABLE} (amount, "timestamp", description, recipient_id, sender_id)
+        VALUES (%(amount)s, %(timestamp)s, %(description)s, %(recipient_id)s, %(sender_id)s)
+        RETURNING id, amount, "timestamp", recipient_id, sender_id
+    ), {ROLLUP_CTE}
+    SELECT updated.id, updated.balance, updated.version, updated.name,
+           (SELECT {slots.TOTAL_BALANCE_SQL.format(customer='customer')} + %(amount)s
+            FROM {CUSTOMER_TABLE} AS customer WHERE id = %(recipient_id)s)
+    FROM updated, ledger
+"""
+
+# изменение балансов пакета одним выражением, VALUES подставляются по числу пользователей
+BATCH_UPDATE_SQL = f"""
+    UPDATE {CUSTOMER_TABLE} AS customer
+    SET balance = customer.balance + delta.amount, version = customer.version + 1
+    FROM (VALUES {{values}}) AS delta(id, amount)
+    WHERE customer.id = delta.id
+    RETURNING customer.id, customer.balance, customer.version, customer.name
+"""
+
+# serialization_failure и deadlock_detected - транзакцию можно безопасно повторить
+RETRYABLE_SQLSTATES = {'40001', '40P01'}
+TRANSFER_MAX_ATTEMPTS = 5
+BATCH_MAX_SIZE = 10000
+CENT = Decimal('0.01')
+RETRY_BASE_DELAY = 0.01  # секунды
+RETRY_MAX_DELAY = 0.2
+
+
+@dataclass
+class TransferResult:
+    """
+    Результат перевода: новые балансы, число попыток и суммарное ожидание блокировок (в секундах)
+    """
+    sender_balance: Decimal
+    recipient_balance: Decimal
+    attempts: int
+    lock_wait: float
+
+
+def credit(customer_id, amount, description=None):
+    """
+    Зачисление средств на счет пользователя, возвращает новый баланс
+    """
+    return _change_balance(CREDIT_SQL, 'credit', customer_id, amount, description)
+
+
+def debit(customer_id, amount, description=None):
+    """
+    Списание средств со счета пользователя, возвращает новый баланс.
+    Если средств недостаточно, выбрасывает InsufficientFunds
+    """
+    return _change_balance(DEBIT_SQL, 'debit', customer_id, amount, description)
+
+
+def _change_balance(sql, operation, customer_id, amount, description):
+    params = {'customer_id': customer_id, 'amount': Decimal(amount), 'timestamp': timezone.now(),
+              'description': description, **rollup_params()}
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    # строку блокирует сам UPDATE, поэтому ожидание учитывается вместе с выполнением запроса
+    record_lock_wait(operation, time.perf_counter() - started)
+
+    if not rows:
+        # ни одна строка не обновилась: пользователя нет, не хватило средств или баланс разделен на слоты
+        balance_slots = Customer.objects.filter(pk=customer_id).values_list('balance_slots', flat=True).first()
+        if balance_slots is None:
+            raise Customer.DoesNotExist(f'Customer {customer_id} does not exist')
+        if operation == 'credit':
+            return _credit_slots(customer_id, params)
+        if balance_slots:
+            return _debit_slots(customer_id, params)
+        raise InsufficientFunds(f'There are not enough funds in the account of customer {customer_id}')
+    note_write([customer_id])
+    get_customer_cache().write_through(rows)
+    return rows[0][1]
+
+
+def _credit_slots(customer_id, params):
+    """
+    Зачисление в случайный слот баланса
+    """
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(slots.SLOT_CREDIT_SQL, {**params, 'slot': slots.random_slot()})
+        row = cursor.fetchone()
+    record_lock_wait('credit', time.perf_counter() - started)
+    if row is None:
+        # слоты отключены во время зачисления: баланс снова хранится в строке пользователя
+        return _change_balance(CREDIT_SQL, 'credit', customer_id, params['amount'], params['description'])
+    note_write([customer_id])
+    return row[0]
+
+
+def _debit_slots(customer_id, params):
+    """
+    Списание у пользователя со слотами баланса: сначала из строки пользователя, затем из слотов
+    """
+    amount = params['amount'].quantize(CENT, ROUND_HALF_UP)  # так сумму сохранит база
+    with transaction.atomic(), connection.cursor() as cursor:
+        started = time.perf_counter()
+        cursor.execute(LOCK_CUSTOMERS_SQL, {'ids': [customer_id]})
+        row = cursor.fetchone()
+        if row is None:
+            raise Customer.DoesNotExist(f'Customer {customer_id} does not exist')
+        _, base, balance_slots = row
+        balances = slots.lock(cursor, customer_id) if balance_slots else {}
+        record_lock_wait('debit', time.perf_counter() - started)
+
+        total = base + sum(balances.values())
+        if total < amount:
+            raise InsufficientFunds(f'There are not enough funds in the account of customer {customer_id}')
+        slots.save_draw(cursor, customer_id, base, *slots.draw(base, balances, amount))
+        entry = Transaction(amount=amount, description=params['description'], sender_id=customer_id)
+        Transaction.objects.bulk_create([entry])
+        add_transactions([entry])
+        note_write([customer_id])
+        get_customer_cache().invalidate([customer_id])
+    return total - amount
+
+
+def transfer(sender_id, recipient_id, amount, description=None, max_attempts=TRANSFER_MAX_ATTEMPTS):
+    """
+    Перевод средств между пользователями.
+    Если пользователя нет, выбрасывает Customer.DoesNotExist, если у отправителя
+    недостаточно средств - InsufficientFunds
+    """
+    sender_id, recipient_id, amount = int(sender_id), int(recipient_id), Decimal(amount)
+    if connection.in_atomic_block:
+        # внутри внешней транзакции повтор невозможен: она уже прервана ошибкой
+        max_attempts = 1
+
+    lock_wait = 0.0
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute(LOCK_TRANSFER_SQL, {'sender_id': sender_id, 'recipient_id': recipient_id})
+                    locked = {customer_id: (balance, balance_slots) for customer_id, balance, balance_slots
+                              in cursor.fetchall()}
+                    if recipient_id not in locked:
+                        # получатель со слотами баланса или несуществующий
+                        cursor.execute(SHARE_CUSTOMER_SQL, {'customer_id': recipient_id})
+                        locked.update({customer_id: (balance, balance_slots) for customer_id, balance, balance_slots
+                                       in cursor.fetchall()})
+                    for customer_id in (sender_id, recipient_id):
+                        if customer_id not in locked:
+                            raise Customer.DoesNotExist(f'Customer {customer_id} does not exist')
+                    sender_slots = slots.lock(cursor, sender_id) if locked[sender_id][1] else {}
+                    waited = time.perf_counter() - started
+                    lock_wait += waited
+                    record_lock_wait('transfer', waited)
+
+                    if locked[sender_id][0] + sum(sender_slots.values()) < amount:
+                        raise InsufficientFunds(
+                            f'There are not enough funds in the account of customer {sender_id}')
+
+                    if locked[sender_id][1] or locked[recipient_id][1]:
+                        balances = _transfer_slots(cursor, sender_id, recipient_id, amount, description, locked,
+                                                   sender_slots)
+                    else:
+                        cursor.execute(TRANSFER_SQL, {'sender_id': sender_id, 'recipient_id': recipient_id,
+                                                      'amount': amount, 'timestamp': timezone.now(),
+                                                      'description': description, **rollup_params()})
+                        rows = cursor.fetchall()
+                        balances = {customer_id: balance for customer_id, balance, *_ in rows}
+                        get_customer_cache().write_through(rows)
+                note_write([sender_id, recipient_id])
+            return TransferResult(balances[sender_id], balances[recipient_id], attempt, lock_wait)
+        except OperationalError as exc:
+            if attempt == max_attempts or getattr(exc.__cause__, 'sqlstate', None) not in RETRYABLE_SQLSTATES:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            logger.warning('Transfer %s -> %s failed on attempt %s (%s), retrying in %.3fs',
+                           sender_id, recipient_id, attempt, exc, delay)
+            time.sleep(delay)
+
+
+def _transfer_slots(cursor, sender_id, recipient_id, amount, description, locked, sender_slots):
+    """
+    Перевод, в котором у отправителя или получателя включены слоты баланса. Строки пользователей
+    и слоты отправителя уже заблокированы, средств достаточно. Возвращает новые балансы
+    """
+    amount = amount.quantize(CENT, ROUND_HALF_UP)
+    base, sender_slot_count = locked[sender_id]
+    recipient_slot_count = locked[recipient_id][1]
+    if not sender_slot_count:
+        # частый случай - перевод на счет площадки: одно выражение, как TRANSFER_SQL
+        cursor.execute(SLOT_TRANSFER_SQL, {'sender_id': sender_id, 'recipient_id': recipient_id, 'amount': amount,
+                                           'slot': slots.random_slot() % recipient_slot_count,
+                                           'timestamp': timezone.now(), 'description': description,
+                                           **rollup_params()})
+        *row, recipient_balance = cursor.fetchone()
+        get_customer_cache().write_through([row])
+        return {sender_id: row[1], recipient_id: recipient_balance}
+
+    rows = []
+    slots.save_draw(cursor, sender_id, base, *slots.draw(base, sender_slots, amount))
+    get_customer_cache().invalidate([sender_id])
+    if recipient_slot_count:
+        slots.add(cursor, recipient_id, recipient_slot_count, amount)
+    else:
+        cursor.execute(ADD_BALANCE_SQL, {'customer_id': recipient_id, 'amount': amount})
+        rows += cursor.fetchall()
+    entry = Transaction(amount=amount, description=description, sender_id=sender_id, recipient_id=recipient_id)
+    Transaction.objects.bulk_create([entry])
+    add_transactions([entry])
+    get_customer_cache().write_through(rows)
+
+    balances = {customer_id: balance for customer_id, balance, *_ in rows}
+    for customer_id in (sender_id, recipient_id):
+        if locked[customer_id][1]:
+            cursor.execute(slots.TOTAL_SQL, {'customer_id': customer_id})
+            balances[customer_id] = cursor.fetchone()[0]
+    return balances
+
+
+def apply_batch(entries, atomic=True):
+    """
+    Применение пакета операций.
+    entries - несохраненные Transaction в порядке применения: у зачисления указан только recipient,
+    у списания - только sender, у перевода - оба. Возвращает список ошибок по элементам
+    (None - операция выполнена, Customer.DoesNotExist или InsufficientFunds).
+    В режиме atomic при любой ошибке не применяется ни одна операция
+    """
+    errors = [None] * len(entries)
+    with transaction.atomic():
+        ids = {customer_id for entry in entries for customer_id in (entry.sender_id, entry.recipient_id)
+               if customer_id is not None}
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(LOCK_CUSTOMERS_SQL, {'ids': sorted(ids)})
+            locked = {customer_id: (balance, balance_slots) for customer_id, balance, balance_slots in cursor.fetchall()}
+            # слоты баланса блокируются только у отправителей: из них могут списываться средства
+            senders = {entry.sender_id for entry in entries}
+            sender_slots = {customer_id: slots.lock(cursor, customer_id) for customer_id in sorted(locked)
+                            if locked[customer_id][1] and customer_id in senders}
+        record_lock_wait('batch', time.perf_counter() - started)
+        balances = {customer_id: base + sum(sender_slots.get(customer_id, {}).values())
+                    for customer_id, (base, _) in locked.items()}
+
+        # последовательное применение операций к балансам в памяти
+        applied = []
+        initial = dict(balances)
+        for index, entry in enumerate(entries):
+            entry.amount = Decimal(entry.amount).quantize(CENT, ROUND_HALF_UP)  # так сумму сохранит база
+            missing = [customer_id for customer_id in (entry.sender_id, entry.recipient_id)
+                       if customer_id is not None and customer_id not in balances]
+            if missing:
+                errors[index] = Customer.DoesNotExist(f'Customer {missing[0]} does not exist')
+            elif entry.sender_id is not None and balances[entry.sender_id] < entry.amount:
+                errors[index] = InsufficientFunds(
+                    f'There are not enough funds in the account of customer {entry.sender_id}')
+            else:
+                if entry.sender_id is not None:
+                    balances[entry.sender_id] -= entry.amount
+                if entry.recipient_id is not None:
+                    balances[entry.recipient_id] += entry.amount
+                applied.append(entry)
+
+        if atomic and any(errors):
+            return errors
+
+        deltas = [(customer_id, balance - initial[customer_id]) for customer_id, balance in balances.items()
+                  if balance != initial[customer_id]]
+        # у пользователей со слотами зачисления идут в строку пользователя (она уже заблокирована),
+        # а списания - сначала из нее, затем из слотов
+        draws = [(customer_id, -delta) for customer_id, delta in deltas if locked[customer_id][1] and delta < 0]
+        updates = [(customer_id, delta) for customer_id, delta in deltas if not locked[customer_id][1] or delta > 0]
+        with connection.cursor() as cursor:
+            if updates:
+                cursor.execute(BATCH_UPDATE_SQL.format(values=', '.join(['(%s::bigint, %s::numeric)'] * len(updates))),
+                               [value for delta in updates for value in delta])
+                get_customer_cache().write_through(row for row in cursor.fetchall() if not locked[row[0]][1])
+            for customer_id, amount in draws:
+                base = locked[customer_id][0]
+                slots.save_draw(cursor, customer_id, base, *slots.draw(base, sender_slots[customer_id], amount))
+        get_customer_cache().invalidate([customer_id for customer_id, _ in deltas if locked[customer_id][1]])
+        Transaction.objects.bulk_create(applied)
+        add_transactions(applied)
+        note_write([customer_id for customer_id, _ in deltas])
+    return errors
@@ -0,0 +1,154 @@
+"""
+Слоты баланса для счетов с частыми зачислениями (например, счет площадки, на который приходят почти все переводы).
+
+У пользователя с Customer.balance_slots = N > 0 баланс - сумма поля balance и N строк BalanceSlot.
+Зачисление увеличивает баланс случайного слота и не изменяет строку пользователя, поэтому одновременные
+зачисления ждут блокировки разных строк: очередь к одной строке сокращается примерно в N раз.
+Итоги для выписок у таких пользователей тоже разделены по слотам (statements.py).
+
+Списание блокирует строку пользователя (FOR NO KEY UPDATE) и все его слоты в порядке номеров и берет средства
+сначала из поля balance, затем из слотов с наибольшим балансом. Зачисление в слот берет на строку пользователя
+только FOR KEY SHARE (ее же берет внешний ключ журнала): эта блокировка не конфликтует со списаниями,
+а конфликтует только с изменением числа слотов (set_slots, FOR UPDATE), поэтому зачисление не попадет
+в слот, который в этот момент переносится в поле balance.
+
+Кэш пользователей (customer_cache.py) таких пользователей не хранит: зачисления в слоты не меняют версию.
+"""
+import random
+
+from django.db import connection, transaction
+
+from .models import BalanceSlot, Customer, Transaction
+from .statements import ROLLUP_CTE
+
+CUSTOMER_TABLE = Customer._meta.db_table
+SLOT_TABLE = BalanceSlot._meta.db_table
+TRANSACTION_TABLE = Transaction._meta.db_table
+
+# зачисление в слот mod(%(slot)s, N): строка пользователя не изменяется.
+# Возвращает баланс пользователя после зачисления (без учета одновременных зачислений в другие слоты)
+SLOT_CREDIT_SQL = f"""
+    WITH target AS (
+        SELECT id, balance, balance_slots FROM {CUSTOMER_TABLE}
+        WHERE id = %(customer_id)s AND balance_slots > 0
+        FOR KEY SHARE
+    ), updated AS (
+        UPDATE {SLOT_TABLE} AS slot SET balance = slot.balance + %(amount)s
+        FROM target
+        WHERE slot.customer_id = target.id AND slot.slot = mod(%(slot)s, target.balance_slots)
+        RETURNING slot.customer_id AS id
+    ), ledger AS (
+        INSERT INTO {TRANSACTION_TABLE} (amount, "timestamp", description, recipient_id, sender_id)
+        SELECT %(amount)s, %(timestamp)s, %(description)s, id, NULL FROM updated
+        RETURNING id, amount, "timestamp", recipient_id, sender_id
+    ), {ROLLUP_CTE}
+    SELECT target.balance + %(amount)s + (SELECT SUM(balance) FROM {SLOT_TABLE} WHERE customer_id = target.id)
+    FROM target, updated, ledger
+"""
+
+LOCK_SLOTS_SQL = f"""
+    SELECT slot, balance FROM {SLOT_TABLE}
+    WHERE customer_id = %(customer_id)s
+    ORDER BY slot
+    FOR UPDATE
+"""
+
+ADD_TO_SLOT_SQL = f"""
+    UPDATE {SLOT_TABLE} SET balance = balance + %(amount)s
+    WHERE customer_id = %(customer_id)s AND slot = %(slot)s
+"""
+
+# новые балансы слотов, VALUES подставляются по числу слотов
+UPDATE_SLOTS_SQL = f"""
+    UPDATE {SLOT_TABLE} AS slot SET balance = new.balance
+    FROM (VALUES {{values}}) AS new(slot, balance)
+    WHERE slot.customer_id = %s AND slot.slot = new.slot
+"""
+
+SET_BASE_SQL = f"""
+    UPDATE {CUSTOMER_TABLE} SET balance = %(balance)s, version = version + 1
+    WHERE id = %(customer_id)s
+"""
+
+# баланс пользователя {customer} (алиас таблицы пользователей) в SQL-запросах
+TOTAL_BALANCE_SQL = f"""
+    ({{customer}}.balance + CASE WHEN {{customer}}.balance_slots > 0
+        THEN (SELECT COALESCE(SUM(balance), 0) FROM {SLOT_TABLE} WHERE customer_id = {{customer}}.id)
+        ELSE 0 END)
+"""
+
+TOTAL_SQL = f"""
+    SELECT {TOTAL_BALANCE_SQL.format(customer='customer')} FROM {CUSTOMER_TABLE} AS customer
+    WHERE id = %(customer_id)s
+"""
+
+
+def random_slot():
+    """
+    Случайное число для выбора слота: номер слота - остаток от деления на число слотов
+    """
+    return random.randrange(1 << 30)
+
+
+def lock(cursor, customer_id):
+    """
+    Блокировка слотов пользователя, возвращает {номер слота: баланс}
+    """
+    cursor.execute(LOCK_SLOTS_SQL, {'customer_id': customer_id})
+    return dict(cursor.fetchall())
+
+
+def draw(base, balances, amount):
+    """
+    Списание amount: сначала из поля balance (base), затем из слотов с наибольшим балансом.
+    Возвращает новое значение поля balance и новые балансы измененных слотов
+    """
+    taken = min(base, amount)
+    base, amount = base - taken, amount - taken
+    changed = {}
+    for slot, balance in sorted(balances.items(), key=lambda item: item[1], reverse=True):
+        if amount <= 0:
+            break
+        taken = min(balance, amount)
+        changed[slot] = balance - taken
+        amount -= taken
+    return base, changed
+
+
+def save_draw(cursor, customer_id, base, new_base, changed):
+    """
+    Запись результата draw в базу (строка пользователя и слоты уже заблокированы)
+    """
+    if new_base != base:
+        cursor.execute(SET_BASE_SQL, {'customer_id': customer_id, 'balance': new_base})
+    if changed:
+        cursor.execute(UPDATE_SLOTS_SQL.format(values=', '.join(['(%s::smallint, %s::numeric)'] * len(changed))),
+                       [value for item in changed.items() for value in item] + [customer_id])
+
+
+def add(cursor, customer_id, balance_slots, amount):
+    """
+    Зачисление amount в случайный слот пользователя
+    """
+    cursor.execute(ADD_TO_SLOT_SQL, {'customer_id': customer_id, 'amount': amount,
+                                     'slot': random_slot() % balance_slots})
+
+
+def set_slots(customer_id, count):
+    """
+    Изменение числа слотов пользователя (0 - отключение слотов). Балансы старых слотов переносятся
+    в поле balance, новые слоты создаются с нулевым балансом. Если пользователя нет,
+    выбрасывает Customer.DoesNotExist
+    """
+    with transaction.atomic():
+        # FOR UPDATE дожидается зачислений в слоты, начатых до изменения
+        customer = Customer.objects.select_for_update().get(pk=customer_id)
+        with connection.cursor() as cursor:
+            moved = sum(lock(cursor, customer.pk).values())
+        BalanceSlot.objects.filter(customer=customer).delete()
+        BalanceSlot.objects.bulk_create([BalanceSlot(customer=customer, slot=slot) for slot in range(count)])
+        customer.balance += moved
+        customer.balance_slots = count
+        customer.version += 1
+        customer.save(update_fields=['balance', 'balance_slots', 'version'])
+    return customer
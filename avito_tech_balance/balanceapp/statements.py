@@ -0,0 +1,136 @@
+"""
+Выписки: итоги движения средств пользователя по дням и месяцам.
+
+Итоги (StatementRollup) обновляются тем же SQL-запросом или в той же транзакции, что и запись
+в журнал (см. services.py), поэтому выписка за любой интервал читает по строке на период,
+а не агрегирует все транзакции пользователя. Границы дней и месяцев - в часовом поясе settings.TIME_ZONE.
+
+У пользователей со слотами баланса (slots.py) итоги периода разделены на строки по слотам
+(номер строки - остаток от деления id транзакции на число слотов), чтобы одновременные зачисления
+не ждали блокировки одной строки итогов; выписка суммирует эти строки.
+
+Для транзакций, записанных в журнал в обход services.py (например, при переносе данных),
+итоги пересчитываются командой python manage.py rebuild_statements. Итоги месяцев, перенесенных в архив
+(archive.py), при пересчете сохраняются: их транзакций в базе уже нет.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from . import archive, partitions
+from .models import Customer, StatementRollup, Transaction
+
+CUSTOMER_TABLE = Customer._meta.db_table
+ROLLUP_TABLE = StatementRollup._meta.db_table
+TRANSACTION_TABLE = Transaction._meta.db_table
+PERIODS = [period for period, _ in StatementRollup.PERIODS]
+
+# прибавление движений {moves} (id, customer_id, "timestamp", inflow, outflow, incoming) к итогам за день и месяц
+ROLLUP_SQL = f"""
+    INSERT INTO {ROLLUP_TABLE} AS total (customer_id, period, start, slot, inflow, outflow, inflow_count, outflow_count)
+    SELECT move.customer_id, period.name,
+           date_trunc(period.name, move."timestamp" AT TIME ZONE %(time_zone)s)::date,
+           CASE WHEN customer.balance_slots > 0 THEN mod(move.id, customer.balance_slots) ELSE 0 END,
+           SUM(move.inflow), SUM(move.outflow),
+           COUNT(*) FILTER (WHERE move.incoming), COUNT(*) FILTER (WHERE NOT move.incoming)
+    FROM ({{moves}}) AS move
+    JOIN {CUSTOMER_TABLE} AS customer ON customer.id = move.customer_id
+    CROSS JOIN (VALUES ('day'), ('month')) AS period(name)
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (customer_id, period, start, slot) DO UPDATE SET
+        inflow = total.inflow + EXCLUDED.inflow,
+        outflow = total.outflow + EXCLUDED.outflow,
+        inflow_count = total.inflow_count + EXCLUDED.inflow_count,
+        outflow_count = total.outflow_count + EXCLUDED.outflow_count
+"""
+
+# движения по строкам журнала {source}: зачисление получателю и списание отправителю
+LEDGER_MOVES_SQL = """
+    SELECT id, recipient_id AS customer_id, "timestamp", amount AS inflow, 0 AS outflow, true AS incoming
+    FROM {source} WHERE recipient_id IS NOT NULL
+    UNION ALL
+    SELECT id, sender_id, "timestamp", 0, amount, false
+    FROM {source} WHERE sender_id IS NOT NULL
+"""
+
+# фрагмент WITH для запросов services.py: итоги по строкам, вставленным в журнал в CTE ledger
+ROLLUP_CTE = 'rollup AS ({sql})'.format(sql=ROLLUP_SQL.format(moves=LEDGER_MOVES_SQL.format(source='ledger')))
+
+# прибавление к итогам транзакций с id из списка (записанных в журнал одним bulk_create)
+ADD_TRANSACTIONS_SQL = ROLLUP_SQL.format(moves=LEDGER_MOVES_SQL.format(
+    source=f'(SELECT * FROM {TRANSACTION_TABLE} WHERE id = ANY(%(ids)s)) AS ledger'))
+
+# транзакции журнала с даты since (начало первого месяца после архивированных) или все при since = NULL
+STORED_SQL = f'SELECT * FROM {TRANSACTION_TABLE} WHERE %(since)s::timestamptz IS NULL OR "timestamp" >= %(since)s'
+
+# пересчет итогов всех пользователей по журналу
+REBUILD_SQL = ROLLUP_SQL.format(moves=LEDGER_MOVES_SQL.format(source=f'({STORED_SQL}) AS ledger'))
+
+# пересчет итогов пользователей из списка: движения их контрагентов не учитываются
+REBUILD_CUSTOMERS_SQL = ROLLUP_SQL.format(moves=f"""
+    SELECT * FROM ({LEDGER_MOVES_SQL.format(
+        source=f'(SELECT * FROM ({STORED_SQL}) AS stored '
+               f'WHERE sender_id = ANY(%(customer_ids)s) OR recipient_id = ANY(%(customer_ids)s)) AS ledger')}) AS move
+    WHERE customer_id = ANY(%(customer_ids)s)
+""")
+
+
+def rollup_params():
+    """
+    Параметры запросов с ROLLUP_SQL
+    """
+    return {'time_zone': settings.TIME_ZONE}
+
+
+def add_transactions(entries):
+    """
+    Прибавление к итогам транзакций, записанных в журнал bulk_create
+    """
+    if entries:
+        with connection.cursor() as cursor:
+            cursor.execute(ADD_TRANSACTIONS_SQL, {'ids': [entry.pk for entry in entries], **rollup_params()})
+
+
+def rebuild(customer_ids=None):
+    """
+    Пересчет итогов по журналу транзакций для пользователей customer_ids (по умолчанию - для всех),
+    возвращает число строк итогов. Запись в журнал на время пересчета приостанавливается блокировкой таблицы итогов.
+    Итоги архивированных месяцев не пересчитываются
+    """
+    month = archive.first_stored_month()
+    rollups = StatementRollup.objects.all()
+    if month is not None:
+        rollups = rollups.filter(start__gte=month)
+    params = {'since': partitions.month_start(month) if month is not None else None, **rollup_params()}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {ROLLUP_TABLE} IN EXCLUSIVE MODE')
+        if customer_ids is None:
+            rollups.delete()
+            cursor.execute(REBUILD_SQL, params)
+        else:
+            customer_ids = [int(customer_id) for customer_id in customer_ids]
+            if not customer_ids:
+                return 0
+            rollups.filter(customer__in=customer_ids).delete()
+            cursor.execute(REBUILD_CUSTOMERS_SQL, {'customer_ids': customer_ids, **params})
+        return cursor.rowcount
+
+
+def get_statement(customer_id, period='month', date_from=None, date_to=None):
+    """
+    Итоги пользователя по периодам в порядке дат (несохраняемые StatementRollup, строки слотов сложены).
+    date_from и date_to - даты, попадающие в первый и последний период выписки
+    """
+    rollups = StatementRollup.objects.filter(customer=customer_id, period=period)
+    if date_from is not None:
+        rollups = rollups.filter(start__gte=period_start(date_from, period))
+    if date_to is not None:
+        rollups = rollups.filter(start__lte=period_start(date_to, period))
+    totals = rollups.order_by('start').values('start').annotate(
+        inflow=Sum('inflow'), outflow=Sum('outflow'), inflow_count=Sum('inflow_count'),
+        outflow_count=Sum('outflow_count'))
+    return [StatementRollup(customer_id=customer_id, period=period, **total) for total in totals]
+
+
+def period_start(day, period):
+    return day.replace(day=1) if period == 'month' else day
@@ -1,14 +1,44 @@
+import asyncio
+import csv
+import io
 import json
+import random
+import re
+import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
+from base64 import urlsafe_b64encode
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
 import requests
-from django.db.models import Q
-
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F, Max, Q, QuerySet, Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 
-from .models import Customer, Transaction
+from . import admission, archive, customer_import, group_commit, ledger, metrics, partitions, reconcile, routers, services, slots, statements
+from .customer_cache import LocalTier, get_customer_cache
+from .db.base import DatabaseWrapper, pool_stats
+from .models import (BalanceCheckpoint, Customer, CustomerImport, ExchangeRate, ReconciliationRun, StatementRollup,
+                     Transaction)
+from .renderers import FastJSONRenderer
+from .serializers import CustomerSerializer, TransactionSerializer
+from .rates import FETCH_ERRORS, FIXTURE_PATH, RateProvider, RatesUnavailable, get_rate_provider, parse_daily
+from .views import TransactionViewSet
 
 
 # docker-compose run test
@@ -20,6 +50,7 @@ class CustomerTestCase(APITestCase):
 
     def tearDown(self) -> None:
         self.customer.delete()
+        cache.clear()
 
     def test_customer_create_api_view(self):
         """
@@ -53,8 +84,8 @@ class CustomerTestCase(APITestCase):
         response = self.client.get(reverse("balanceapp:customer-detail", kwargs={"pk": self.customer.pk}), query_param)
         self.assertEqual(response.status_code, 200)
 
-        response_valute = requests.get('http://www.cbr.ru/scripts/XML_daily.asp')
-        root = ET.fromstring(response_valute.content)
+        # курсы в тестах берутся из локальной копии XML_daily.asp
+        root = ET.fromstring(FIXTURE_PATH.read_bytes())
         for valute in root.findall('Valute'):
             char_code = valute.find('CharCode').text
             if char_code == query_param['currency']:
@@ -65,6 +96,12 @@ class CustomerTestCase(APITestCase):
         response_data = json.loads(response.content)
         self.assertEqual(response_data, expected_data)
 
+        # проверяем неизвестную валюту
+        response = self.client.get(reverse("balanceapp:customer-detail", kwargs={"pk": self.customer.pk}),
+                                   {'currency': 'XXX'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "the currency was not found"})
+
     def test_customer_update_api_view(self):
         """
         Проверка редактирования информации о пользователе
@@ -85,6 +122,97 @@ class CustomerTestCase(APITestCase):
         self.assertFalse(Customer.objects.filter(pk=self.customer.pk))
 
 
+class FlakySource:
+    """
+    Источник курсов, который считает обращения и может быть недоступен
+    """
+    def __init__(self, delay=0):
+        self.calls = 0
+        self.delay = delay
+        self.available = True
+        self.value = Decimal('86.6402')
+
+    def fetch(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if not self.available:
+            raise requests.ConnectionError('cbr.ru is unreachable')
+        return {'USD': self.value}
+
+
+class RateProviderTestCase(SimpleTestCase):
+    """
+    Проверка кэширования курсов валют
+    """
+    def tearDown(self):
+        cache.clear()
+
+    def test_fixture_source(self):
+        rates = get_rate_provider().get_rates()
+        self.assertEqual(rates['USD'], Decimal('86.6402'))
+        # курс за одну иену: Value 56,2208 за Nominal 100
+        self.assertEqual(rates['JPY'], Decimal('0.562208'))
+
+    def test_concurrent_loads_are_coalesced(self):
+        source = FlakySource(delay=0.2)
+        provider = RateProvider(source)
+        threads = [threading.Thread(target=provider.get_rates) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(source.calls, 1)
+
+        # повторные обращения обслуживаются из кэша
+        self.assertEqual(provider.get_rate('USD'), Decimal('86.6402'))
+        self.assertIsNone(provider.get_rate('EUR'))
+        self.assertEqual(source.calls, 1)
+
+    def test_stale_table_is_refreshed_in_background(self):
+        source = FlakySource()
+        provider = RateProvider(source, ttl=0)
+        provider.get_rates()
+        source.value = Decimal('90')
+        # устаревшая таблица отдается сразу, а новая загружается в фоне
+        self.assertEqual(provider.get_rate('USD'), Decimal('86.6402'))
+        for _ in range(100):
+            if provider.get_rate('USD') == Decimal('90'):
+                break
+            time.sleep(0.01)
+        self.assertEqual(provider.get_rate('USD'), Decimal('90'))
+
+    def test_last_good_table_is_served_when_source_is_down(self):
+        source = FlakySource()
+        provider = RateProvider(source, ttl=0)
+        provider.get_rates()
+        source.available = False
+        with self.assertLogs('balanceapp.rates', 'WARNING'):
+            for _ in range(3):
+                self.assertEqual(provider.get_rate('USD'), Decimal('86.6402'))
+                with provider._lock:  # дожидаемся фонового обновления
+                    pass
+
+        # без ранее полученной таблицы отдать нечего
+        cache.clear()
+        with self.assertRaises(RatesUnavailable):
+            RateProvider(source).get_rates()
+
+    def test_malformed_response(self):
+        valute = '<Valute><CharCode>USD</CharCode><Nominal>{}</Nominal><Value>{}</Value></Valute>'
+        for content in ('<ValCurs name="Foreign Currency Market"></ValCurs>',
+                        '<ValCurs Date="31.02.2024"></ValCurs>',
+                        '<ValCurs Date="24.07.2024">{}</ValCurs>'.format(valute.format(1, 'n/a')),
+                        '<ValCurs Date="24.07.2024">{}</ValCurs>'.format(valute.format(0, '86,6402')),
+                        '<ValCurs Date="24.07.2024"><Valute><CharCode>USD</CharCode></Valute></ValCurs>'):
+            with self.subTest(content=content), self.assertRaises(FETCH_ERRORS):
+                parse_daily(content)
+
+        # неразборчивый ответ ЦБ обрабатывается как недоступность источника
+        source = mock.Mock(fetch=lambda: parse_daily('<ValCurs></ValCurs>'))
+        with self.assertRaises(RatesUnavailable):
+            RateProvider(source).get_rates()
+
+
 class WithdrawDepositTestCase(APITestCase):
     """
     Проверка возможности снять и зачислить средства
@@ -161,6 +289,147 @@ class WithdrawDepositTestCase(APITestCase):
                                       "you must specify either 'withdraw' or 'deposit'."})
 
 
+def run_in_threads(threads, requests_per_thread, send):
+    """
+    Одновременная отправка запросов из нескольких потоков.
+    send(client, номер потока) отправляет один запрос, возвращается список кодов ответов
+    """
+    statuses = []
+    barrier = threading.Barrier(threads)
+
+    def worker(number):
+        client = APIClient()
+        barrier.wait()
+        try:
+            for _ in range(requests_per_thread):
+                statuses.append(send(client, number).status_code)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return statuses
+
+
+# одновременные записи по одному счету проверяют базу, а не лимиты: контроль допуска (admission.py) выключен
+@override_settings(ADMISSION={'ENABLED': False})
+class WithdrawDepositConcurrencyTestCase(APITransactionTestCase):
+    """
+    Проверка отсутствия потерянных обновлений при одновременных операциях с одним счетом
+    """
+    threads = 10
+    requests_per_thread = 10
+
+    def hammer(self, customer_id, payload):
+        """
+        Отправка одинаковых операций из нескольких потоков, возвращает список кодов ответов
+        """
+        url = reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': customer_id})
+        return run_in_threads(self.threads, self.requests_per_thread,
+                              lambda client, i: client.post(url, json.dumps(payload), content_type='application/json'))
+
+    def test_concurrent_withdraw(self):
+        customer = Customer.objects.create(name="Den")
+        statuses = self.hammer(customer.pk, {'amount': 10, 'operation': 'withdraw'})
+
+        self.assertEqual(statuses, [200] * self.threads * self.requests_per_thread)
+        customer.refresh_from_db()
+        self.assertEqual(customer.balance, Decimal(10 * self.threads * self.requests_per_thread))
+        self.assertEqual(Transaction.objects.filter(recipient=customer).count(),
+                         self.threads * self.requests_per_thread)
+
+    def test_concurrent_deposit(self):
+        # средств хватает ровно на половину списаний
+        customer = Customer.objects.create(name="Den", balance=5 * self.threads * self.requests_per_thread)
+        statuses = self.hammer(customer.pk, {'amount': 10, 'operation': 'deposit'})
+
+        successful = statuses.count(200)
+        self.assertEqual(successful, self.threads * self.requests_per_thread // 2)
+        self.assertEqual(statuses.count(400), len(statuses) - successful)
+        customer.refresh_from_db()
+        self.assertEqual(customer.balance, 0)
+        self.assertEqual(Transaction.objects.filter(sender=customer).count(), successful)
+
+
+@override_settings(GROUP_COMMIT={'ENABLED': True, 'MAX_DELAY': 0.02, 'MAX_SIZE': 500})
+class GroupCommitTestCase(WithdrawDepositConcurrencyTestCase):
+    """
+    Те же одновременные операции при групповой фиксации: каждый запрос получает свой результат
+    """
+    def batches(self):
+        """
+        Число пакетов и операций в них по метрике group_commit_batch_size
+        """
+        return (metrics.REGISTRY.get_sample_value('group_commit_batch_size_count') or 0,
+                metrics.REGISTRY.get_sample_value('group_commit_batch_size_sum') or 0)
+
+    def test_operations_share_transactions(self):
+        customers = [Customer.objects.create(name=f"Den {number}", balance=50) for number in range(self.threads)]
+        batches_before, operations_before = self.batches()
+
+        def send(client, number):
+            # поток number списывает со счета пользователя number, последний поток - с несуществующего счета
+            customer_id = customers[number].pk if number < self.threads - 1 else 0
+            return client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': customer_id}),
+                               json.dumps({'amount': 10, 'operation': 'deposit'}), content_type='application/json')
+
+        statuses = run_in_threads(self.threads, self.requests_per_thread, send)
+
+        # у каждого пользователя средств хватает на 5 списаний из 10
+        self.assertEqual(statuses.count(200), 5 * (self.threads - 1))
+        self.assertEqual(statuses.count(404), self.requests_per_thread)
+        self.assertEqual(statuses.count(400), len(statuses) - statuses.count(200) - statuses.count(404))
+        for customer in customers[:-1]:
+            customer.refresh_from_db()
+            self.assertEqual(customer.balance, 0)
+            self.assertEqual(Transaction.objects.filter(sender=customer).count(), 5)
+
+        batches, operations = self.batches()
+        self.assertEqual(operations - operations_before, len(statuses))
+        self.assertLess(batches - batches_before, len(statuses))
+
+    def test_inside_transaction_without_queue(self):
+        customer = Customer.objects.create(name="Den")
+        batches_before = self.batches()
+        with transaction.atomic():
+            group_commit.credit(customer.pk, 100)
+            customer.refresh_from_db()
+            self.assertEqual(customer.balance, 100)
+        self.assertEqual(self.batches(), batches_before)
+
+    def test_batch_failure_is_raised_per_waiter(self):
+        queue = group_commit.GroupCommit(max_delay=0.05)
+        failure = OperationalError('connection lost')
+        errors = []
+        barrier = threading.Barrier(3)
+
+        def worker(number):
+            barrier.wait()
+            try:
+                queue.submit(Transaction(amount=10, recipient_id=number + 1))
+            except OperationalError as exc:
+                errors.append(exc)
+
+        with mock.patch.object(services, 'apply_batch', side_effect=failure) as apply_batch:
+            workers = [threading.Thread(target=worker, args=(number,)) for number in range(3)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+
+        self.assertEqual(apply_batch.call_count, 1)
+        self.assertEqual(len(errors), 3)
+        # у каждого потока свой экземпляр ошибки со своей трассировкой, исходная ошибка - в __cause__
+        self.assertEqual(len({id(error) for error in errors}), 3)
+        self.assertNotIn(failure, errors)
+        for error in errors:
+            self.assertIs(error.__cause__, failure)
+            self.assertEqual(error.args, failure.args)
+
+
 class TransferTestCase(APITestCase):
     """
     Проверка возможности перевести средства от пользователя к пользователю
@@ -253,6 +522,182 @@ class TransferTestCase(APITestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.data, {"error": "There are not enough funds in the account"})
 
+        # некорректный id - 404, ошибки внутри перевода не выдаются за отсутствие пользователя
+        response = self.client.post(reverse('balanceapp:transfer'),
+                                    {'amount': 1, 'sender': 'ups', 'recipient': self.recipient.pk}, format='json')
+        self.assertEqual(response.status_code, 404)
+        with mock.patch.object(services, 'transfer', side_effect=ValueError('slot')):
+            with self.assertRaisesMessage(ValueError, 'slot'):
+                self.client.post(reverse('balanceapp:transfer'),
+                                 {'amount': 1, 'sender': self.sender.pk, 'recipient': self.recipient.pk}, format='json')
+
+
+# одновременные записи по одному счету проверяют базу, а не лимиты: контроль допуска (admission.py) выключен
+@override_settings(ADMISSION={'ENABLED': False})
+class TransferConcurrencyTestCase(APITransactionTestCase):
+    """
+    Проверка встречных переводов между одними и теми же пользователями
+    """
+    def setUp(self):
+        self.first = Customer.objects.create(name="Deineris", balance=1000)
+        self.second = Customer.objects.create(name="Khal", balance=1000)
+
+    def test_opposite_transfers(self):
+        def send(client, number):
+            # четные потоки переводят first -> second, нечетные - в обратную сторону
+            sender, recipient = (self.first, self.second) if number % 2 == 0 else (self.second, self.first)
+            return client.post(reverse('balanceapp:transfer'),
+                               json.dumps({'amount': 1, 'sender': sender.pk, 'recipient': recipient.pk}),
+                               content_type='application/json')
+
+        statuses = run_in_threads(10, 20, send)
+
+        self.assertEqual(statuses, [200] * 200)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.balance, 1000)
+        self.assertEqual(self.second.balance, 1000)
+        self.assertEqual(Transaction.objects.count(), 200)
+
+    def test_retry_on_deadlock(self):
+        class DeadlockDetected(Exception):
+            sqlstate = '40P01'
+
+        deadlock = OperationalError('deadlock detected')
+        deadlock.__cause__ = DeadlockDetected()
+
+        failures = [deadlock]
+
+        def deadlock_on_lock(execute, sql, params, many, context):
+            # первая блокировка строк пользователей завершается взаимоблокировкой, как ее сообщил бы PostgreSQL
+            if failures and sql == services.LOCK_TRANSFER_SQL:
+                raise failures.pop()
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(deadlock_on_lock), self.assertLogs('balanceapp.services', 'WARNING'):
+            result = services.transfer(self.first.pk, self.second.pk, 100)
+
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual(result.sender_balance, 900)
+        self.assertEqual(result.recipient_balance, 1100)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_lock_wait_is_reported(self):
+        response = self.client.post(reverse('balanceapp:transfer'),
+                                    json.dumps({'amount': 1, 'sender': self.first.pk, 'recipient': self.second.pk}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^lock;dur=\d+\.\d{2}$')
+
+
+class BatchTestCase(APITestCase):
+    """
+    Проверка пакетного выполнения операций
+    """
+    def setUp(self):
+        self.first = Customer.objects.create(name="Deineris", balance=1000)
+        self.second = Customer.objects.create(name="Khal")
+
+    def post(self, data):
+        return self.client.post(reverse('balanceapp:batch'), json.dumps(data), content_type='application/json')
+
+    def test_atomic_batch(self):
+        items = [{'type': 'operation', 'customer': self.second.pk, 'amount': 300, 'operation': 'withdraw',
+                  'description': 'salary'},
+                 {'type': 'transfer', 'sender': self.first.pk, 'recipient': self.second.pk, 'amount': 1000},
+                 # перевод возможен только после предыдущих операций
+                 {'type': 'transfer', 'sender': self.second.pk, 'recipient': self.first.pk, 'amount': 1200.5},
+                 {'type': 'operation', 'customer': self.first.pk, 'amount': 0.5, 'operation': 'deposit'}]
+
+        # блокировка пользователей, изменение балансов, запись журнала и итогов - по одному запросу на весь пакет
+        with self.assertNumQueries(6):
+            response = self.post({'items': items})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'applied': True, 'results': [{'index': index, 'status': 'ok'}
+                                                                       for index in range(len(items))]})
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.balance, Decimal('1200.00'))
+        self.assertEqual(self.second.balance, Decimal('99.50'))
+        self.assertEqual(list(Transaction.objects.values_list('amount', 'sender', 'recipient', 'description')),
+                         [(Decimal('300.00'), None, self.second.pk, 'salary'),
+                          (Decimal('1000.00'), self.first.pk, self.second.pk, None),
+                          (Decimal('1200.50'), self.second.pk, self.first.pk, None),
+                          (Decimal('0.50'), self.first.pk, None, None)])
+
+    def test_atomic_batch_is_rolled_back(self):
+        items = [{'type': 'operation', 'customer': self.second.pk, 'amount': 300, 'operation': 'withdraw'},
+                 {'type': 'transfer', 'sender': self.first.pk, 'recipient': self.second.pk, 'amount': 5000},
+                 {'type': 'operation', 'customer': self.second.pk + 100, 'amount': 300, 'operation': 'withdraw'}]
+        response = self.post({'items': items})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'applied': False, 'results': [
+            {'index': 0, 'status': 'not_applied'},
+            {'index': 1, 'status': 'error', 'error': 'There are not enough funds in the account'},
+            {'index': 2, 'status': 'error', 'error': 'No Customer matches the given query.'}]})
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.balance, 0)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_best_effort_batch(self):
+        items = [{'type': 'transfer', 'sender': self.first.pk, 'recipient': self.second.pk, 'amount': 600},
+                 {'type': 'transfer', 'sender': self.first.pk, 'recipient': self.second.pk, 'amount': 600},
+                 {'type': 'operation', 'customer': self.first.pk, 'amount': 'ups', 'operation': 'deposit'},
+                 {'type': 'operation', 'customer': self.first.pk, 'amount': 400, 'operation': 'deposit'}]
+        response = self.post({'mode': 'best_effort', 'items': items})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'applied': True, 'results': [
+            {'index': 0, 'status': 'ok'},
+            {'index': 1, 'status': 'error', 'error': 'There are not enough funds in the account'},
+            {'index': 2, 'status': 'error', 'error': 'The amount must be positive number'},
+            {'index': 3, 'status': 'ok'}]})
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.balance, 0)
+        self.assertEqual(self.second.balance, 600)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_batch_validation(self):
+        response = self.post({'items': []})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "Items are required"})
+
+        response = self.post({'mode': 'ups', 'items': [{}]})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post({'items': [{'type': 'ups'},
+                                        {'type': 'operation', 'customer': self.first.pk, 'amount': 5},
+                                        {'type': 'operation', 'customer': self.first.pk, 'amount': 5,
+                                         'operation': 'ups'},
+                                        {'type': 'transfer', 'sender': self.first.pk, 'amount': 5}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['error'] for result in response.data['results']], [
+            "The field 'type' is specified incorrectly, you must specify either 'operation' or 'transfer'.",
+            "Amount, operation and customer are required",
+            "The field 'operation' is specified incorrectly, you must specify either 'withdraw' or 'deposit'.",
+            "Amount, sender and recipient are required"])
+
+        # дробный id и true не приводятся к id пользователя
+        response = self.post({'items': [{'type': 'operation', 'customer': self.first.pk + 0.5, 'amount': 5,
+                                         'operation': 'withdraw'},
+                                        {'type': 'transfer', 'sender': True, 'recipient': self.second.pk, 'amount': 5},
+                                        {'type': 'transfer', 'sender': str(self.first.pk), 'recipient': '1e1',
+                                         'amount': 5}]})
+        self.assertEqual([result['error'] for result in response.data['results']],
+                         ['No Customer matches the given query.'] * 3)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_float_amounts(self):
+        # 2.675 во float меньше 2.675: сумма округляется до копеек по десятичной записи числа
+        response = self.post({'items': [{'type': 'operation', 'customer': self.second.pk, 'amount': 2.675,
+                                         'operation': 'withdraw'}]})
+        self.assertEqual(response.status_code, 200)
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.balance, Decimal('2.68'))
+
 
 class TransactionTestCase(APITestCase):
     """
@@ -335,3 +780,1784 @@ class TransactionTestCase(APITestCase):
             dictionary['recipient'] = transaction.recipient.pk
             expected_data.append(dictionary)
         self.assertEqual(response_data, expected_data)
+
+
+class KeysetPaginationTestCase(APITestCase):
+    """
+    Проверка навигации по транзакциям по курсору
+    """
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Daineris")
+        self.other = Customer.objects.create(name="Khal")
+        # суммы повторяются, чтобы проверить однозначность порядка
+        for number in range(25):
+            Transaction.objects.create(sender=self.customer if number % 2 else self.other,
+                                       recipient=self.other if number % 2 else self.customer, amount=number % 4 * 100)
+        Transaction.objects.create(sender=self.other, recipient=self.other, amount=100)
+
+    def walk(self, params):
+        """
+        Проход по всем страницам вперед, а затем назад; возвращает id транзакций в обоих направлениях
+        """
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.customer.pk})
+        response = self.client.get(url, dict(params, pagination='cursor'))
+        pages = [response.data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+        forward = [row['id'] for page in pages for row in page['results']]
+
+        backward_pages = [pages[-1]]
+        while backward_pages[-1]['previous']:
+            backward_pages.append(self.client.get(backward_pages[-1]['previous']).data)
+        backward = [row['id'] for page in reversed(backward_pages) for row in page['results']]
+        return pages, forward, backward
+
+    def test_cursor_pagination(self):
+        queryset = Transaction.objects.filter(Q(recipient=self.customer) | Q(sender=self.customer))
+        for order in (None, 'timestamp', '-timestamp', 'amount', '-amount'):
+            with self.subTest(order=order):
+                params = {'order': order} if order else {}
+                pages, forward, backward = self.walk(params)
+                ordering = [order, order.replace(order.lstrip('-'), 'id')] if order else ['id']
+                expected = list(queryset.order_by(*ordering).values_list('id', flat=True))
+
+                self.assertEqual(len(pages), 3)
+                self.assertEqual(pages[0]['count'], 25)
+                self.assertIsNone(pages[0]['previous'])
+                self.assertEqual(forward, expected)
+                self.assertEqual(backward, expected)
+
+    def test_cursor_pagination_without_count(self):
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.customer.pk})
+        # без подсчета страница - один запрос
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'pagination': 'cursor', 'count': 'false', 'order': '-amount'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(len(response.data['results']), 10)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_invalid_cursor(self):
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.customer.pk})
+        for cursor in ('ups', 'eyJ2YWx1ZSI6ICJ1cHMiLCAiaWQiOiAxLCAicmV2ZXJzZSI6IGZhbHNlfQ=='):
+            response = self.client.get(url, {'cursor': cursor, 'order': 'timestamp'})
+            self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor(self):
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.customer.pk})
+        positions = [({'id': 1, 'reverse': False}, 'timestamp'),
+                     ({'value': None, 'id': 1, 'reverse': False}, 'timestamp'),
+                     ({'value': ['2024-07-01'], 'id': 1, 'reverse': False}, '-timestamp'),
+                     ({'value': 'ups', 'id': 1, 'reverse': False}, 'amount'),
+                     ({'value': None, 'id': 1, 'reverse': True}, '-amount')]
+        for position, order in positions:
+            with self.subTest(position=position, order=order):
+                cursor = urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+                response = self.client.get(url, {'cursor': cursor, 'order': order})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data, {'detail': 'Invalid cursor'})
+
+        # значение без часового пояса считается временем текущего часового пояса
+        position = {'value': '2000-01-01T00:00:00', 'id': 0, 'reverse': False}
+        cursor = urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+        response = self.client.get(url, {'cursor': cursor, 'order': 'timestamp', 'count': 'false'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+
+
+class TransactionQueryPlanTestCase(TestCase):
+    """
+    Проверка плана запроса истории транзакций: страница собирается слиянием двух индексных сканирований
+    """
+    @classmethod
+    def setUpTestData(cls):
+        customers = Customer.objects.bulk_create([Customer(name=f'customer {number}') for number in range(200)])
+        Transaction.objects.bulk_create([
+            Transaction(amount=number % 1000, sender=customers[number % 200], recipient=customers[number * 7 % 200])
+            for number in range(20000)
+        ])
+        cls.customer = customers[10]
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Transaction._meta.db_table}')
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            return cursor.fetchone()[0][0]['Plan']
+
+    def nodes(self, plan):
+        yield plan
+        for child in plan.get('Plans', []):
+            yield from self.nodes(child)
+
+    def partition_indexes(self, index):
+        """
+        Индексы секций журнала, созданные по индексу index секционированной таблицы
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass', [index])
+            return {name for name, in cursor.fetchall()}
+
+    def assertMergedIndexScans(self, queryset, sender_index, recipient_index):
+        nodes = list(self.nodes(self.explain(queryset)))
+        node_types = [node['Node Type'] for node in nodes]
+        self.assertIn('Merge Append', node_types)
+        self.assertNotIn('Sort', node_types)
+        self.assertNotIn('Seq Scan', node_types)
+        # журнал секционирован (partitions.py): каждая выборка читает индексы всех секций
+        self.assertEqual({node.get('Index Name') for node in nodes if node['Node Type'] == 'Index Scan'},
+                         self.partition_indexes(sender_index) | self.partition_indexes(recipient_index))
+        return nodes
+
+    def test_history_page_plan(self):
+        for ordering, suffix in ((['id'], 'id'), (['timestamp', 'id'], 'time'), (['-amount', '-id'], 'amount')):
+            with self.subTest(ordering=ordering):
+                queryset = Transaction.objects.for_customer(self.customer.pk).order_by(*ordering)[20:30]
+                self.assertMergedIndexScans(queryset, f'tx_sender_{suffix}_idx', f'tx_recipient_{suffix}_idx')
+
+    def test_keyset_page_plan(self):
+        position = Transaction.objects.filter(sender=self.customer).order_by('amount', 'id')[40]
+        queryset = (Transaction.objects.for_customer(self.customer.pk).order_by('amount', 'id')
+                    .filter(Q(amount__gte=position.amount) & (Q(amount__gt=position.amount) | Q(id__gt=position.pk))))
+        nodes = self.assertMergedIndexScans(queryset[:11], 'tx_sender_amount_idx', 'tx_recipient_amount_idx')
+        # позиция курсора - часть условия сканирования индекса, а не фильтр после него
+        for node in nodes:
+            if node['Node Type'] == 'Index Scan':
+                self.assertIn('amount >=', node['Index Cond'])
+
+    def test_period_plan(self):
+        month = timezone.localdate().replace(day=1)
+        queryset = TransactionViewSet.filter_period(Transaction.objects.for_customer(self.customer.pk),
+                                                    partitions.month_start(month),
+                                                    partitions.month_start(partitions.add_months(month, 1)))
+        nodes = list(self.nodes(self.explain(queryset.order_by('timestamp', 'id')[:10])))
+        # условие на время отсекает секции других месяцев
+        scanned = {node['Relation Name'] for node in nodes if 'Relation Name' in node}
+        self.assertEqual(scanned, {partitions.partition_name(month)})
+
+    def test_history_contents(self):
+        expected = list(Transaction.objects.filter(Q(recipient=self.customer) | Q(sender=self.customer))
+                        .order_by('-amount', '-id').values_list('id', flat=True))
+        queryset = Transaction.objects.for_customer(self.customer.pk).order_by('-amount', '-id')
+        self.assertEqual(queryset.count(), len(expected))
+        self.assertEqual([row.pk for row in queryset[30:60]], expected[30:60])
+
+
+class TransactionExportTestCase(APITestCase):
+    """
+    Проверка потоковой выгрузки истории транзакций
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name="Daineris")
+        cls.other = Customer.objects.create(name="Khal")
+        Transaction.objects.bulk_create([
+            Transaction(amount=Decimal(number) / 4, description=f'операция "{number}", №{number}',
+                        sender=cls.customer if number % 3 else cls.other,
+                        recipient=cls.customer if number % 3 != 1 else cls.other)
+            for number in range(2500)
+        ])
+        # по одной транзакции в день, в обратном порядке относительно id
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        for number, transaction in enumerate(Transaction.objects.order_by('-id')):
+            Transaction.objects.filter(pk=transaction.pk).update(timestamp=start + timedelta(hours=12 * number))
+
+    def export(self, **params):
+        response = self.client.get(reverse('balanceapp:transactions-export', kwargs={'customer_id': self.customer.pk}),
+                                   params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def expected(self, **period):
+        queryset = Transaction.objects.filter(Q(recipient=self.customer) | Q(sender=self.customer), **period)
+        return json.loads(json.dumps(TransactionSerializer(queryset.order_by('timestamp', 'id'), many=True).data))
+
+    def test_csv_export(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        expected = self.expected()
+        self.assertEqual(len(rows), len(expected))
+        for row, transaction in zip(rows, expected):
+            self.assertEqual(row, {key: '' if value is None else str(value) for key, value in transaction.items()})
+
+    def test_ndjson_export(self):
+        response, content = self.export(format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual([json.loads(line) for line in content.splitlines()], self.expected())
+
+    def test_export_period(self):
+        _, content = self.export(format='ndjson', date_from='2024-02-01', date_to='2024-02-10T12:00:00Z')
+        expected = self.expected(timestamp__gte=datetime(2024, 2, 1, tzinfo=dt_timezone.utc),
+                                 timestamp__lte=datetime(2024, 2, 10, 12, tzinfo=dt_timezone.utc))
+        self.assertEqual(len(expected), 20)
+        self.assertEqual([json.loads(line) for line in content.splitlines()], expected)
+
+        _, content = self.export(format='ndjson', date_from='2024-02-01', date_to='2024-02-01')
+        self.assertEqual(len(content.splitlines()), 2)
+
+    def test_export_validation(self):
+        url = reverse('balanceapp:transactions-export', kwargs={'customer_id': self.customer.pk})
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'date_from': 'yesterday'}).status_code, 400)
+        url = reverse('balanceapp:transactions-export', kwargs={'customer_id': self.other.pk + 100})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class BalanceAsOfTestCase(APITestCase):
+    """
+    Проверка баланса на момент времени по снимкам и журналу транзакций
+    """
+    start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        # начальный баланс задан не через журнал
+        self.customers = [Customer.objects.create(name=name, balance=balance)
+                          for name, balance in (("Daineris", 1000), ("Khal", 0), ("Jorah", 50))]
+        self.random = random.Random(8)
+        self.operate(300, self.start)
+
+    def operate(self, count, since):
+        """
+        Случайные операции, каждой назначается своя дата: по одной в час начиная с since
+        """
+        for number in range(count):
+            first, second = self.random.sample(self.customers, 2)
+            amount = Decimal(self.random.randint(1, 5000)) / 100
+            kind = self.random.choice(('credit', 'debit', 'transfer'))
+            try:
+                if kind == 'credit':
+                    services.credit(first.pk, amount)
+                elif kind == 'debit':
+                    services.debit(first.pk, amount)
+                else:
+                    services.transfer(first.pk, second.pk, amount)
+            except services.InsufficientFunds:
+                services.credit(first.pk, amount)
+            Transaction.objects.filter(pk=Transaction.objects.latest('id').pk).update(
+                timestamp=since + timedelta(hours=number))
+
+    def expected(self, customer, moment):
+        """
+        Баланс по всему журналу: текущий баланс за вычетом транзакций после moment
+        """
+        later = Transaction.objects.filter(timestamp__gt=moment)
+        received = sum(later.filter(recipient=customer).values_list('amount', flat=True), Decimal(0))
+        sent = sum(later.filter(sender=customer).values_list('amount', flat=True), Decimal(0))
+        customer.refresh_from_db()
+        return customer.balance - received + sent
+
+    def assertBalances(self, moments):
+        for customer in self.customers:
+            for moment in moments:
+                with self.assertNumQueries(1):
+                    balance = ledger.balance_as_of(customer.pk, moment)
+                self.assertEqual(balance, self.expected(customer, moment), (customer.pk, moment))
+
+    def moments(self, count=15):
+        return [self.start + timedelta(minutes=self.random.randint(-60, 400 * 60)) for _ in range(count)]
+
+    def test_without_checkpoints(self):
+        self.assertBalances(self.moments())
+
+    def test_with_checkpoints(self):
+        self.assertEqual(ledger.create_checkpoints(self.start + timedelta(hours=100, minutes=30)), 3)
+        self.assertBalances(self.moments())
+
+        # снимок создается только для пользователей с транзакциями после предыдущего снимка
+        self.assertEqual(ledger.create_checkpoints(self.start + timedelta(hours=100, minutes=40)), 0)
+        self.assertEqual(ledger.create_checkpoints(self.start + timedelta(hours=200, minutes=30)), 3)
+        self.assertEqual(ledger.create_checkpoints(self.start + timedelta(hours=100)), 0)  # раньше последнего
+        self.assertBalances(self.moments())
+
+        # последняя учтенная транзакция снимка
+        cutoff = self.start + timedelta(hours=200, minutes=30)
+        for checkpoint in BalanceCheckpoint.objects.filter(timestamp=cutoff):
+            last = (Transaction.objects.filter(Q(sender=checkpoint.customer_id) | Q(recipient=checkpoint.customer_id),
+                                               timestamp__lte=cutoff).order_by('-timestamp', '-id').first())
+            self.assertEqual(checkpoint.transaction_id, last.pk)
+
+        # новые операции после снимков
+        self.operate(50, self.start + timedelta(hours=400))
+        call_command('checkpoint_balances', cutoff='2024-01-19T12:00:00Z', stdout=io.StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.filter(timestamp=self.start + timedelta(hours=444)).count(), 3)
+        self.assertBalances(self.moments() + [self.start + timedelta(hours=460)])
+
+    def test_new_customer_checkpoint(self):
+        ledger.create_checkpoints(self.start + timedelta(hours=100))
+        newcomer = Customer.objects.create(name="Viserys", balance=10)
+        services.credit(newcomer.pk, 5)
+        Transaction.objects.filter(recipient=newcomer).update(timestamp=self.start + timedelta(hours=150))
+        self.assertEqual(ledger.create_checkpoints(self.start + timedelta(hours=120)), 4)
+        checkpoint = BalanceCheckpoint.objects.get(customer=newcomer)
+        self.assertEqual((checkpoint.balance, checkpoint.transaction_id), (Decimal(10), None))
+        self.assertEqual(ledger.balance_as_of(newcomer.pk, self.start + timedelta(hours=160)), Decimal(15))
+
+    def test_balance_as_of_endpoint(self):
+        customer = self.customers[0]
+        url = reverse('balanceapp:balance-as-of', kwargs={'customer_id': customer.pk})
+        response = self.client.get(url, {'as_of': '2024-01-05T00:00:00Z'})
+        self.assertEqual(response.status_code, 200)
+        moment = datetime(2024, 1, 5, tzinfo=dt_timezone.utc)
+        self.assertEqual(response.data, {"id": customer.pk, "balance": f'{self.expected(customer, moment):.2f}',
+                                         "valute": "RUB", "as_of": "2024-01-05T00:00:00Z"})
+
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'as_of': 'yesterday'}).status_code, 400)
+        url = reverse('balanceapp:balance-as-of', kwargs={'customer_id': customer.pk + 100})
+        self.assertEqual(self.client.get(url, {'as_of': '2024-01-05T00:00:00Z'}).status_code, 404)
+
+
+class StatementTestCase(APITestCase):
+    """
+    Проверка итогов для выписок: обновление при записи в журнал, пересчет и эндпоинт выписки
+    """
+    def setUp(self):
+        self.customers = [Customer.objects.create(name=name, balance=1000) for name in ("Daineris", "Khal", "Jorah")]
+        self.random = random.Random(9)
+        moments = [datetime(2024, 1, 30, 22, tzinfo=dt_timezone.utc) + timedelta(hours=13 * number)
+                   for number in range(60)]
+        for moment in moments:
+            with mock.patch('django.utils.timezone.now', return_value=moment):
+                self.operate()
+
+    def operate(self):
+        first, second = self.random.sample(self.customers, 2)
+        amount = round(self.random.uniform(1, 100), 2)
+        kind = self.random.choice(('operation', 'transfer', 'self', 'batch'))
+        if kind == 'operation':
+            self.client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': first.pk}),
+                             {'amount': amount, 'operation': self.random.choice(('withdraw', 'deposit'))},
+                             format='json')
+        elif kind in ('transfer', 'self'):
+            self.client.post(reverse('balanceapp:transfer'),
+                             {'amount': amount, 'sender': first.pk,
+                              'recipient': first.pk if kind == 'self' else second.pk}, format='json')
+        else:
+            self.client.post(reverse('balanceapp:batch'), {'items': [
+                {'type': 'transfer', 'sender': first.pk, 'recipient': second.pk, 'amount': amount},
+                {'type': 'operation', 'customer': second.pk, 'amount': amount, 'operation': 'withdraw'},
+                {'type': 'transfer', 'sender': second.pk, 'recipient': first.pk, 'amount': amount / 2},
+            ]}, format='json')
+
+    def expected(self, customer, period):
+        """
+        Итоги, посчитанные по всему журналу
+        """
+        totals = {}
+        for transaction in Transaction.objects.filter(Q(sender=customer) | Q(recipient=customer)):
+            start = statements.period_start(timezone.localtime(transaction.timestamp).date(), period)
+            total = totals.setdefault(start, [Decimal(0), Decimal(0), 0, 0])
+            if transaction.recipient_id == customer.pk:
+                total[0] += transaction.amount
+                total[2] += 1
+            if transaction.sender_id == customer.pk:
+                total[1] += transaction.amount
+                total[3] += 1
+        return sorted((start, *total) for start, total in totals.items())
+
+    def actual(self, customer, period):
+        return list(StatementRollup.objects.filter(customer=customer, period=period).order_by('start').values_list(
+            'start', 'inflow', 'outflow', 'inflow_count', 'outflow_count'))
+
+    def assertRollups(self):
+        for customer in self.customers:
+            for period in statements.PERIODS:
+                self.assertEqual(self.actual(customer, period), self.expected(customer, period), (customer, period))
+
+    def test_rollups_follow_ledger(self):
+        self.assertEqual(StatementRollup.objects.filter(period='month').values('start').distinct().count(), 3)
+        self.assertRollups()
+
+    def test_rebuild(self):
+        first, second, third = self.customers
+        StatementRollup.objects.filter(customer=first).update(inflow=0)
+        StatementRollup.objects.filter(customer=second, period='day').delete()
+        Transaction.objects.bulk_create([Transaction(amount=10, recipient=third)])  # запись в обход services
+
+        statements.rebuild([first.pk, second.pk])
+        for customer in (first, second):
+            for period in statements.PERIODS:
+                self.assertEqual(self.actual(customer, period), self.expected(customer, period))
+        self.assertNotEqual(self.actual(third, 'day'), self.expected(third, 'day'))
+
+        call_command('rebuild_statements', stdout=io.StringIO())
+        self.assertRollups()
+
+    def test_statement_endpoint(self):
+        customer = self.customers[0]
+        url = reverse('balanceapp:transactions-statement', kwargs={'customer_id': customer.pk})
+        # проверка существования пользователя и чтение итогов
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'date_from': '2024-02-15', 'date_to': '2024-03-01'})
+        self.assertEqual(response.status_code, 200)
+        expected = [{'start': start.isoformat(), 'inflow': f'{inflow:.2f}', 'outflow': f'{outflow:.2f}',
+                     'net': f'{inflow - outflow:.2f}', 'inflow_count': inflow_count, 'outflow_count': outflow_count}
+                    for start, inflow, outflow, inflow_count, outflow_count in self.expected(customer, 'month')
+                    if start.month in (2, 3)]
+        self.assertEqual(len(expected), 2)
+        self.assertEqual(json.loads(response.content),
+                         {'id': customer.pk, 'period': 'month', 'valute': 'RUB', 'results': expected})
+
+        response = self.client.get(url, {'period': 'day', 'date_from': '2024-02-10', 'date_to': '2024-02-11'})
+        self.assertEqual([row['start'] for row in response.data['results']],
+                         [start.isoformat() for start, *_ in self.expected(customer, 'day')
+                          if start.isoformat() in ('2024-02-10', '2024-02-11')])
+
+        self.assertEqual(self.client.get(url, {'period': 'year'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'date_from': '2024-02-30'}).status_code, 400)
+        url = reverse('balanceapp:transactions-statement', kwargs={'customer_id': customer.pk + 100})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class SlowAsyncSource(FlakySource):
+    """
+    Источник курсов с неблокирующим медленным ответом
+    """
+    async def afetch(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {'USD': self.value}
+
+
+class AsyncEndpointsTestCase(TestCase):
+    """
+    Проверка асинхронных версий эндпоинтов: ответы совпадают с синхронными
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = Customer.objects.create(name="Daineris", balance=1000)
+        cls.second = Customer.objects.create(name="Khal", balance=1000)
+        for number in range(25):
+            services.transfer(cls.first.pk, cls.second.pk, number + 1)
+
+    def tearDown(self):
+        cache.clear()
+
+    async def test_slow_rates_do_not_block(self):
+        source = SlowAsyncSource(delay=0.3)
+        provider = RateProvider(source, cache_alias='default')
+        started = time.monotonic()
+        rates = await asyncio.gather(*[provider.aget_rate('USD') for _ in range(20)])
+        # ожидание ЦБ общее для всех запросов и не занимает поток
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(rates, [Decimal('86.6402')] * 20)
+        self.assertEqual(source.calls, 1)
+
+    async def test_customer_detail(self):
+        for params in ({}, {'currency': 'USD'}, {'currency': 'XXX'}):
+            sync_response = await sync_to_async(self.client.get)(
+                reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}), params)
+            response = await self.async_client.get(
+                reverse('balanceapp_async:customer-detail', kwargs={'pk': self.first.pk}), params)
+            self.assertEqual(response.status_code, sync_response.status_code)
+            # ссылки на страницы отличаются только префиксом /async/
+            self.assertEqual(json.loads(response.content.decode().replace('/balance/async/', '/balance/')),
+                             json.loads(sync_response.content))
+
+        response = await self.async_client.get(
+            reverse('balanceapp_async:customer-detail', kwargs={'pk': self.second.pk + 100}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_operations_and_transfer(self):
+        url = reverse('balanceapp_async:withdraw-deposit', kwargs={'customer_id': self.first.pk})
+        response = await self.async_client.post(url, {'amount': 100, 'operation': 'withdraw'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.post(url, {'amount': 5000, 'operation': 'deposit'},
+                                                content_type='application/json')
+        self.assertEqual((response.status_code, json.loads(response.content)),
+                         (400, {"error": "There are not enough funds in the account"}))
+        response = await self.async_client.post(url, {'amount': '100', 'operation': 'deposit'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.post(url, 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        url = reverse('balanceapp_async:transfer')
+        response = await self.async_client.post(url, {'amount': 50, 'sender': self.first.pk,
+                                                      'recipient': self.second.pk}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^lock;dur=\d+\.\d{2}$')
+        response = await self.async_client.post(url, {'amount': 50, 'sender': self.first.pk,
+                                                      'recipient': self.second.pk + 100},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+        await self.first.arefresh_from_db()
+        await self.second.arefresh_from_db()
+        self.assertEqual((self.first.balance, self.second.balance), (Decimal(1000 - 325 + 100 - 50), Decimal(1375)))
+
+    async def test_transactions(self):
+        for params in ({}, {'page': 2, 'order': '-amount'}, {'page': 3, 'order': 'timestamp'}, {'page': 4}):
+            sync_response = await sync_to_async(self.client.get)(
+                reverse('balanceapp:transactions', kwargs={'customer_id': self.first.pk}), params)
+            response = await self.async_client.get(
+                reverse('balanceapp_async:transactions', kwargs={'customer_id': self.first.pk}), params)
+            self.assertEqual(response.status_code, sync_response.status_code)
+            # ссылки на страницы отличаются только префиксом /async/
+            self.assertEqual(json.loads(response.content.decode().replace('/balance/async/', '/balance/')),
+                             json.loads(sync_response.content))
+
+
+class ConnectionPoolTestCase(APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Den", balance=1000)
+
+    def test_prepared_statements(self):
+        # после prepare_threshold выполнений запрос изменения баланса подготовлен на сервере
+        for _ in range(connection.settings_dict['OPTIONS']['prepare_threshold'] + 1):
+            services.credit(self.customer.pk, 1)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT statement FROM pg_prepared_statements')
+            prepared = [row[0] for row in cursor.fetchall()]
+        self.assertTrue(any('SET balance = balance +' in statement for statement in prepared))
+
+    def test_pgbouncer_mode(self):
+        settings_dict = {**connection.settings_dict,
+                         'OPTIONS': {**connection.settings_dict['OPTIONS'], 'pgbouncer': True}}
+        params = DatabaseWrapper(settings_dict, alias='pgbouncer').get_connection_params()
+        self.assertIsNone(params['prepare_threshold'])
+        self.assertNotIn('pool', params)
+        self.assertEqual(connection.get_connection_params()['prepare_threshold'],
+                         connection.settings_dict['OPTIONS']['prepare_threshold'])
+
+    def test_health(self):
+        response = self.client.get(reverse('balanceapp:health-db'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'ok')
+        stats = response.data['pools'][connection.settings_dict['NAME']]
+        self.assertGreaterEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['max_size'], connection.settings_dict['OPTIONS']['pool']['max_size'])
+
+        with mock.patch.object(connection, 'cursor', side_effect=OperationalError('connection refused')):
+            response = self.client.get(reverse('balanceapp:health-db'))
+        self.assertEqual((response.status_code, response.data['status']), (503, 'unavailable'))
+
+
+class ConnectionPoolReuseTestCase(APITransactionTestCase):
+    def test_connections_are_reused(self):
+        def request():
+            Customer.objects.exists()
+            connection.close()  # как в конце запроса: соединение возвращается в пул
+
+        request()
+        before = pool_stats()[connection.settings_dict['NAME']]
+        threads = [threading.Thread(target=request) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        after = pool_stats()[connection.settings_dict['NAME']]
+        self.assertEqual(after['checkouts'] - before['checkouts'], 10)
+        # новые соединения открываются только до размера пула
+        self.assertLessEqual(after['connections_opened'], after['max_size'])
+        self.assertEqual(after['timeouts'], 0)
+
+
+class MetricsTestCase(APITestCase):
+    SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})? (\S+)$')
+
+    def setUp(self):
+        self.first = Customer.objects.create(name="Den", balance=1000)
+        self.second = Customer.objects.create(name="Alex", balance=1000)
+        get_rate_provider.cache_clear()  # без последней таблицы, сохраненной другими тестами
+
+    def tearDown(self):
+        cache.clear()
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line.startswith('#'):
+                continue
+            name, _, labels, value = self.SAMPLE.match(line).groups()
+            labels = tuple(sorted(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or '')))
+            samples[name, labels] = float(value)
+        return samples
+
+    def sample(self, samples, name, **labels):
+        return samples.get((name, tuple(sorted(labels.items()))), 0)
+
+    def test_routes(self):
+        before = self.scrape()
+        self.client.get(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}), {'currency': 'USD'})
+        self.client.get(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}), {'currency': 'USD'})
+        self.client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': self.first.pk}),
+                         {'amount': 100, 'operation': 'withdraw'}, format='json')
+        self.client.post(reverse('balanceapp:transfer'),
+                         {'amount': 50, 'sender': self.first.pk, 'recipient': self.second.pk}, format='json')
+        self.client.get('/balance/no-such-page/')
+        after = self.scrape()
+
+        def delta(name, **labels):
+            return self.sample(after, name, **labels) - self.sample(before, name, **labels)
+
+        detail = {'route': 'balanceapp:customer-detail', 'method': 'GET'}
+        self.assertEqual(delta('http_requests_total', status='200', **detail), 2)
+        self.assertEqual(delta('http_request_duration_seconds_count', **detail), 2)
+        self.assertEqual(delta('http_request_duration_seconds_bucket', le='+Inf', **detail), 2)
+        # пользователь читается из базы один раз, второй запрос - из кэша пользователей;
+        # курс на сегодня ищется в истории курсов при каждом запросе
+        self.assertEqual(delta('http_request_db_queries_sum', **detail), 3)
+        self.assertGreater(delta('http_request_db_duration_seconds_sum', **detail), 0)
+        # таблица курсов загружается один раз, второй запрос попадает в кэш
+        self.assertEqual(delta('cbr_fetch_duration_seconds_count', source='FixtureSource', result='ok'), 1)
+        self.assertEqual(delta('rates_cache_requests_total', result='miss'), 1)
+        self.assertEqual(delta('rates_cache_requests_total', result='hit'), 1)
+
+        operations = {'route': 'balanceapp:withdraw-deposit', 'method': 'POST'}
+        self.assertEqual(delta('http_requests_total', status='200', **operations), 1)
+        self.assertEqual(delta('balance_lock_wait_seconds_count', operation='credit'), 1)
+        transfer = {'route': 'balanceapp:transfer', 'method': 'POST'}
+        self.assertEqual(delta('http_request_lock_wait_seconds_count', **transfer), 1)
+        self.assertGreater(delta('http_request_lock_wait_seconds_sum', **transfer), 0)
+        self.assertEqual(delta('balance_lock_wait_seconds_count', operation='transfer'), 1)
+        # несуществующие пути не создают отдельных серий
+        self.assertEqual(delta('http_requests_total', route='unmatched', method='GET', status='404'), 1)
+
+        database = connection.settings_dict['NAME']
+        self.assertGreater(self.sample(after, 'db_pool_checkouts_total', database=database), 0)
+        self.assertEqual(self.sample(after, 'db_pool_max_size', database=database),
+                         connection.settings_dict['OPTIONS']['pool']['max_size'])
+
+    def test_streaming_response_latency(self):
+        customer = self.first
+        for number in range(3):
+            Transaction.objects.create(recipient=customer, amount=100 + number)
+        export = {'route': 'balanceapp:transactions-export', 'method': 'GET'}
+        before = self.scrape()
+        response = self.client.get(reverse('balanceapp:transactions-export', kwargs={'customer_id': customer.pk}))
+        # до чтения тела время ответа не записано
+        self.assertEqual(self.sample(self.scrape(), 'http_request_duration_seconds_count', **export),
+                         self.sample(before, 'http_request_duration_seconds_count', **export))
+        content = b''.join(response.streaming_content)
+        response.close()
+        after = self.scrape()
+
+        self.assertEqual(len(content.decode().splitlines()), 4)
+        self.assertEqual(self.sample(after, 'http_request_duration_seconds_count', **export)
+                         - self.sample(before, 'http_request_duration_seconds_count', **export), 1)
+        # запросы выгрузки выполняются при чтении тела и учитываются в запросе
+        self.assertGreater(self.sample(after, 'http_request_db_queries_sum', **export)
+                           - self.sample(before, 'http_request_db_queries_sum', **export), 0)
+
+    def test_label_escaping(self):
+        metrics.ADMISSION_REJECTED.labels(reason='a"b').inc()
+        self.assertIn('admission_rejected_total{reason="a\\"b"} 1.0', metrics.render())
+
+
+
+# кэш пользователей отключен: все чтения идут в базу
+@override_settings(REPLICATION={'REPLICAS': ['replica'], 'MAX_LAG': 1.0, 'CHECK_INTERVAL': 60, 'CACHE': 'default'},
+                   CUSTOMER_CACHE={'LOCAL_SIZE': 0})
+class ReplicaRoutingTestCase(APITransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        routers.reset_lags()
+        self.first = Customer.objects.create(name="Den", balance=1000)
+        self.second = Customer.objects.create(name="Alex", balance=1000)
+
+    def tearDown(self):
+        routers.reset_lags()
+        cache.clear()
+
+    def get(self, url, **params):
+        """
+        GET-запрос, возвращает ответ и SQL-запросы к основной базе и к реплике
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(url, params)
+        return response, [query['sql'] for query in primary], [query['sql'] for query in replica]
+
+    def test_reads_go_to_replica(self):
+        response, primary, replica = self.get(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}))
+        self.assertEqual(response.data['balance'], '1000.00')
+        self.assertEqual(primary, [])
+        self.assertTrue(any('balanceapp_customer' in sql for sql in replica))
+
+        response, primary, replica = self.get(reverse('balanceapp:transactions',
+                                                      kwargs={'customer_id': self.first.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(primary, [])
+        self.assertTrue(any('balanceapp_transaction' in sql for sql in replica))
+
+        # запись и чтение внутри нее - на основной базе
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': self.first.pk}),
+                                        {'amount': 100, 'operation': 'withdraw'}, format='json')
+        self.assertEqual((response.status_code, len(replica)), (200, 0))
+
+    def test_read_your_writes(self):
+        self.get(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}))  # проверка отставания
+        self.client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': self.first.pk}),
+                         {'amount': 100, 'operation': 'withdraw'}, format='json')
+
+        # реплика проверена до записи: данные пользователя читаются с основной базы
+        response, primary, replica = self.get(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}))
+        self.assertEqual(response.data['balance'], '1100.00')
+        self.assertEqual(replica, [])
+        self.assertTrue(primary)
+        # у другого пользователя записей не было
+        _, primary, replica = self.get(reverse('balanceapp:customer-detail', kwargs={'pk': self.second.pk}))
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+        # после новой проверки реплика уже содержит запись
+        routers.reset_lags()
+        response, primary, replica = self.get(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}))
+        self.assertEqual(response.data['balance'], '1100.00')
+        self.assertEqual(primary, [])
+
+    def test_read_your_writes_without_lag(self):
+        # реплика без отставания по времени, но еще не получившая WAL записи, не читает данные пользователя
+        self.client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': self.first.pk}),
+                         {'amount': 100, 'operation': 'withdraw'}, format='json')
+        with mock.patch.object(routers, 'LAG_SQL', "SELECT 0, pg_current_wal_lsn() - '0/0'::pg_lsn - 1"):
+            response, primary, replica = self.get(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}))
+        self.assertEqual(response.data['balance'], '1100.00')
+        self.assertEqual(len(replica), 1)  # только проверка реплики
+        self.assertTrue(primary)
+
+    def test_list_falls_back_for_stale_page(self):
+        _, primary, replica = self.get(reverse('balanceapp:customer-list'))
+        self.assertEqual(primary, [])
+        self.client.patch(reverse('balanceapp:customer-detail', kwargs={'pk': self.second.pk}), {'name': 'Bob'},
+                          format='json')
+
+        response, primary, replica = self.get(reverse('balanceapp:customer-list'))
+        self.assertEqual([row['name'] for row in response.data['results']], ['Den', 'Bob'])
+        # страница прочитана с реплики, но на ней есть пользователь с более поздней записью
+        self.assertTrue(replica)
+        self.assertTrue(any('balanceapp_customer' in sql for sql in primary))
+
+    def test_lag_threshold(self):
+        url = reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk})
+        with mock.patch.object(routers, 'LAG_SQL', 'SELECT 5, 0'):
+            _, primary, replica = self.get(url)
+        self.assertEqual(len(replica), 1)  # только проверка отставания
+        self.assertTrue(primary)
+
+        routers.reset_lags()
+        with mock.patch.object(routers, 'LAG_SQL', 'SELECT 1 / 0'):  # реплика недоступна
+            response, primary, replica = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(primary)
+        self.assertEqual(routers.replica_state('replica'), (None, None))
+
+
+class CustomerCacheTestCase(APITestCase):
+    def setUp(self):
+        get_customer_cache.cache_clear()
+        self.customer_cache = get_customer_cache()
+        self.first = Customer.objects.create(name="Den", balance=1000)
+        self.second = Customer.objects.create(name="Alex", balance=1000)
+
+    def tearDown(self):
+        get_customer_cache.cache_clear()
+        cache.clear()
+
+    def detail(self, customer):
+        return self.client.get(reverse('balanceapp:customer-detail', kwargs={'pk': customer.pk}))
+
+    def operation(self, customer, amount, operation):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': customer.pk}),
+                                    {'amount': amount, 'operation': operation}, format='json')
+
+    def test_hot_reads_skip_database(self):
+        self.assertEqual(self.detail(self.first).data['balance'], '1000.00')
+        with self.assertNumQueries(0):
+            response = self.detail(self.first)
+        self.assertEqual(response.data, {'id': self.first.pk, 'name': 'Den', 'balance': '1000.00', 'valute': 'RUB'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.detail(self.first).status_code, 200)
+        self.assertEqual(self.client.get(reverse('balanceapp:customer-detail', kwargs={'pk': 10 ** 9})).status_code,
+                         404)
+
+    def test_write_through(self):
+        self.detail(self.first)
+        self.operation(self.first, 100, 'withdraw')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.detail(self.first).data['balance'], '1100.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('balanceapp:transfer'),
+                             {'amount': 300, 'sender': self.first.pk, 'recipient': self.second.pk}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('balanceapp:batch'), {'items': [
+                {'type': 'operation', 'customer': self.second.pk, 'amount': 50, 'operation': 'deposit'},
+            ]}, format='json')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.detail(self.first).data['balance'], '800.00')
+            self.assertEqual(self.detail(self.second).data['balance'], '1250.00')
+        self.assertEqual(self.customer_cache.get(self.second.pk).version, 2)
+
+    def test_stale_fill_is_ignored(self):
+        stale = Customer.objects.get(pk=self.first.pk)  # прочитан до операции
+        self.operation(self.first, 100, 'withdraw')
+        self.customer_cache.fill(stale)
+        self.assertEqual(self.customer_cache.get(self.first.pk).balance, Decimal('1100.00'))
+
+        # запоздавшая запись с более старой версией тоже не применяется
+        self.customer_cache.put(self.first.pk, 0, 'Den', Decimal('1'))
+        self.assertEqual(self.detail(self.first).data['balance'], '1100.00')
+
+    def test_rolled_back_write_is_not_cached(self):
+        self.detail(self.first)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            services.credit(self.first.pk, 100)
+            raise RuntimeError
+        self.assertIsNone(self.customer_cache.get(self.first.pk))
+        self.assertEqual(self.detail(self.first).data['balance'], '1000.00')
+
+    def test_orm_changes_invalidate(self):
+        self.detail(self.first)
+        self.client.patch(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}), {'name': 'Bob'},
+                          format='json')
+        self.assertEqual(self.detail(self.first).data['name'], 'Bob')
+
+        self.client.delete(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}))
+        self.assertEqual(self.detail(self.first).status_code, 404)
+
+    def test_operations_do_not_trust_cache(self):
+        # даже испорченный кэш не разрешает списание сверх баланса в базе
+        self.customer_cache.put(self.first.pk, 10 ** 6, 'Den', Decimal('1000000'))
+        response = self.operation(self.first, 5000, 'deposit')
+        self.assertEqual((response.status_code, response.data), (400, {"error": "There are not enough funds in the account"}))
+
+    @override_settings(CUSTOMER_CACHE={'SHARED': 'default', 'LOCAL_TIMEOUT': 60})
+    def test_shared_tier(self):
+        customer_cache = get_customer_cache()
+        self.detail(self.first)
+        customer_cache.local.clear()  # как в другом воркере
+        with self.assertNumQueries(0):
+            self.assertEqual(self.detail(self.first).data['balance'], '1000.00')
+
+        self.operation(self.first, 100, 'withdraw')
+        customer_cache.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.detail(self.first).data['balance'], '1100.00')
+        customer_cache.put(self.first.pk, 0, 'Den', Decimal('1'))
+        customer_cache.local.clear()
+        self.assertEqual(customer_cache.get(self.first.pk).balance, Decimal('1100.00'))
+
+    @override_settings(CUSTOMER_CACHE={'SHARED': 'default', 'LOCAL_TIMEOUT': 60})
+    def test_stale_fill_after_rename(self):
+        customer_cache = get_customer_cache()
+        stale = Customer.objects.get(pk=self.first.pk)  # прочитан до изменения имени
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('balanceapp:customer-detail', kwargs={'pk': self.first.pk}),
+                                         {'name': 'Bob'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Customer.objects.get(pk=self.first.pk).version, stale.version + 1)
+
+        # запоздавшее заполнение старыми данными не возвращает прежнее имя ни в один из уровней
+        customer_cache.fill(stale)
+        self.assertEqual(customer_cache.get(self.first.pk).name, 'Bob')
+        customer_cache.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.detail(self.first).data['name'], 'Bob')
+
+    def test_version_bumped_once(self):
+        # сохранение через ORM увеличивает версию тем же UPDATE, экземпляр получает новое значение
+        customer = Customer.objects.get(pk=self.first.pk)
+        customer.name = 'Bob'
+        customer.save()
+        self.assertEqual(customer.version, 1)
+        customer.save(update_fields=['name'])
+        self.assertEqual(Customer.objects.get(pk=self.first.pk).version, customer.version)
+        self.assertEqual(customer.version, 2)
+
+        # set_slots задает версию сам, сохранение не увеличивает ее второй раз
+        self.assertEqual(slots.set_slots(self.first.pk, 2).version, 3)
+        self.assertEqual(slots.set_slots(self.first.pk, 0).version, 4)
+        self.assertEqual(Customer.objects.get(pk=self.first.pk).version, 4)
+
+    def test_local_tier_lru(self):
+        local = LocalTier(size=2, timeout=60)
+        local.put(1, 1, 'a', Decimal(1))
+        local.put(2, 1, 'b', Decimal(2))
+        local.get(1)
+        local.put(3, 1, 'c', Decimal(3))
+        self.assertEqual((local.get(1)[1], local.get(2), local.get(3)[1]), ('a', None, 'c'))
+
+        expired = LocalTier(size=2, timeout=0)
+        expired.put(1, 5, 'a', Decimal(1))
+        self.assertIsNone(expired.get(1))
+        self.assertTrue(expired.put(1, 4, 'a', Decimal(1)))  # устаревшая по времени запись перезаписывается
+
+    def test_hit_ratio_metrics(self):
+        def sample(result):
+            return metrics.REGISTRY.get_sample_value('customer_cache_requests_total',
+                                                     {'tier': 'local', 'result': result}) or 0
+
+        hits, misses = sample('hit'), sample('miss')
+        for _ in range(4):
+            self.detail(self.first)
+        self.assertEqual((sample('hit') - hits, sample('miss') - misses), (3, 1))
+        self.assertIn('customer_cache_requests_total{result="hit",tier="local"}', metrics.render())
+
+
+class ExchangeRateTestCase(APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Den", balance=866402)
+        moments = [datetime(2024, 7, 22, 10, tzinfo=dt_timezone.utc),
+                   datetime(2024, 7, 24, 10, tzinfo=dt_timezone.utc),
+                   datetime(2024, 7, 27, 10, tzinfo=dt_timezone.utc),  # суббота - курс пятницы
+                   datetime(2024, 7, 1, 10, tzinfo=dt_timezone.utc)]  # до начала истории курсов
+        for moment in moments:
+            transaction = Transaction.objects.create(amount=Decimal('1000.00'), recipient=self.customer)
+            Transaction.objects.filter(pk=transaction.pk).update(timestamp=moment)
+
+    def import_rates(self, *args):
+        out = io.StringIO()
+        call_command('import_rates', '--offline', *args, stdout=out)
+        return out.getvalue().strip()
+
+    def test_incremental_import(self):
+        self.assertEqual(self.import_rates('--since', '2024-07-20', '--until', '2024-07-24'),
+                         'Imported 24 rate(s) for 3 day(s)')
+        # продолжение с дня после последней загруженной даты, выходные не дают новых курсов
+        self.assertEqual(self.import_rates('--until', '2024-07-28'), 'Imported 16 rate(s) for 2 day(s)')
+        self.assertEqual(self.import_rates('--until', '2024-07-28'), 'Imported 0 rate(s) for 0 day(s)')
+
+        self.assertEqual(ExchangeRate.objects.get(code='USD', date=date(2024, 7, 26)).rate, Decimal('86.6402'))
+        # курс за одну единицу валюты (Nominal = 100)
+        self.assertEqual(ExchangeRate.objects.get(code='KZT', date=date(2024, 7, 26)).rate, Decimal('0.182361'))
+        with self.assertRaises(CommandError):
+            call_command('import_rates', '--offline', '--since', 'yesterday')
+
+    def test_transactions_in_currency(self):
+        self.import_rates('--since', '2024-07-22', '--until', '2024-07-28')
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.customer.pk})
+        with self.assertNumQueries(2):
+            plain = self.client.get(url, {'order': 'timestamp'})
+        # курсы для всей страницы - одним запросом
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'order': 'timestamp', 'currency': 'USD'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], plain.data['count'])
+        usd = {day: ExchangeRate.objects.get(code='USD', date=day).rate
+               for day in (date(2024, 7, 22), date(2024, 7, 24), date(2024, 7, 26))}
+        self.assertEqual([(row['amount'], row['valute']) for row in response.data['results']], [
+            (None, 'USD'),
+            (str(round(Decimal(1000) / usd[date(2024, 7, 22)], 2)), 'USD'),
+            (str(round(Decimal(1000) / usd[date(2024, 7, 24)], 2)), 'USD'),
+            ('11.54', 'USD'),
+        ])
+        self.assertEqual([row['id'] for row in response.data['results']],
+                         [row['id'] for row in plain.data['results']])
+
+        response = self.client.get(url, {'currency': 'XXX'})
+        self.assertEqual((response.status_code, response.data), (400, {"error": "the currency was not found"}))
+
+    def test_customers_in_currency(self):
+        self.import_rates('--since', '2024-07-22', '--until', '2024-07-26')
+        response = self.client.get(reverse('balanceapp:customer-list'), {'currency': 'USD'})
+        self.assertEqual(response.status_code, 200)
+        # последний курс из истории
+        self.assertEqual(response.data['results'], [
+            {'id': self.customer.pk, 'name': 'Den', 'balance': '10000.00', 'valute': 'USD'}])
+
+        response = self.client.get(reverse('balanceapp:customer-list'), {'currency': 'XXX'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_current_rate_is_per_unit(self):
+        detail = reverse('balanceapp:customer-detail', kwargs={'pk': self.customer.pk})
+        customers = reverse('balanceapp:customer-list')
+        # истории курсов еще нет: курс от поставщика курсов ЦБ, за одну единицу валюты (Nominal = 100)
+        for currency in ('KZT', 'JPY'):
+            listed = self.client.get(customers, {'currency': currency})
+            self.assertEqual(listed.status_code, 200)
+            self.assertEqual(listed.data['results'][0]['balance'],
+                             self.client.get(detail, {'currency': currency}).data['balance'])
+        self.assertEqual(listed.data['results'][0]['balance'], str(round(Decimal(866402) / Decimal('0.562208'), 2)))
+
+        # курс на сегодня из истории
+        ExchangeRate.objects.create(code='KZT', date=timezone.localdate(), rate=Decimal('0.2'))
+        self.assertEqual(self.client.get(customers, {'currency': 'KZT'}).data['results'][0]['balance'], '4332010.00')
+        self.assertEqual(self.client.get(detail, {'currency': 'KZT'}).data['balance'], '4332010.00')
+
+
+class BalanceSlotTestCase(APITestCase):
+    """
+    Проверка счета со слотами баланса: зачисления в слоты, списания из строки пользователя и слотов
+    """
+    def setUp(self):
+        self.hot = Customer.objects.create(name="Avito", balance=100)
+        self.other = Customer.objects.create(name="Den", balance=1000)
+        out = io.StringIO()
+        call_command('balance_slots', self.hot.pk, '--slots', '4', stdout=out)
+        self.assertEqual(out.getvalue().strip(), f'Customer {self.hot.pk} now has 4 balance slot(s)')
+
+    def operation(self, customer, amount, operation):
+        return self.client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': customer.pk}),
+                                {'amount': amount, 'operation': operation}, format='json')
+
+    def balance(self, customer):
+        return Decimal(self.client.get(reverse('balanceapp:customer-detail', kwargs={'pk': customer.pk})).data['balance'])
+
+    def test_credits_go_to_slots(self):
+        for _ in range(20):
+            self.assertEqual(self.operation(self.hot, 10, 'withdraw').status_code, 200)
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, 100)  # строка пользователя не изменяется
+        self.assertEqual(sum(slot.balance for slot in self.hot.slots.all()), 200)
+        self.assertEqual(self.balance(self.hot), 300)
+        listed = self.client.get(reverse('balanceapp:customer-list')).data['results']
+        self.assertEqual(listed[0]['balance'], '300.00')
+
+        # итоги выписки разделены по слотам, выписка их складывает
+        self.assertGreater(StatementRollup.objects.filter(customer=self.hot, period='month').count(), 1)
+        statement = self.client.get(reverse('balanceapp:transactions-statement',
+                                            kwargs={'customer_id': self.hot.pk})).data['results']
+        self.assertEqual([(row['inflow'], row['inflow_count']) for row in statement], [('200.00', 20)])
+
+    def test_debit_draws_across_slots(self):
+        for _ in range(20):
+            self.operation(self.hot, 10, 'withdraw')
+        self.assertEqual(self.operation(self.hot, 250, 'deposit').status_code, 200)
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, 0)
+        self.assertEqual(self.balance(self.hot), 50)
+        self.assertTrue(all(slot.balance >= 0 for slot in self.hot.slots.all()))
+
+        response = self.operation(self.hot, 60, 'deposit')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.balance(self.hot), 50)
+        self.assertEqual(Transaction.objects.filter(sender=self.hot).count(), 1)
+
+    def test_transfers_and_batch(self):
+        transfer = reverse('balanceapp:transfer')
+        self.assertEqual(self.client.post(transfer, {'sender': self.other.pk, 'recipient': self.hot.pk,
+                                                     'amount': 300}, format='json').status_code, 200)
+        self.assertEqual(self.client.post(transfer, {'sender': self.hot.pk, 'recipient': self.other.pk,
+                                                     'amount': 350}, format='json').status_code, 200)
+        self.assertEqual(self.client.post(transfer, {'sender': self.hot.pk, 'recipient': self.other.pk,
+                                                     'amount': 51}, format='json').status_code, 400)
+        self.assertEqual((self.balance(self.hot), self.balance(self.other)), (50, 1050))
+
+        response = self.client.post(reverse('balanceapp:batch'), {'items': [
+            {'type': 'operation', 'customer': self.hot.pk, 'amount': 20, 'operation': 'withdraw'},
+            {'type': 'transfer', 'sender': self.hot.pk, 'recipient': self.other.pk, 'amount': 60},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.balance(self.hot), self.balance(self.other)), (10, 1110))
+
+        # баланс по журналу и снимкам учитывает слоты
+        as_of = self.client.get(reverse('balanceapp:balance-as-of', kwargs={'customer_id': self.hot.pk}),
+                                {'as_of': (timezone.now() + timedelta(hours=1)).isoformat()})
+        self.assertEqual(as_of.data['balance'], '10.00')
+        ledger.create_checkpoints(timezone.now() + timedelta(hours=1))
+        self.assertEqual(BalanceCheckpoint.objects.get(customer=self.hot).balance, 10)
+
+    def test_disable_slots(self):
+        for _ in range(5):
+            self.operation(self.hot, 10, 'withdraw')
+        call_command('balance_slots', self.hot.pk, '--slots', '0', stdout=io.StringIO())
+        self.hot.refresh_from_db()
+        self.assertEqual((self.hot.balance, self.hot.balance_slots, self.hot.slots.count()), (150, 0, 0))
+        self.assertEqual(self.operation(self.hot, 10, 'withdraw').status_code, 200)
+        self.assertEqual(self.balance(self.hot), 160)
+
+        with self.assertRaises(CommandError):
+            call_command('balance_slots', 0, '--slots', '4', stdout=io.StringIO())
+
+
+# одновременные записи по одному счету проверяют базу, а не лимиты: контроль допуска (admission.py) выключен
+@override_settings(ADMISSION={'ENABLED': False})
+class BalanceSlotConcurrencyTestCase(APITransactionTestCase):
+    """
+    Одновременные зачисления и списания по счету со слотами баланса
+    """
+    def test_concurrent_transfers_to_hot_account(self):
+        hot = Customer.objects.create(name="Avito", balance=0)
+        slots.set_slots(hot.pk, 8)
+        senders = [Customer.objects.create(name=f"Den {number}", balance=1000) for number in range(10)]
+
+        def send(client, number):
+            # нечетные потоки списывают со счета площадки, четные переводят на него
+            if number % 2:
+                return client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': hot.pk}),
+                                   json.dumps({'amount': 5, 'operation': 'deposit'}), content_type='application/json')
+            return client.post(reverse('balanceapp:transfer'),
+                               json.dumps({'amount': 10, 'sender': senders[number].pk, 'recipient': hot.pk}),
+                               content_type='application/json')
+
+        statuses = run_in_threads(10, 20, send)
+
+        self.assertEqual(statuses.count(200) + statuses.count(400), 200)
+        credited = Transaction.objects.filter(recipient=hot).aggregate(total=Sum('amount'))['total']
+        debited = Transaction.objects.filter(sender=hot).aggregate(total=Sum('amount'))['total'] or 0
+        self.assertEqual(credited, 1000)
+        hot.refresh_from_db()
+        self.assertEqual(hot.total_balance, credited - debited)
+        self.assertTrue(all(slot.balance >= 0 for slot in hot.slots.all()))
+        self.assertGreaterEqual(hot.balance, 0)
+
+
+class TransactionPartitionTestCase(APITestCase):
+    """
+    Проверка месячных секций журнала транзакций: создание секций, перенос из секции по умолчанию, отсоединение
+    """
+    def setUp(self):
+        self.sender = Customer.objects.create(name="Den", balance=1000)
+        self.recipient = Customer.objects.create(name="Antonio Banderas")
+
+    def partition_of(self, transaction):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT tableoid::regclass::text FROM {partitions.PARENT_TABLE} WHERE id = %s',
+                           [transaction.pk])
+            return cursor.fetchone()[0]
+
+    def old_transaction(self, moment):
+        transaction = Transaction.objects.create(amount=10, sender=self.sender, recipient=self.recipient)
+        Transaction.objects.filter(pk=transaction.pk).update(timestamp=moment)
+        return transaction
+
+    def test_partitions_ahead(self):
+        month = timezone.localdate().replace(day=1)
+        names = [partition.name for partition in partitions.list_partitions()]
+        for count in range(4):
+            self.assertIn(partitions.partition_name(partitions.add_months(month, count)), names)
+        self.assertEqual(names[-1], partitions.DEFAULT_PARTITION)
+
+        transaction = Transaction.objects.create(amount=10, sender=self.sender, recipient=self.recipient)
+        self.assertEqual(self.partition_of(transaction), partitions.partition_name(month))
+        self.assertEqual(partitions.ensure_partitions(), [])
+
+    def test_default_partition_split(self):
+        transaction = self.old_transaction(timezone.make_aware(datetime(2020, 5, 10, 12)))
+        self.assertEqual(self.partition_of(transaction), partitions.DEFAULT_PARTITION)
+
+        self.assertEqual(partitions.ensure_partitions(), ['balanceapp_transaction_p202005'])
+        self.assertEqual(self.partition_of(transaction), 'balanceapp_transaction_p202005')
+
+    def test_history_period(self):
+        old = self.old_transaction(timezone.make_aware(datetime(2020, 5, 31, 23)))
+        self.old_transaction(timezone.make_aware(datetime(2020, 6, 1)))
+        recent = Transaction.objects.create(amount=10, sender=self.sender, recipient=self.recipient)
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.sender.pk})
+
+        response = self.client.get(url, {'date_from': '2020-05-01', 'date_to': '2020-05-31'})
+        self.assertEqual([row['id'] for row in response.data['results']], [old.pk])
+        response = self.client.get(url, {'date_from': '2020-07-01', 'pagination': 'cursor'})
+        self.assertEqual([row['id'] for row in response.data['results']], [recent.pk])
+        response = self.client.get(url, {'date_to': '31.05.2020'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "Dates must be in ISO 8601 format"})
+
+    def test_detach(self):
+        old = self.old_transaction(timezone.make_aware(datetime(2020, 5, 10)))
+        partitions.ensure_partitions()
+        out = io.StringIO()
+        call_command('transaction_partitions', '--detach-before', '2020-06', stdout=out)
+        self.assertIn('Detached balanceapp_transaction_p202005', out.getvalue())
+
+        # транзакции отсоединенной секции не видны в журнале, но остаются в ее таблице
+        self.assertFalse(Transaction.objects.filter(pk=old.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM balanceapp_transaction_p202005')
+            self.assertEqual(cursor.fetchall(), [(old.pk,)])
+        self.assertNotIn('balanceapp_transaction_p202005',
+                         [partition.name for partition in partitions.list_partitions()])
+
+        with self.assertRaises(CommandError):
+            call_command('transaction_partitions', '--detach-before', '2020-13', stdout=out)
+        with self.assertRaises(CommandError):
+            call_command('transaction_partitions', '--retention', stdout=out)
+
+
+class TransactionArchiveTestCase(APITestCase):
+    """
+    Проверка архива старых месяцев журнала: перенос в файлы и чтение истории и выгрузки из архива
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(TRANSACTION_ARCHIVE={'PATH': directory.name, 'AFTER_MONTHS': 12})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.root = Path(directory.name)
+
+        self.customer = Customer.objects.create(name="Den", balance=1000)
+        self.other = Customer.objects.create(name="Antonio Banderas")
+        self.moments = [timezone.make_aware(datetime(2020, month, day, 12)) for month, day in
+                        ((4, 3), (4, 20), (5, 1), (5, 31), (6, 15))]
+        self.old = []
+        for number, moment in enumerate(self.moments):
+            sender, recipient = (self.customer, self.other) if number % 2 else (self.other, self.customer)
+            transaction = Transaction.objects.create(amount=(number + 1) * 100, sender=sender, recipient=recipient)
+            Transaction.objects.filter(pk=transaction.pk).update(timestamp=moment)
+            self.old.append(transaction.pk)
+        # зачисление без отправителя и перевод самому себе
+        self.recent = [Transaction.objects.create(amount=50, recipient=self.customer).pk,
+                       Transaction.objects.create(amount=250, sender=self.customer, recipient=self.customer).pk]
+
+        out = io.StringIO()
+        call_command('archive_transactions', '--before', '2020-06', stdout=out)
+        self.assertIn('Archived 2 month(s) before 2020-06', out.getvalue())
+
+    def history(self, **params):
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.customer.pk})
+        pages = [self.client.get(url, params).data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+        return pages[0]['count'], [row['id'] for page in pages for row in page['results']]
+
+    def test_months_moved_to_files(self):
+        self.assertEqual(archive.archived_months(), [date(2020, 4, 1), date(2020, 5, 1)])
+        self.assertEqual(Transaction.objects.filter(pk__in=self.old).count(), 1)  # июнь остался в базе
+        self.assertNotIn('balanceapp_transaction_p202004',
+                         [partition.name for partition in partitions.list_partitions()])
+        self.assertEqual(partitions.detached_partitions(), [])
+
+        index = json.loads((self.root / '202005' / 'index.json').read_text())
+        self.assertEqual(index['customers'][str(self.customer.pk)],
+                         {'file': f'{self.customer.pk}.jsonl.gz', 'rows': 2,
+                          'first': '2020-05-01T12:00:00+00:00', 'last': '2020-05-31T12:00:00+00:00',
+                          'min_id': self.old[2], 'max_id': self.old[3], 'min_amount': '300.00',
+                          'max_amount': '400.00'})
+        rows = list(archive.read_file(self.root / '202004' / f'{self.other.pk}.jsonl.gz'))
+        self.assertEqual([(row[0], row[1]) for row in rows],
+                         [(self.old[0], Decimal('100')), (self.old[1], Decimal('200'))])
+
+    def test_history_reads_archive(self):
+        count, ids = self.history()
+        self.assertEqual(count, 7)
+        self.assertEqual(ids, sorted(self.old + self.recent))
+
+        count, ids = self.history(order='-amount')
+        self.assertEqual(ids, [self.old[4], self.old[3], self.old[2], self.recent[1], self.old[1], self.old[0],
+                               self.recent[0]])
+        count, ids = self.history(order='timestamp', pagination='cursor')
+        self.assertEqual(ids, self.old + self.recent)
+
+        count, ids = self.history(date_from='2020-04-10', date_to='2020-05-31')
+        self.assertEqual(ids, self.old[1:4])
+        # период без архивированных месяцев архив не читает
+        with mock.patch.object(archive, 'read_file') as read_file:
+            count, ids = self.history(date_from='2020-06-01')
+        read_file.assert_not_called()
+        self.assertEqual(ids, [self.old[4]] + self.recent)
+
+    def test_history_reads_archive_lazily(self):
+        queryset = Transaction.objects.for_customer(self.customer.pk)
+        history = archive.history(queryset, self.customer.pk)
+        path = self.root / '202005' / f'{self.customer.pk}.jsonl.gz'
+        with mock.patch.object(archive, 'read_file', wraps=archive.read_file) as read_file:
+            # число строк - из индекса, первая страница новых транзакций архив не читает
+            self.assertEqual(history.count(), 7)
+            rows = history.order_by('-timestamp', '-id')[:3]
+            self.assertEqual([row.id for row in rows], self.recent[::-1] + [self.old[4]])
+            read_file.assert_not_called()
+
+            # страница, захватывающая архив, читает только нужный месяц
+            rows = history.order_by('-timestamp', '-id')[2:4]
+            self.assertEqual([row.id for row in rows], [self.old[4], self.old[3]])
+            self.assertEqual([call.args[0] for call in read_file.call_args_list], [path])
+
+            # курсор дальше файла апреля по индексу: апрель не читается
+            read_file.reset_mock()
+            rows = history.order_by('amount', 'id').filter(Q(amount__gt=250)).values_list('id', 'amount', named=True)[:]
+            self.assertEqual([row.id for row in rows], self.old[2:])
+            self.assertEqual([call.args[0] for call in read_file.call_args_list], [path])
+
+    async def test_async_history_reads_archive(self):
+        for params in ({}, {'order': '-amount', 'page': 1}, {'order': 'timestamp', 'date_to': '2020-05-15'}):
+            with self.subTest(params=params):
+                sync_response = await sync_to_async(self.client.get)(
+                    reverse('balanceapp:transactions', kwargs={'customer_id': self.customer.pk}), params)
+                response = await self.async_client.get(
+                    reverse('balanceapp_async:transactions', kwargs={'customer_id': self.customer.pk}), params)
+                self.assertEqual(json.loads(response.content.decode().replace('/balance/async/', '/balance/')),
+                                 json.loads(sync_response.content))
+
+    def test_export_reads_archive(self):
+        url = reverse('balanceapp:transactions-export', kwargs={'customer_id': self.customer.pk})
+        response = self.client.get(url, {'format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], self.old + self.recent)
+        self.assertEqual(rows[0], {'id': self.old[0], 'amount': '100.00', 'timestamp': '2020-04-03T12:00:00Z',
+                                   'description': None, 'sender': self.other.pk, 'recipient': self.customer.pk})
+
+    def test_ledger_after_archive(self):
+        # снимки на границу архива сделаны до удаления секций
+        self.assertEqual(dict(BalanceCheckpoint.objects.filter(timestamp=partitions.month_start(date(2020, 6, 1)))
+                              .values_list('customer', 'balance')),
+                         {self.customer.pk: Decimal(450), self.other.pk: Decimal(500)})
+        # баланс на момент внутри архивированных месяцев - назад от границы по файлам архива
+        for moment, balance in ((datetime(2020, 4, 1), 650), (datetime(2020, 4, 25), 550),
+                                (datetime(2020, 5, 31, 12), 450), (datetime(2020, 6, 20), 950)):
+            with self.subTest(moment=moment):
+                self.assertEqual(ledger.balance_as_of(self.customer.pk, timezone.make_aware(moment)), Decimal(balance))
+        self.assertEqual(ledger.balance_as_of(self.other.pk, timezone.make_aware(datetime(2020, 4, 10))), Decimal(200))
+
+        # транзакции архивированных месяцев сверка не ищет в базе
+        self.assertEqual(reconcile.run(full=True, workers=1)[1], [])
+
+        # итоги архивированных месяцев пересчет сохраняет
+        april = StatementRollup.objects.create(customer=self.customer, period='month', start=date(2020, 4, 1),
+                                               inflow=100, outflow=200, inflow_count=1, outflow_count=1)
+        statements.rebuild()
+        statements.rebuild([self.customer.pk])
+        self.assertEqual(list(StatementRollup.objects.filter(customer=self.customer, period='month')
+                              .values_list('start', 'inflow')),
+                         [(april.start, Decimal(100)), (date(2020, 6, 1), Decimal(500)),
+                          (timezone.localdate().replace(day=1), Decimal(300))])
+
+    def test_late_transaction_merged(self):
+        late = Transaction.objects.create(amount=70, sender=self.customer, recipient=self.other)
+        Transaction.objects.filter(pk=late.pk).update(timestamp=timezone.make_aware(datetime(2020, 5, 10)))
+        archive.archive_before(date(2020, 6, 1))
+
+        index = json.loads((self.root / '202005' / 'index.json').read_text())
+        self.assertEqual(index['customers'][str(self.customer.pk)]['rows'], 3)
+        count, ids = self.history(order='timestamp')
+        self.assertEqual(ids, self.old[:2] + [self.old[2], late.pk, self.old[3], self.old[4]] + self.recent)
+
+
+class FastListRenderingTestCase(APITestCase):
+    """
+    Проверка быстрых списков (TransactionRowSerializer, CustomerRowSerializer, FastJSONRenderer):
+    ответ побайтно совпадает с ответом сериализаторов DRF и JSONRenderer
+    """
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Den \u2028\u2029 \x1f \"quoted\" \\ Дэн 😀", balance='1000.50')
+        self.other = Customer.objects.create(name="Avito", balance=100000000)
+        call_command('balance_slots', self.other.pk, '--slots', '2', stdout=io.StringIO())
+        services.credit(self.other.pk, Decimal('12.34'), 'to slots')
+        services.transfer(self.customer.pk, self.other.pk, Decimal('0.10'), 'перевод\n\t<tab>')
+        services.transfer(self.other.pk, self.customer.pk, Decimal('99999999.99'), None)
+        services.transfer(self.customer.pk, self.customer.pk, Decimal('5'), 'self \u2028')
+        Transaction.objects.create(amount=Decimal('7.00'), recipient=self.customer,
+                                   timestamp=timezone.make_aware(datetime(2024, 7, 1, 12, 30, 15, 123456)))
+        # вторая страница
+        for number in range(12):
+            services.credit(self.customer.pk, Decimal(number) / 4, f'deposit {number}')
+
+    def assertRendersLikeDRF(self, response, serialize):
+        """
+        Ответ совпадает с JSONRenderer для результатов, сериализованных serialize(ids) в том же порядке
+        """
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        ids = [row['id'] for row in response.data['results']]
+        expected = {**response.data, 'results': serialize(ids)}
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_transactions_match_serializer(self):
+        def serialize(ids):
+            transactions = Transaction.objects.in_bulk(ids)
+            return TransactionSerializer([transactions[pk] for pk in ids], many=True).data
+
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.customer.pk})
+        for params in ({}, {'order': '-amount'}, {'order': 'timestamp', 'page': 2}, {'pagination': 'cursor'}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertTrue(response.data['results'])
+                self.assertRendersLikeDRF(response, serialize)
+        response = self.client.get(url, {'pagination': 'cursor', 'order': 'amount'})
+        self.assertRendersLikeDRF(self.client.get(response.data['next']), serialize)
+
+    def test_customers_match_serializer(self):
+        def serialize(ids):
+            customers = Customer.objects.with_total_balance().in_bulk(ids)
+            return CustomerSerializer([customers[pk] for pk in ids], many=True).data
+
+        response = self.client.get(reverse('balanceapp:customer-list'))
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][1]['balance'], '12.45')  # 0.01 в строке пользователя и 12.44 в слотах
+        self.assertRendersLikeDRF(response, serialize)
+
+    def test_renderer_fallback(self):
+        # Decimal, нестроковые ключи, большие целые и отступ - через JSONRenderer
+        data = {'amount': Decimal('1.10'), 'when': timezone.now(), 1: 'one', 'big': 2 ** 70, 'line': '\u2028'}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        del data['amount'], data[1], data['big']
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        indented = 'application/json; indent=4'
+        self.assertEqual(FastJSONRenderer().render(data, indented), JSONRenderer().render(data, indented))
+
+
+class ReconcileTestCase(APITestCase):
+    """
+    Проверка сверки балансов с журналом транзакций (manage.py reconcile)
+    """
+    def setUp(self):
+        # начальный баланс задан не через журнал, у второго пользователя - слоты баланса
+        self.rich = Customer.objects.create(name="Daineris", balance=1000)
+        self.hot = Customer.objects.create(name="Avito")
+        call_command('balance_slots', self.hot.pk, '--slots', '2', stdout=io.StringIO())
+        self.poor = Customer.objects.create(name="Jorah")
+        now = timezone.now()
+        self.operate(now - timedelta(hours=2))
+        ledger.create_checkpoints(now - timedelta(minutes=90))
+        self.operate(now - timedelta(hours=1))
+
+    def operate(self, moment):
+        """
+        Операции с датой moment: она старше границы сверки (ledger.CHECKPOINT_DELAY)
+        """
+        latest = Transaction.objects.aggregate(latest=Max('id'))['latest'] or 0
+        services.transfer(self.rich.pk, self.hot.pk, Decimal('10.50'))
+        services.credit(self.hot.pk, Decimal('3.25'))
+        services.transfer(self.hot.pk, self.poor.pk, Decimal('5'))
+        services.debit(self.poor.pk, Decimal('1'))
+        Transaction.objects.filter(pk__gt=latest).update(timestamp=moment)
+
+    def reconcile(self, *args):
+        """
+        Запуск команды: (вывод, ошибка или None)
+        """
+        out, err = io.StringIO(), io.StringIO()
+        try:
+            call_command('reconcile', '--workers', '1', *args, stdout=out, stderr=err)
+        except CommandError as exc:
+            return out.getvalue() + err.getvalue(), exc
+        return out.getvalue() + err.getvalue(), None
+
+    def test_full_reconciliation(self):
+        output, error = self.reconcile('--full')
+        self.assertIsNone(error)
+        self.assertIn('Full reconciliation: checked 3 customer(s)', output)
+        self.assertIn('0 discrepancy(ies)', output)
+
+        # потерянное обновление: баланс изменился без транзакции
+        Customer.objects.filter(pk=self.poor.pk).update(balance=F('balance') + 100)
+        with tempfile.NamedTemporaryFile('r', suffix='.csv') as report:
+            output, error = self.reconcile('--full', '--chunk-size', '1', '--report', report.name)
+            rows = list(csv.reader(report))
+        self.assertEqual(str(error), '1 balance(s) do not match the ledger')
+        self.assertIn('checked 3 customer(s)', output)
+        self.poor.refresh_from_db()
+        self.assertEqual(rows, [['customer_id', 'balance', 'expected', 'difference'],
+                                [str(self.poor.pk), str(self.poor.balance), str(self.poor.balance - 100), '100.00']])
+
+    def test_without_checkpoints(self):
+        # без снимков начальный баланс, заданный не через журнал, считается расхождением
+        BalanceCheckpoint.objects.all().delete()
+        output, error = self.reconcile()
+        self.assertEqual(str(error), '1 balance(s) do not match the ledger')
+        self.assertIn(f'{self.rich.pk},979.00,-21.00,1000.00', output)
+
+    def test_incremental(self):
+        self.reconcile()
+        first = ReconciliationRun.objects.get()
+        self.assertTrue(first.full)
+        self.assertEqual(first.last_transaction_id, Transaction.objects.aggregate(latest=Max('id'))['latest'])
+        self.assertEqual(first.customers, 3)
+
+        # без новых транзакций пользователи не проверяются
+        Customer.objects.filter(pk=self.hot.pk).update(balance=F('balance') - 1)
+        output, error = self.reconcile()
+        self.assertIsNone(error)
+        self.assertIn('Incremental reconciliation: checked 0 customer(s)', output)
+
+        # проверяются пользователи с транзакциями после предыдущей сверки
+        services.credit(self.hot.pk, Decimal(2))
+        output, error = self.reconcile()
+        self.assertEqual(str(error), '1 balance(s) do not match the ledger')
+        self.assertIn('Incremental reconciliation: checked 1 customer(s)', output)
+        # транзакция новее ledger.CHECKPOINT_DELAY: граница не сдвигается, пользователь проверяется снова
+        self.assertEqual(reconcile.last_reconciled().last_transaction_id, first.last_transaction_id)
+        self.assertIn('checked 1 customer(s)', self.reconcile()[0])
+        self.assertIn('checked 3 customer(s)', self.reconcile('--full')[0])
+
+    def test_arguments(self):
+        with self.assertRaisesMessage(CommandError, '--workers must be positive'):
+            call_command('reconcile', '--workers', '0')
+        self.assertFalse(ReconciliationRun.objects.exists())
+
+
+class ReconcileProcessPoolTestCase(APITransactionTestCase):
+    """
+    Проверка сверки в пуле процессов: процессы читают зафиксированные данные тестовой базы
+    """
+    def test_workers(self):
+        customers = [Customer.objects.create(name=f"Customer {number}") for number in range(5)]
+        for customer in customers:
+            services.credit(customer.pk, Decimal(100))
+        services.transfer(customers[0].pk, customers[4].pk, Decimal('12.34'))
+        Customer.objects.filter(pk=customers[2].pk).update(balance=99)
+
+        progress = []
+        reconciliation, discrepancies = reconcile.run(full=True, workers=2, chunk_size=2,
+                                                      progress=lambda *args: progress.append(args))
+        self.assertEqual(reconciliation.customers, 5)
+        self.assertEqual(discrepancies, [(customers[2].pk, Decimal('99.00'), Decimal('100.00'))])
+        self.assertEqual(sorted(progress), [(customers[0].pk, customers[2].pk, 2), (customers[2].pk, customers[4].pk, 2),
+                                            (customers[4].pk, customers[4].pk + 1, 1)])
+
+
+class CustomerImportTestCase(APITestCase):
+    """
+    Проверка загрузки пользователей из CSV (manage.py import_customers, POST /balance/customers/import/)
+    """
+    CSV = 'name,balance\nDaineris,1000.50\n"Jorah, the Andal",\nAvito,0\nTyrion,12\n'
+
+    def import_file(self, content, *args):
+        """
+        Запуск команды с файлом content: (вывод, ошибка или None)
+        """
+        out, err = io.StringIO(), io.StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write(content)
+            file.flush()
+            try:
+                call_command('import_customers', file.name, *args, stdout=out, stderr=err)
+            except CommandError as exc:
+                return out.getvalue() + err.getvalue(), exc
+        return out.getvalue() + err.getvalue(), None
+
+    def staging_exists(self, result):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [customer_import.staging_table(result)])
+            return cursor.fetchone()[0]
+
+    def test_import(self):
+        output, error = self.import_file(self.CSV, '--batch-size', '3')
+        self.assertIsNone(error)
+        self.assertIn('Imported 3/4 rows', output)
+        self.assertIn('created 4 customer(s) from 4 row(s)', output)
+        self.assertEqual(list(Customer.objects.values_list('name', 'balance')), [
+            ('Daineris', Decimal('1000.50')), ('Jorah, the Andal', Decimal(0)), ('Avito', Decimal(0)),
+            ('Tyrion', Decimal(12))])
+
+        # начальные балансы записаны в журнал и итоги выписок, сверка расхождений не находит
+        daineris = Customer.objects.get(name='Daineris')
+        entry = Transaction.objects.get(recipient=daineris)
+        self.assertEqual((entry.amount, entry.sender_id, entry.description),
+                         (Decimal('1000.50'), None, customer_import.DESCRIPTION))
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(StatementRollup.objects.get(customer=daineris, period='month').inflow, Decimal('1000.50'))
+        self.assertEqual(reconcile.run(full=True, workers=1)[1], [])
+
+        result = CustomerImport.objects.get()
+        self.assertEqual((result.status, result.rows, result.merged_line, result.customers), ('done', 4, 4, 4))
+        self.assertFalse(self.staging_exists(result))
+
+    def test_invalid_rows(self):
+        content = 'name,balance\nDaineris,100\n,5\nJorah,-1\nTyrion,1.005\n' + f'{"x" * 101},1\n'
+        output, error = self.import_file(content)
+        self.assertIn('4 invalid row(s), nothing imported', str(error))
+        self.assertIn('Line 3: Name is required', str(error))
+        self.assertIn('Line 4: The balance must be non-negative number', str(error))
+        self.assertIn('Line 6: Name is longer than 100 characters', str(error))
+        self.assertFalse(Customer.objects.exists())
+        result = CustomerImport.objects.get()
+        self.assertEqual((result.status, result.invalid), ('invalid', 4))
+        self.assertFalse(self.staging_exists(result))
+
+        # с --skip-invalid переносятся корректные строки
+        output, error = self.import_file(content, '--skip-invalid')
+        self.assertIsNone(error)
+        self.assertIn('Skipped 4 invalid row(s)', output)
+        self.assertEqual(list(Customer.objects.values_list('name', 'balance')), [('Daineris', Decimal(100))])
+
+    def test_invalid_file(self):
+        output, error = self.import_file('name,amount\nDaineris,1\n')
+        self.assertIn('Invalid CSV file', str(error))
+        output, error = self.import_file('name,balance\nDaineris,1,2\n')
+        self.assertIn('Invalid CSV file', str(error))
+        self.assertFalse(Customer.objects.exists())
+        self.assertEqual(list(CustomerImport.objects.values_list('status', flat=True)), ['invalid', 'invalid'])
+        with self.assertRaisesMessage(CommandError, '--batch-size must be positive'):
+            call_command('import_customers', 'missing.csv', '--batch-size', '0')
+
+    def test_resume(self):
+        # сбой после первой части: она зафиксирована, повторный запуск продолжает со второй
+        with mock.patch.object(customer_import, 'rollup_params', side_effect=[{'time_zone': 'UTC'}, OperationalError]):
+            with self.assertRaises(OperationalError):
+                self.import_file(self.CSV, '--batch-size', '2')
+        result = CustomerImport.objects.get()
+        self.assertEqual((result.status, result.merged_line, result.customers), ('merging', 2, 2))
+        self.assertEqual(Customer.objects.count(), 2)
+
+        output, error = self.import_file(self.CSV, '--batch-size', '2')
+        self.assertIsNone(error)
+        self.assertIn(f'Import {result.pk}: created 4 customer(s)', output)
+        self.assertEqual(list(Customer.objects.values_list('name', flat=True)),
+                         ['Daineris', 'Jorah, the Andal', 'Avito', 'Tyrion'])
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_concurrent_start(self):
+        with mock.patch.object(customer_import, 'rollup_params', side_effect=[{'time_zone': 'UTC'}, OperationalError]):
+            with self.assertRaises(OperationalError):
+                self.import_file(self.CSV, '--batch-size', '2')
+        # другой запуск с тем же файлом создал загрузку между поиском незавершенной и созданием своей
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            output, error = self.import_file(self.CSV, '--batch-size', '2')
+        self.assertIsNone(error)
+        self.assertEqual(CustomerImport.objects.get().customers, 4)
+        self.assertEqual(Customer.objects.count(), 4)
+
+    def test_upload(self):
+        url = reverse('balanceapp:customer-import')
+        upload = SimpleUploadedFile('partner.csv', self.CSV.encode(), content_type='text/csv')
+        response = self.client.post(url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.post(url, {}, format='multipart').data, {"error": "File is required"})
+        upload.seek(0)
+        response = self.client.post(url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual({key: response.data[key] for key in ('status', 'rows', 'customers')},
+                         {'status': 'done', 'rows': 4, 'customers': 4})
+        self.assertEqual(CustomerImport.objects.get().source, 'partner.csv')
+
+        detail = self.client.get(reverse('balanceapp:customer-import-detail', kwargs={'import_id': response.data['id']}))
+        self.assertEqual(detail.data, response.data)
+
+        upload = SimpleUploadedFile('bad.csv', b'name,balance\n,1\n', content_type='text/csv')
+        response = self.client.post(url, {'file': upload}, format='multipart')
+        self.assertEqual((response.status_code, response.data['status'], response.data['error']),
+                         (400, 'invalid', 'Line 2: Name is required'))
+
+
+@override_settings(ADMISSION={'ENABLED': True, 'CLIENT_RATE': 100, 'CLIENT_BURST': 100, 'CUSTOMER_RATE': 1,
+                              'CUSTOMER_BURST': 2, 'MAX_IN_FLIGHT': 1})
+class AdmissionControlTestCase(APITestCase):
+    """
+    Проверка контроля допуска зачислений, списаний и переводов (admission.py)
+    """
+    def setUp(self):
+        self.daineris = Customer.objects.create(name="Daineris", balance=100)
+        self.jorah = Customer.objects.create(name="Jorah", balance=100)
+
+    def deposit(self, customer):
+        return self.client.post(reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': customer.pk}),
+                                {"amount": 10, "operation": "withdraw"}, format='json')
+
+    def transfer(self, sender, recipient):
+        return self.client.post(reverse('balanceapp:transfer'),
+                                {"amount": 1, "sender": sender.pk, "recipient": str(recipient.pk)}, format='json')
+
+    def test_customer_rate(self):
+        self.assertEqual([self.deposit(self.daineris).status_code for _ in range(2)], [200, 200])
+        response = self.deposit(self.daineris)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.data, {"error": "Too many requests for the customer"})
+        self.daineris.refresh_from_db()
+        self.assertEqual(self.daineris.balance, Decimal(120))
+
+        # лимит счета не действует на другие счета, у перевода проверяются оба счета
+        self.assertEqual(self.deposit(self.jorah).status_code, 200)
+        self.assertEqual(self.transfer(self.jorah, self.daineris).status_code, 429)
+        self.assertEqual(self.transfer(self.jorah, self.daineris).data, {"error": "Too many requests for the customer"})
+
+    @override_settings(ADMISSION={'ENABLED': True, 'CLIENT_RATE': 0.5, 'CLIENT_BURST': 2})
+    def test_client_rate(self):
+        self.assertEqual(self.deposit(self.daineris).status_code, 200)
+        self.assertEqual(self.transfer(self.daineris, self.jorah).status_code, 200)
+        response = self.deposit(self.jorah)
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '2'))
+        self.assertEqual(response.data, {"error": "Too many requests"})
+
+        # у пользователя API своя корзина, чтение не ограничивается
+        self.client.force_authenticate(User.objects.create_user('partner'))
+        self.assertEqual(self.deposit(self.jorah).status_code, 200)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('balanceapp:customer-list')).status_code, 200)
+
+    @override_settings(ADMISSION={'ENABLED': True, 'MAX_IN_FLIGHT': 1})
+    def test_in_flight(self):
+        control = admission.get_admission_control()
+        running = control.admit('worker', [self.jorah.pk])
+        response = self.transfer(self.daineris, self.jorah)
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '1'))
+        self.assertEqual(response.data, {"error": "Too many concurrent operations for the customer"})
+        # место отправителя, занятое до отказа, освобождено
+        control.admit('worker', [self.daineris.pk]).release()
+
+        running.release()
+        self.assertEqual(self.transfer(self.daineris, self.jorah).status_code, 200)
+        # после ответа место освобождается и при ошибке операции
+        self.assertEqual(self.client.post(reverse('balanceapp:transfer'), {"amount": 1000, "sender": self.daineris.pk,
+                                                                           "recipient": self.jorah.pk},
+                                          format='json').status_code, 400)
+        control.admit('worker', [self.daineris.pk, self.jorah.pk]).release()
+
+    @override_settings(ADMISSION={'ENABLED': True, 'SHARED': 'default', 'CUSTOMER_RATE': 1, 'CUSTOMER_BURST': 2,
+                                  'MAX_IN_FLIGHT': 1})
+    def test_shared_backend(self):
+        cache.clear()
+        control = admission.get_admission_control()
+        self.assertIsInstance(control.backend, admission.CacheBackend)
+        # второй воркер (свой экземпляр) видит места и токены, занятые первым
+        other = admission.AdmissionControl(admission.CacheBackend('default'), customer_rate=1, customer_burst=2,
+                                           max_in_flight=1)
+        running = control.admit('first', [self.daineris.pk])
+        with self.assertRaises(admission.Rejected) as rejected:
+            other.admit('second', [self.daineris.pk])
+        self.assertEqual(rejected.exception.reason, 'in_flight')
+        running.release()
+        # токен, взятый отклоненным запросом, возвращен в корзину
+        other.admit('second', [self.daineris.pk]).release()
+        with self.assertRaises(admission.Rejected) as rejected:
+            other.admit('second', [self.daineris.pk])
+        self.assertEqual(rejected.exception.reason, 'customer')
+        other.admit('second', [self.jorah.pk]).release()
+
+    def test_rejected_request_keeps_tokens(self):
+        control = admission.get_admission_control()
+        running = control.admit('worker', [self.jorah.pk])
+        for _ in range(3):
+            self.assertEqual(self.transfer(self.daineris, self.jorah).status_code, 429)
+        running.release()
+        # отказы по числу одновременных записей не расходовали токены отправителя
+        self.assertEqual([self.deposit(self.daineris).status_code for _ in range(2)], [200, 200])
+
+    def test_batch(self):
+        url = reverse('balanceapp:batch')
+        items = [{"type": "operation", "customer": self.daineris.pk, "amount": 10, "operation": "withdraw"},
+                 {"type": "transfer", "sender": self.daineris.pk, "recipient": self.jorah.pk, "amount": 1}]
+        self.assertEqual(self.client.post(url, {"items": items}, format='json').status_code, 200)
+        # пакет берет по токену у каждого счета: у Jorah остался один токен
+        self.assertEqual(self.deposit(self.jorah).status_code, 200)
+        response = self.client.post(url, {"items": items[:1]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(url, {"items": items[:1]}, format='json')
+        self.assertEqual((response.status_code, response.data), (429, {"error": "Too many requests for the customer"}))
+        self.daineris.refresh_from_db()
+        self.assertEqual(self.daineris.balance, Decimal(119))
+
+    async def test_async_views(self):
+        url = reverse('balanceapp_async:withdraw-deposit', kwargs={'customer_id': self.daineris.pk})
+        statuses = [(await self.async_client.post(url, {"amount": 10, "operation": "withdraw"},
+                                                  content_type='application/json')).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+        control = admission.get_admission_control()
+        running = control.admit('worker', [self.jorah.pk])
+        response = await self.async_client.post(reverse('balanceapp_async:transfer'),
+                                                {"amount": 1, "sender": self.jorah.pk, "recipient": self.daineris.pk},
+                                                content_type='application/json')
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '1'))
+        self.assertEqual(json.loads(response.content), {"error": "Too many concurrent operations for the customer"})
+        running.release()
+        # место отправителя освобождено, отказ не израсходовал второй токен Jorah
+        control.admit('worker', [self.jorah.pk]).release()
+
+    def test_token_bucket(self):
+        state, wait = admission.refill(None, rate=2, burst=2, now=10)
+        self.assertEqual((state, wait), ((1, 10), 0))
+        state, wait = admission.refill(state, rate=2, burst=2, now=10)
+        state, wait = admission.refill(state, rate=2, burst=2, now=10.25)
+        self.assertEqual((state, wait), ((0.5, 10.25), 0.25))
+        self.assertEqual(admission.refill(state, rate=2, burst=2, now=100), ((1, 100), 0))
@@ -0,0 +1,238 @@
+"""
+Регрессионные тесты производительности эндпоинтов: точное число SQL-запросов и время ответа
+на наборе данных реалистичного размера.
+
+Для каждого эндпоинта и вида операции в BUDGETS записаны число запросов и предел медианы времени ответа.
+Тест падает, если число запросов изменилось (лишний запрос или N+1 - увеличилось, оптимизация - уменьшилось:
+тогда бюджет нужно уменьшить) или медиана превысила предел. Пределы времени взяты с запасом в несколько раз
+от времени на одном ядре, чтобы ловить регрессии, а не колебания нагрузки машины.
+
+В обычном прогоне тестов проверяется только число запросов на небольшом наборе данных. Полный набор
+и пределы времени - с переменной окружения PERFORMANCE (тесты помечены тегом performance):
+    PERFORMANCE=1 python manage.py test balanceapp.tests_performance
+
+Запросы SAVEPOINT и RELEASE SAVEPOINT не считаются: их добавляет транзакция теста вокруг transaction.atomic
+представлений, в работе сервиса их нет. Асинхронные эндпоинты (async_views.py) обращаются к базе
+в других потоках и здесь не проверяются.
+
+Результаты (число запросов, медиана и максимум времени) сохраняются в JSON, если задана переменная
+окружения PERFORMANCE_REPORT:
+    PERFORMANCE=1 PERFORMANCE_REPORT=performance.json python manage.py test balanceapp.tests_performance
+"""
+import io
+import json
+import os
+import re
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from . import admission, ledger, partitions, statements
+from .customer_cache import get_customer_cache
+from .models import Customer, Transaction
+
+# полный набор данных и проверка времени ответа
+PERFORMANCE = bool(os.environ.get('PERFORMANCE'))
+CUSTOMERS = 10000 if PERFORMANCE else 1000
+TRANSACTIONS = 200000 if PERFORMANCE else 20000
+# шаг времени между транзакциями в секундах: при любом размере набора транзакции занимают несколько месяцев
+STEP = 37 * 200000 // TRANSACTIONS
+# каждая HOT_SHARE-я транзакция - зачисление пользователю, историю которого читают тесты
+HOT_SHARE = 10
+REPEAT = 15
+
+# эндпоинт: (число SQL-запросов, предел медианы времени ответа в секундах)
+BUDGETS = {
+    'customer-list': (2, 0.025),  # страница и общее число строк
+    'customer-detail': (1, 0.02),
+    'customer-detail-cached': (0, 0.01),
+    'customer-create': (1, 0.02),
+    'customer-update': (3, 0.02),  # пользователь, новое имя с новой версией и перечитывание версии для кэша
+    'customer-delete': (6, 0.03),  # пользователь и каскадное удаление слотов, журнала, снимков, итогов
+    'operation-deposit': (1, 0.02),
+    'operation-withdraw': (1, 0.02),
+    'transfer': (2, 0.02),  # блокировка строк и перевод
+    'batch-atomic': (4, 0.04),
+    'batch-best-effort': (4, 0.04),
+    'transactions': (2, 0.06),  # страница и общее число строк
+    'transactions-next-page': (2, 0.06),
+    'transactions-cursor': (1, 0.06),  # ?pagination=cursor&count=false
+    'transactions-period': (2, 0.04),
+    'transactions-currency': (3, 0.06),  # и курсы на даты транзакций страницы
+    'transactions-export-csv': (3, 1.0),  # проверка пользователя, полученные и отправленные
+    'transactions-export-ndjson': (3, 1.0),
+    'statement-month': (2, 0.03),  # проверка пользователя и итоги
+    'statement-day': (2, 0.03),
+    'balance-as-of': (1, 0.03),
+    'health-db': (1, 0.01),
+    'metrics': (0, 0.03),
+}
+
+SAVEPOINT_RE = re.compile(r'^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b')
+
+SEED_CUSTOMERS_SQL = """
+    INSERT INTO balanceapp_customer (name, balance, version, balance_slots)
+    SELECT 'Customer ' || n, 1000000, 0, 0 FROM generate_series(1, %(customers)s) AS n
+    RETURNING id
+"""
+
+# получатель - каждая HOT_SHARE-я транзакция у первого пользователя, отправитель (у половины транзакций) -
+# другой пользователь; транзакции идут с шагом STEP секунд назад от now
+SEED_TRANSACTIONS_SQL = """
+    INSERT INTO balanceapp_transaction (amount, "timestamp", description, recipient_id, sender_id)
+    SELECT (n %% 1000 + 1)::numeric / 10, %(now)s - n * %(step)s * interval '1 second',
+           CASE WHEN n %% 3 = 0 THEN 'refund' END, %(first)s + recipient,
+           CASE WHEN n %% 2 = 0 THEN %(first)s + (recipient + 1 + n %% (%(customers)s - 1)) %% %(customers)s END
+    FROM (
+        SELECT n, CASE WHEN n %% %(hot_share)s = 0 THEN 0 ELSE (n * 7919) %% %(customers)s END AS recipient
+        FROM generate_series(1, %(transactions)s) AS n
+    ) AS seed
+"""
+
+results = {}
+
+
+@tag('performance')
+class EndpointPerformanceTestCase(APITestCase):
+    """
+    Число SQL-запросов и время ответа эндпоинтов на наборе из CUSTOMERS пользователей и TRANSACTIONS транзакций
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(SEED_CUSTOMERS_SQL, {'customers': CUSTOMERS})
+            first = min(pk for pk, in cursor.fetchall())
+            cursor.execute(SEED_TRANSACTIONS_SQL, {'now': now, 'first': first, 'customers': CUSTOMERS,
+                                                   'hot_share': HOT_SHARE, 'transactions': TRANSACTIONS, 'step': STEP})
+            cursor.execute('ANALYZE balanceapp_customer, balanceapp_transaction')
+        # транзакции прошлых месяцев переносятся из секции по умолчанию в свои секции
+        partitions.ensure_partitions()
+        statements.rebuild()
+        ledger.create_checkpoints(now - timedelta(days=30))
+        call_command('import_rates', '--offline', '--since', '2024-07-22', '--until', '2024-07-26',
+                     stdout=io.StringIO())
+        cls.hot = Customer.objects.get(pk=first)
+        cls.other = Customer.objects.get(pk=first + 1)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        path = os.environ.get('PERFORMANCE_REPORT')
+        if path:
+            with open(path, 'w') as file:
+                json.dump(results, file, indent=2)
+
+    def setUp(self):
+        get_customer_cache().local.clear()
+        # лимиты записей (admission.py) не должны зависеть от запросов других тестов
+        admission.get_admission_control.cache_clear()
+
+    def assertBudget(self, name, request, prepare=None):
+        """
+        Проверка бюджета BUDGETS[name]: request выполняет запрос и возвращает ответ, prepare (если есть)
+        вызывается перед каждым запросом и не входит ни в число запросов, ни во время
+        """
+        queries, seconds = BUDGETS[name]
+        if prepare is not None:
+            prepare()
+        with CaptureQueriesContext(connection) as captured:
+            response = request()
+            # ответ-поток читается из базы при чтении тела
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertLess(response.status_code, 400, f'{name}: {content[:200]}')
+        executed = [query['sql'] for query in captured.captured_queries if not SAVEPOINT_RE.match(query['sql'])]
+        self.assertEqual(len(executed), queries, f'{name}: SQL queries changed:\n' + '\n'.join(executed))
+        if not PERFORMANCE:
+            results[name] = {'queries': len(executed)}
+            return
+
+        timings = []
+        for _ in range(REPEAT):
+            if prepare is not None:
+                prepare()
+            started = time.perf_counter()
+            response = request()
+            if response.streaming:
+                b''.join(response.streaming_content)
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        results[name] = {'queries': len(executed), 'median_ms': round(median * 1000, 2),
+                         'max_ms': round(max(timings) * 1000, 2), 'budget_ms': seconds * 1000}
+        self.assertLessEqual(median, seconds, f'{name}: median {median * 1000:.1f} ms exceeds budget '
+                                              f'{seconds * 1000:.0f} ms')
+
+    def test_customers(self):
+        self.assertBudget('customer-list', lambda: self.client.get(reverse('balanceapp:customer-list'), {'page': 50}))
+        detail = reverse('balanceapp:customer-detail', kwargs={'pk': self.hot.pk})
+        self.assertBudget('customer-detail', lambda: self.client.get(detail), prepare=get_customer_cache().local.clear)
+        self.assertBudget('customer-detail-cached', lambda: self.client.get(detail))
+        self.assertBudget('customer-create', lambda: self.client.post(reverse('balanceapp:customer-list'),
+                                                                      {'name': 'Newcomer'}, format='json'))
+        self.assertBudget('customer-update', lambda: self.client.patch(detail, {'name': 'Hot'}, format='json'))
+
+        def create_victim():
+            self.victim = Customer.objects.create(name='Victim')
+        self.assertBudget('customer-delete', lambda: self.client.delete(
+            reverse('balanceapp:customer-detail', kwargs={'pk': self.victim.pk})), prepare=create_victim)
+
+    def test_operations(self):
+        url = reverse('balanceapp:withdraw-deposit', kwargs={'customer_id': self.other.pk})
+        self.assertBudget('operation-deposit', lambda: self.client.post(
+            url, {'amount': 10.5, 'operation': 'withdraw', 'description': 'salary'}, format='json'))
+        self.assertBudget('operation-withdraw', lambda: self.client.post(
+            url, {'amount': 3.25, 'operation': 'deposit'}, format='json'))
+        self.assertBudget('transfer', lambda: self.client.post(reverse('balanceapp:transfer'), {
+            'amount': 1.5, 'sender': self.other.pk, 'recipient': self.hot.pk}, format='json'))
+
+        items = ([{'type': 'operation', 'customer': self.other.pk + number, 'amount': 5, 'operation': 'withdraw'}
+                  for number in range(5)]
+                 + [{'type': 'transfer', 'sender': self.other.pk + number, 'recipient': self.hot.pk, 'amount': 1}
+                    for number in range(5)])
+        for mode in ('atomic', 'best_effort'):
+            self.assertBudget(f'batch-{mode.replace("_", "-")}', lambda: self.client.post(
+                reverse('balanceapp:batch'), {'mode': mode, 'items': items}, format='json'))
+
+    def test_history(self):
+        url = reverse('balanceapp:transactions', kwargs={'customer_id': self.hot.pk})
+        self.assertBudget('transactions', lambda: self.client.get(url))
+        next_page = self.client.get(url).data['next']
+        self.assertBudget('transactions-next-page', lambda: self.client.get(next_page))
+        cursor = self.client.get(url, {'pagination': 'cursor', 'count': 'false'}).data['next']
+        self.assertBudget('transactions-cursor', lambda: self.client.get(cursor))
+        period = {'date_from': (timezone.now() - timedelta(days=20)).date().isoformat(),
+                  'date_to': (timezone.now() - timedelta(days=10)).date().isoformat()}
+        self.assertBudget('transactions-period', lambda: self.client.get(url, period))
+        self.assertBudget('transactions-currency', lambda: self.client.get(url, {'currency': 'USD'}))
+
+        export = reverse('balanceapp:transactions-export', kwargs={'customer_id': self.hot.pk})
+        self.assertBudget('transactions-export-csv', lambda: self.client.get(export, {'format': 'csv'}))
+        self.assertBudget('transactions-export-ndjson', lambda: self.client.get(export, {'format': 'ndjson'}))
+
+        statement = reverse('balanceapp:transactions-statement', kwargs={'customer_id': self.hot.pk})
+        self.assertBudget('statement-month', lambda: self.client.get(statement))
+        self.assertBudget('statement-day', lambda: self.client.get(statement, {'period': 'day'}))
+        as_of = (timezone.now() - timedelta(days=5)).isoformat()
+        self.assertBudget('balance-as-of', lambda: self.client.get(
+            reverse('balanceapp:balance-as-of', kwargs={'customer_id': self.hot.pk}), {'as_of': as_of}))
+
+    def test_service(self):
+        self.assertBudget('health-db', lambda: self.client.get(reverse('balanceapp:health-db')))
+        self.assertBudget('metrics', lambda: self.client.get('/metrics'))
+
+    def test_dataset(self):
+        # бюджеты рассчитаны на этот размер данных
+        self.assertEqual(Customer.objects.count(), CUSTOMERS)
+        self.assertEqual(Transaction.objects.filter(recipient=self.hot).count(), TRANSACTIONS // HOT_SHARE)
+        self.assertGreater(self.hot.balance, Decimal(0))
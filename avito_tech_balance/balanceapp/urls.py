@@ -1,7 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import CustomerViewSet, WithdrawDeposit, TransferView, TransactionViewSet
+from .views import (CustomerViewSet, WithdrawDeposit, TransferView, TransactionViewSet, BatchView,
+                    TransactionExportView, BalanceAsOfView, StatementView, DatabaseHealthView,
+                    CustomerImportView)
 
 app_name = "balanceapp"
 
@@ -10,7 +12,17 @@ router.register(r'customers', CustomerViewSet)
 
 urlpatterns = [
     path('transfer/', TransferView.as_view(), name='transfer'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('health/db/', DatabaseHealthView.as_view(), name='health-db'),
+    # до маршрутов router: иначе customers/import/ совпадает с customers/<pk>/
+    path('customers/import/', CustomerImportView.as_view(), name='customer-import'),
+    path('customers/import/<int:import_id>/', CustomerImportView.as_view(), name='customer-import-detail'),
     path('', include(router.urls)),
+    path('customers/<int:customer_id>/balance/', BalanceAsOfView.as_view(), name='balance-as-of'),
     path('customers/<int:customer_id>/operations/', WithdrawDeposit.as_view(), name='withdraw-deposit'),
     path('customers/<int:customer_id>/transactions/', TransactionViewSet.as_view({'get': 'list'}), name='transactions'),
+    path('customers/<int:customer_id>/transactions/export/', TransactionExportView.as_view(),
+         name='transactions-export'),
+    path('customers/<int:customer_id>/transactions/statement/', StatementView.as_view(),
+         name='transactions-statement'),
 ]
\ No newline at end of file
@@ -1,26 +1,161 @@
+from datetime import datetime, time, timedelta
 from decimal import Decimal
-import requests
-import xml.etree.ElementTree as ET
-from django.db.models import Q
+
+from django.db import DatabaseError, connection
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views import View
 
 from rest_framework import status
-from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from .models import Customer, Transaction
-from .serializers import CustomerSerializer, TransactionSerializer
+from . import (admission, archive, customer_import, export, group_commit, ledger, metrics, rate_history, routers,
+               services, statements)
+from .customer_cache import get_customer_cache
+from .db.base import pool_stats
+from .models import Customer, CustomerImport, Transaction
+from .pagination import KeysetPagination
+from .rates import RatesUnavailable
+from .renderers import FastJSONRenderer
+from .serializers import (CustomerRowSerializer, CustomerSerializer, StatementSerializer, TransactionRowSerializer,
+                          TransactionSerializer)
+
+
+
+class ReplicaReadMixin:
+    """
+    GET-запросы представления читают с реплики (см. routers.py) с учетом записей по пользователю из URL
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        customer_id = kwargs.get('pk', kwargs.get('customer_id'))
+        with routers.replica_reads([customer_id] if customer_id is not None else []):
+            return super().dispatch(request, *args, **kwargs)
+
 
+def parse_customer_id(value):
+    """
+    id пользователя из тела запроса (целое число или строка из цифр) или None, если значение не id.
+    Дробные числа и true не приводятся к int: операция не должна попасть на чужой счет
+    """
+    if type(value) is int:
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return None
 
 
-class CustomerViewSet(ModelViewSet):
+def customer_ids(data, fields):
+    """
+    id счетов из полей fields тела запроса data для контроля допуска
+    """
+    # некорректный id отклонит проверка тела запроса
+    ids = [parse_customer_id(data.get(field)) for field in fields]
+    return [customer_id for customer_id in ids if customer_id is not None]
+
+
+class AdmissionControlMixin:
+    """
+    POST-запросы представления проходят контроль допуска (см. admission.py) до обработчика:
+    при превышении лимита ответ 429 с заголовком Retry-After, база не затрагивается
+    """
+
+    def admission_customers(self, request, *args, **kwargs):
+        """
+        id счетов, которые изменяет запрос
+        """
+        return []
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        control = admission.get_admission_control()
+        if control is not None and request.method == 'POST':
+            self.admission = control.admit(admission.client_key(request),
+                                           self.admission_customers(request, *args, **kwargs))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, admission.Rejected):
+            return Response({"error": str(exc)}, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                            headers={'Retry-After': str(exc.retry_after)})
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, 'admission', None) is not None:
+            self.admission.release()
+            self.admission = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class CustomerViewSet(ReplicaReadMixin, ModelViewSet):
     """
     Представление для создания пользователя, отображения его данных (pk, имя и баланс)
     Изменение имени
     """
-    queryset = Customer.objects.all()
+    queryset = Customer.objects.with_total_balance()
     serializer_class = CustomerSerializer
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        """
+        Список пользователей, балансы в валюте по текущему курсу (rate_history.current_rate) - ?currency=USD
+        """
+        response = self.list_rows()
+        reads = routers.current_reads()
+        rows = response.data['results'] if isinstance(response.data, dict) else response.data
+        if reads is not None and reads.is_stale([row['id'] for row in rows]):
+            # на реплике еще нет последней записи по одному из пользователей страницы
+            with routers.primary_reads():
+                response = self.list_rows()
+                rows = response.data['results'] if isinstance(response.data, dict) else response.data
+
+        currency = request.query_params.get('currency')
+        if currency:
+            try:
+                rate = rate_history.current_rate(currency)
+            except RatesUnavailable:
+                return Response({"error": "exchange rates are temporarily unavailable"},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            if rate is None:
+                return Response({"error": "the currency was not found"}, status=status.HTTP_400_BAD_REQUEST)
+            for row in rows:
+                row['balance'] = rate_history.convert(row['balance'], rate)
+                row['valute'] = currency
+        return response
+
+    def list_rows(self):
+        """
+        Страница пользователей, как у ListModelMixin.list, но из кортежей values_list (CustomerRowSerializer)
+        """
+        rows = CustomerRowSerializer.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(CustomerRowSerializer.data(rows))
+        return self.get_paginated_response(CustomerRowSerializer.data(page))
+
+    def get_cached_object(self):
+        """
+        Пользователь из кэша (customer_cache.py), при промахе - из базы
+        """
+        try:
+            return get_customer_cache().load(self.kwargs['pk'])
+        except (Customer.DoesNotExist, ValueError):
+            raise Http404('No Customer matches the given query.')
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        routers.note_write([serializer.instance.pk])
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        routers.note_write([serializer.instance.pk])
 
     def retrieve(self, request, *args, **kwargs):
         """
@@ -29,29 +164,53 @@ class CustomerViewSet(ModelViewSet):
         Пример: curl -X POST -H 'Content-Type: application/json' -d '{"name":"test"}' http://127.0.0.1:8000/balance/customers/
         curl -X GET http://127.0.0.1:8000/balance/customers/1/
         """
-        instance = self.get_object()
+        instance = self.get_cached_object()
         serializer = self.get_serializer(instance)
 
         currency = self.request.query_params.get('currency')
         if currency:
-            response = requests.get('http://www.cbr.ru/scripts/XML_daily.asp')
-            root = ET.fromstring(response.content)
-            for valute in root.findall('Valute'):
-                char_code = valute.find('CharCode').text
-                if char_code == currency:
-                    value = Decimal(float(valute.find('Value').text.replace(",", ".")))  # преобразуем строку в decimal
-                    custom_data = serializer.data
-                    # вычисляем баланс в валюте и переписываем обозначение валюты
-                    custom_data['balance'] = str(round(instance.balance / value, 2))
-                    custom_data['valute'] = char_code
-                    return Response(custom_data, status=status.HTTP_200_OK)
+            try:
+                value = rate_history.current_rate(currency)
+            except RatesUnavailable:
+                return Response({"error": "exchange rates are temporarily unavailable"},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            if value is None:
+                return Response({"error": "the currency was not found"}, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response({"error": "the currency was not found"}, status=status.HTTP_400_BAD_REQUEST)
+            custom_data = serializer.data
+            # вычисляем баланс в валюте и переписываем обозначение валюты
+            custom_data['balance'] = str(round(instance.total_balance / value, 2))
+            custom_data['valute'] = currency
+            return Response(custom_data, status=status.HTTP_200_OK)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class WithdrawDeposit(APIView):
+class BalanceAsOfView(APIView):
+    """
+    Представление для получения баланса пользователя на момент времени
+    http://127.0.0.1:8000/balance/customers/1/balance/?as_of=2024-07-26T12:00:00Z
+    Обязательный параметр as_of - дата и время в формате ISO 8601.
+    """
+
+    def get(self, request, customer_id):
+        value = request.query_params.get('as_of')
+        moment = parse_datetime(value) if value else None
+        if moment is None:
+            return Response({"error": "The 'as_of' parameter must be a date and time in ISO 8601 format"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+
+        try:
+            balance = ledger.balance_as_of(customer_id, moment)
+        except Customer.DoesNotExist:
+            raise Http404('No Customer matches the given query.')
+        return Response({"id": customer_id, "balance": export.format_amount(balance), "valute": "RUB",
+                         "as_of": export.format_timestamp(moment)}, status=status.HTTP_200_OK)
+
+
+class WithdrawDeposit(AdmissionControlMixin, APIView):
     """
     Представление для зачисления/списания средств со счета пользователя
     http://127.0.0.1:8000/balance/customers/1/
@@ -59,41 +218,51 @@ class WithdrawDeposit(APIView):
     Не обязательное поле - description.
     """
 
+    def admission_customers(self, request, customer_id):
+        return [customer_id]
+
     def post(self, request, customer_id):
         data = request.data
         amount = data.get('amount')
         operation = data.get('operation')
         description = data.get('description')
 
-        customer = get_object_or_404(Customer, pk=customer_id)
+        error = self.validate(data)
+        if error is not None:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            if operation == 'withdraw':  # зачисление средств
+                group_commit.credit(customer_id, amount, description)
+            else:  # списание средств
+                group_commit.debit(customer_id, amount, description)
+        except Customer.DoesNotExist:
+            raise Http404('No Customer matches the given query.')
+        except services.InsufficientFunds:
+            return Response({"error": "There are not enough funds in the account"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({"OK": "The operation was successful"}, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def validate(data):
+        """
+        Проверка тела запроса, возвращает текст ошибки или None
+        """
+        amount = data.get('amount')
+        operation = data.get('operation')
 
         if not amount or not operation:  # если не передали все необходимые аргументы
-            return Response({"error": "Amount and operation are required"}, status=status.HTTP_400_BAD_REQUEST)
+            return "Amount and operation are required"
 
         if type(amount) is str or amount <= 0:  # если сумма некорректная
-            return Response({"error": "The amount must be positive number"}, status=status.HTTP_400_BAD_REQUEST)
+            return "The amount must be positive number"
 
-        if operation == 'withdraw':  # зачисление средств
-            customer.balance += Decimal(amount)
-            customer.save()
-            Transaction.objects.create(amount=Decimal(amount), recipient=customer, description=description)
-            return Response({"OK": "The operation was successful"}, status=status.HTTP_200_OK)
-
-        elif operation == 'deposit':  # списание средств
-            if Decimal(amount) > customer.balance:
-                return Response({"error": "There are not enough funds in the account"},
-                                status=status.HTTP_400_BAD_REQUEST)
-            customer.balance -= Decimal(amount)
-            customer.save()
-            Transaction.objects.create(amount=Decimal(amount), sender=customer, description=description)
-            return Response({"OK": "The operation was successful"}, status=status.HTTP_200_OK)
-        else:
-            return Response({"error": "The field 'operation' is specified incorrectly, "
-                                      "you must specify either 'withdraw' or 'deposit'."},
-                            status=status.HTTP_400_BAD_REQUEST)
+        if operation not in ('withdraw', 'deposit'):
+            return "The field 'operation' is specified incorrectly, you must specify either 'withdraw' or 'deposit'."
+        return None
 
 
-class TransferView(APIView):
+class TransferView(AdmissionControlMixin, APIView):
     """
     Представление для передачи средств одного пользователя на счет другого пользователя
     http://127.0.0.1:8000/balance/transfer/
@@ -101,50 +270,409 @@ class TransferView(APIView):
     Не обязательный параметр description
     """
 
+    def admission_customers(self, request):
+        return self.customer_ids(request.data)
+
+    @staticmethod
+    def customer_ids(data):
+        """
+        id отправителя и получателя перевода из тела запроса data
+        """
+        return customer_ids(data, ('sender', 'recipient'))
+
     def post(self, request):
         data = request.data
         amount = data.get('amount')
-        sender_id = data.get('sender')
-        recipient_id = data.get('recipient')
+        sender_id = parse_customer_id(data.get('sender'))
+        recipient_id = parse_customer_id(data.get('recipient'))
         description = data.get('description')
 
-        if not amount or not sender_id or not recipient_id:  # если не передали все необходимые аргументы
-            return Response({"error": "Amount, sender and recipient are required"},
+        error = self.validate(data)
+        if error is not None:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        if sender_id is None or recipient_id is None:  # как get_object_or_404 для некорректных id
+            raise Http404('No Customer matches the given query.')
+
+        try:
+            result = services.transfer(sender_id, recipient_id, amount, description)
+        except Customer.DoesNotExist:
+            raise Http404('No Customer matches the given query.')
+        except services.InsufficientFunds:
+            return Response({"error": "There are not enough funds in the account"},
                             status=status.HTTP_400_BAD_REQUEST)
+        # время ожидания блокировок строк пользователей, мс
+        return Response({"OK": "The operation was successful"}, status=status.HTTP_200_OK,
+                        headers={'Server-Timing': f'lock;dur={result.lock_wait * 1000:.2f}'})
+
+    @staticmethod
+    def validate(data):
+        """
+        Проверка тела запроса, возвращает текст ошибки или None
+        """
+        amount = data.get('amount')
+
+        if not amount or not data.get('sender') or not data.get('recipient'):  # если не передали все аргументы
+            return "Amount, sender and recipient are required"
 
         if type(amount) is str or amount < 0:  # если сумма некорректная
-            return Response({"error": "The amount must be positive number"}, status=status.HTTP_400_BAD_REQUEST)
+            return "The amount must be positive number"
+        return None
 
-        sender = get_object_or_404(Customer, pk=sender_id)
-        recipient = get_object_or_404(Customer, pk=recipient_id)
 
-        if sender.balance < Decimal(amount):
-            return Response({"error": "There are not enough funds in the account"},
+class BatchView(AdmissionControlMixin, APIView):
+    """
+    Представление для выполнения пакета зачислений, списаний и переводов одним запросом
+    http://127.0.0.1:8000/balance/batch/
+    Пример тела запроса: {"mode": "atomic", "items": [
+        {"type": "operation", "customer": 1, "amount": 100.00, "operation": "withdraw", "description": "present"},
+        {"type": "transfer", "sender": 1, "recipient": 2, "amount": 50.00}
+    ]}
+    mode: atomic (по умолчанию) - при любой ошибке не выполняется ни одна операция,
+    best_effort - выполняются все корректные операции.
+    Операции применяются в порядке перечисления, в ответе - результат по каждой операции.
+    Контроль допуска берет токен и место одновременной записи у каждого счета пакета.
+    """
+
+    def admission_customers(self, request):
+        items = request.data.get('items')
+        if not isinstance(items, list):
+            return []
+        return [customer_id for item in items[:services.BATCH_MAX_SIZE] if isinstance(item, dict)
+                for customer_id in customer_ids(item, ('customer', 'sender', 'recipient'))]
+
+    def post(self, request):
+        items = request.data.get('items')
+        mode = request.data.get('mode', 'atomic')
+
+        if mode not in ('atomic', 'best_effort'):
+            return Response({"error": "The field 'mode' is specified incorrectly, "
+                                      "you must specify either 'atomic' or 'best_effort'."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        sender.balance -= Decimal(amount)
-        recipient.balance += Decimal(amount)
-        sender.save()
-        recipient.save()
-        Transaction.objects.create(amount=Decimal(amount), sender=sender, recipient=recipient,
-                                   description=description)
-        return Response({"OK": "The operation was successful"}, status=status.HTTP_200_OK)
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Items are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(items) > services.BATCH_MAX_SIZE:
+            return Response({"error": f"The batch must contain at most {services.BATCH_MAX_SIZE} items"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # валидация всех элементов до обращения к базе
+        errors = [None] * len(items)
+        entries = []
+        for index, item in enumerate(items):
+            entry, errors[index] = self.to_entry(item)
+            if entry is not None:
+                entries.append((index, entry))
+
+        if mode == 'atomic' and any(errors):
+            return Response({"applied": False, "results": self.results(errors, applied=False)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if entries:
+            batch_errors = services.apply_batch([entry for _, entry in entries], atomic=mode == 'atomic')
+            for (index, _), error in zip(entries, batch_errors):
+                if isinstance(error, Customer.DoesNotExist):
+                    errors[index] = 'No Customer matches the given query.'
+                elif isinstance(error, services.InsufficientFunds):
+                    errors[index] = 'There are not enough funds in the account'
 
+        applied = mode == 'best_effort' or not any(errors)
+        return Response({"applied": applied, "results": self.results(errors, applied)},
+                        status=status.HTTP_200_OK if applied else status.HTTP_400_BAD_REQUEST)
+
+    @staticmethod
+    def to_entry(item):
+        """
+        Проверка элемента пакета, возвращает (несохраненную транзакцию, None) или (None, текст ошибки)
+        """
+        if not isinstance(item, dict):
+            return None, "Each item must be an object"
+
+        amount = item.get('amount')
+        description = item.get('description')
+        item_type = item.get('type')
+
+        if item_type == 'operation':
+            customer_id = item.get('customer')
+            operation = item.get('operation')
+            if not amount or not operation or not customer_id:
+                return None, "Amount, operation and customer are required"
+        elif item_type == 'transfer':
+            sender_id = item.get('sender')
+            recipient_id = item.get('recipient')
+            if not amount or not sender_id or not recipient_id:
+                return None, "Amount, sender and recipient are required"
+        else:
+            return None, "The field 'type' is specified incorrectly, you must specify either 'operation' or 'transfer'."
+
+        if type(amount) not in (int, float) or amount <= 0:  # если сумма некорректная
+            return None, "The amount must be positive number"
+
+        # сумма - по десятичной записи числа, без погрешности двоичного float
+        amount = Decimal(str(amount))
+        if item_type == 'transfer':
+            sender_id, recipient_id = parse_customer_id(sender_id), parse_customer_id(recipient_id)
+            if sender_id is None or recipient_id is None:
+                return None, 'No Customer matches the given query.'
+            return Transaction(amount=amount, sender_id=sender_id, recipient_id=recipient_id,
+                               description=description), None
+        customer_id = parse_customer_id(customer_id)
+        if customer_id is None:
+            return None, 'No Customer matches the given query.'
+        if operation == 'withdraw':  # зачисление средств
+            return Transaction(amount=amount, recipient_id=customer_id, description=description), None
+        if operation == 'deposit':  # списание средств
+            return Transaction(amount=amount, sender_id=customer_id, description=description), None
+        return None, "The field 'operation' is specified incorrectly, you must specify either 'withdraw' or 'deposit'."
 
-class TransactionViewSet(ReadOnlyModelViewSet):
+    @staticmethod
+    def results(errors, applied):
+        results = []
+        for index, error in enumerate(errors):
+            if error is not None:
+                results.append({"index": index, "status": "error", "error": error})
+            else:
+                results.append({"index": index, "status": "ok" if applied else "not_applied"})
+        return results
+
+
+class TransactionViewSet(ReplicaReadMixin, ReadOnlyModelViewSet):
     """
     Получение списка транзакций
     GET запрос к  http://127.0.0.1:8000/balance/customers/<int:customer_id>/transactions/?order=timestamp.
     Для сортировки по дате необходимо указать параметр запроса ?order=timestamp, для сортировки по сумме ?order=amount.
     Для сортировки по убыванию параметр запроса должен начинаться с "-", например ?order=-amount
+    Навигация по курсору: ?pagination=cursor (далее - ссылки next/previous), ?count=false - без подсчета
+    общего числа транзакций
+    Суммы в валюте по курсу на дату транзакции - ?currency=USD
+    Транзакции за период - ?date_from=2024-07-01&date_to=2024-07-31 (даты или дата и время в ISO 8601):
+    читаются только секции журнала за месяцы периода. Транзакции архивированных месяцев читаются из архива
     """
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    period = (None, None)
+
+    def list(self, request, *args, **kwargs):
+        try:
+            self.period = (TransactionExportView.parse_bound(request.query_params.get('date_from')),
+                           TransactionExportView.parse_bound(request.query_params.get('date_to'), upper=True))
+        except ValueError:
+            return Response({"error": "Dates must be in ISO 8601 format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # строки страницы - кортежи values_list, сериализуются без экземпляров Transaction
+        page = self.paginate_queryset(TransactionRowSerializer.rows(self.filter_queryset(self.get_queryset())))
+        data = TransactionRowSerializer.data(page)
+        currency = request.query_params.get('currency')
+        if not currency:
+            return self.get_paginated_response(data)
+
+        # курсы на все даты страницы - одним запросом
+        days = [timezone.localtime(transaction.timestamp).date() for transaction in page]
+        rates = rate_history.rates_for_days(currency, days)
+        if not any(rates.values()) and not rate_history.has_currency(currency):
+            return Response({"error": "the currency was not found"}, status=status.HTTP_400_BAD_REQUEST)
+
+        for row, day in zip(data, days):
+            # None - если курса на дату транзакции еще нет в истории
+            row['amount'] = rate_history.convert(row['amount'], rates[day])
+            row['valute'] = currency
+        return self.get_paginated_response(data)
+
+    @property
+    def paginator(self):
+        """
+        Навигация по номеру страницы (по умолчанию) или по курсору
+        """
+        if not hasattr(self, '_paginator'):
+            request = getattr(self, 'request', None)
+            params = request.query_params if request is not None else {}
+            if KeysetPagination.cursor_query_param in params or params.get('pagination') == 'cursor':
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
-        customer = self.kwargs['customer_id']
-        order = self.request.query_params.get('order')
+        queryset = self.filter_period(self.queryset.for_customer(self.kwargs['customer_id']), *self.period)
+        # период захватывает архивированные месяцы: их транзакции читаются из файлов архива
+        queryset = archive.history(queryset, self.kwargs['customer_id'], *self.period)
+        return self.order_queryset(queryset, self.request.query_params.get('order'))
+
+    @staticmethod
+    def filter_period(queryset, date_from, date_to):
+        """
+        Транзакции с date_from по date_to (не включая). Условие попадает в каждую выборку UNION,
+        поэтому секции журнала за другие месяцы не читаются
+        """
+        if date_from is not None:
+            queryset = queryset.filter(timestamp__gte=date_from)
+        if date_to is not None:
+            queryset = queryset.filter(timestamp__lt=date_to)
+        return queryset
+
+    @staticmethod
+    def order_queryset(queryset, order):
+        """
+        Сортировка по параметру order (timestamp, amount, -timestamp, -amount), при равенстве - по id
+        """
         if order:
             if order == 'timestamp' or order == 'amount' or order[1:] == 'timestamp' or order[1:] == 'amount':
-                return self.queryset.filter(Q(recipient=customer) | Q(sender=customer)).order_by(order)
-        return self.queryset.filter(Q(recipient=customer) | Q(sender=customer))
+                return queryset.order_by(order, order.replace(order.lstrip('-'), 'id'))
+        return queryset
+
+
+class StatementView(APIView):
+    """
+    Выписка: зачисления, списания и их количество по дням или месяцам
+    GET запрос к http://127.0.0.1:8000/balance/customers/<int:customer_id>/transactions/statement/?period=day
+    Параметры запроса: period - month (по умолчанию) или day,
+    date_from и date_to - даты, попадающие в первый и последний период выписки.
+    Периоды без транзакций в выписку не попадают.
+    """
+
+    def get(self, request, customer_id):
+        period = request.query_params.get('period', 'month')
+        if period not in statements.PERIODS:
+            return Response({"error": "The period must be either 'day' or 'month'"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        bounds = {}
+        for name in ('date_from', 'date_to'):
+            value = request.query_params.get(name)
+            if value:
+                try:
+                    bounds[name] = parse_date(value)
+                except ValueError:  # дата в верном формате, но не существует
+                    bounds[name] = None
+                if bounds[name] is None:
+                    return Response({"error": "Dates must be in YYYY-MM-DD format"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+        if not Customer.objects.filter(pk=customer_id).exists():
+            raise Http404('No Customer matches the given query.')
+        rollups = statements.get_statement(customer_id, period, **bounds)
+        return Response({"id": customer_id, "period": period, "valute": "RUB",
+                         "results": StatementSerializer(rollups, many=True).data}, status=status.HTTP_200_OK)
+
+
+class TransactionExportView(View):
+    """
+    Потоковая выгрузка всей истории транзакций пользователя
+    GET запрос к http://127.0.0.1:8000/balance/customers/<int:customer_id>/transactions/export/?format=ndjson
+    Параметры запроса: format - csv (по умолчанию) или ndjson,
+    date_from и date_to - границы периода (дата или дата и время в ISO 8601, обе включительно).
+    Строки упорядочены по дате, затем по id.
+    """
+    chunk_size = 2000
+
+    def get(self, request, customer_id):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in export.FORMATS:
+            return JsonResponse({"error": "The format must be either 'csv' or 'ndjson'"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            date_from = self.parse_bound(request.GET.get('date_from'))
+            date_to = self.parse_bound(request.GET.get('date_to'), upper=True)
+        except ValueError:
+            return JsonResponse({"error": "Dates must be in ISO 8601 format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not Customer.objects.filter(pk=customer_id).exists():
+            return JsonResponse({"detail": "No Customer matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+
+        _, content_type = export.FORMATS[export_format]
+        response = StreamingHttpResponse(
+            export.stream(customer_id, export_format, date_from, date_to, self.chunk_size),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="transactions_{customer_id}.{export_format}"'
+        return response
+
+    @staticmethod
+    def parse_bound(value, upper=False):
+        """
+        Граница периода: дата и время как есть, дата - начало дня (для верхней границы - начало следующего дня)
+        """
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is not None:
+            moment = datetime.combine(day + timedelta(days=1) if upper else day, time.min)
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValueError(value)
+            if upper:
+                moment += timedelta(microseconds=1)  # верхняя граница включительно
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+
+class CustomerImportView(APIView):
+    """
+    Загрузка пользователей с начальными балансами из CSV (см. customer_import.py), только для администраторов
+    POST запрос к http://127.0.0.1:8000/balance/customers/import/ (multipart/form-data):
+    file - CSV с заголовком name,balance, не обязательное поле skip_invalid=true - пропустить строки с ошибками.
+    Ход загрузки - GET запрос к http://127.0.0.1:8000/balance/customers/import/<id>/.
+    Прерванная загрузка продолжается повторной отправкой того же файла
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def get(self, request, import_id=None):
+        if import_id is None:  # GET - только к загрузке с id
+            return self.http_method_not_allowed(request)
+        try:
+            result = CustomerImport.objects.get(pk=import_id)
+        except CustomerImport.DoesNotExist:
+            raise Http404('No import matches the given query.')
+        return Response(self.describe(result), status=status.HTTP_200_OK)
+
+    def post(self, request, import_id=None):
+        if import_id is not None:
+            return self.http_method_not_allowed(request)
+        file = request.FILES.get('file')
+        if file is None:
+            return Response({"error": "File is required"}, status=status.HTTP_400_BAD_REQUEST)
+        skip_invalid = request.data.get('skip_invalid') in ('true', '1')
+
+        try:
+            result = customer_import.import_customers(file, file.name, skip_invalid, size=file.size)
+        except customer_import.ImportFailed as exc:
+            return Response({"error": f"Invalid CSV file: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
+        if result.status == 'invalid':
+            return Response(self.describe(result), status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.describe(result), status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def describe(result):
+        return {"id": result.pk, "status": result.status, "rows": result.rows, "invalid": result.invalid,
+                "imported": result.merged_line, "customers": result.customers, "error": result.error}
+
+
+class DatabaseHealthView(APIView):
+    """
+    Проверка доступности базы и статистика пула соединений
+    GET запрос к http://127.0.0.1:8000/balance/health/db/
+    """
+
+    def get(self, request):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError as exc:
+            return Response({"status": "unavailable", "error": str(exc), "pools": pool_stats()},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"status": "ok", "pools": pool_stats()}, status=status.HTTP_200_OK)
+
+
+class MetricsView(View):
+    """
+    Метрики приложения в текстовом формате Prometheus (см. metrics.py)
+    GET запрос к http://127.0.0.1:8000/metrics
+    """
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
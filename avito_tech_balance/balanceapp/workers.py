@@ -0,0 +1,16 @@
+"""
+Настройка Django в процессах пула (см. reconcile.py). Модуль не импортирует модели: процесс, запущенный
+через spawn, загружает его до django.setup()
+"""
+import django
+from django.db import connections
+
+
+def setup(databases):
+    """
+    django.setup() и имена баз родительского процесса по алиасам (например, тестовой базы,
+    которую test runner подставляет только в своем процессе)
+    """
+    django.setup()
+    for alias, name in databases.items():
+        connections[alias].settings_dict['NAME'] = name
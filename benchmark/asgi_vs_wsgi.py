@@ -0,0 +1,87 @@
+"""
+Сравнение синхронных (gunicorn, WSGI) и асинхронных (uvicorn, ASGI) эндпоинтов под нагрузкой.
+
+Запуск после docker compose up -d (nginx отдает /balance/ из gunicorn, /balance/async/ из uvicorn):
+    python benchmark/asgi_vs_wsgi.py --concurrency 50 --requests 2000 --json results.json
+
+Для каждого сценария и каждого сервера выводятся пропускная способность, задержки (p50/p95/p99)
+и число ответов с ошибкой.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from common import latency_summary
+
+SCENARIOS = {
+    'customer': lambda customer_id: ('GET', f'customers/{customer_id}/', None),
+    'customer_currency': lambda customer_id: ('GET', f'customers/{customer_id}/?currency=USD', None),
+    'transactions': lambda customer_id: ('GET', f'customers/{customer_id}/transactions/?order=-amount', None),
+    'operation': lambda customer_id: ('POST', f'customers/{customer_id}/operations/',
+                                      {'amount': 1, 'operation': 'withdraw'}),
+}
+
+
+async def run(client, base_url, scenario, customer_id, concurrency, total):
+    method, path, body = SCENARIOS[scenario](customer_id)
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, base_url + path, json=body)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {'requests': total, 'errors': errors, **latency_summary(latencies, elapsed)}
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        response = await client.post(args.wsgi_url + 'customers/', json={'name': 'benchmark'})
+        response.raise_for_status()
+        customer_id = response.json()['id']
+        await client.post(args.wsgi_url + f'customers/{customer_id}/operations/',
+                          json={'amount': 1000, 'operation': 'withdraw'})
+
+        results = []
+        for scenario in args.scenarios:
+            for server, base_url in (('wsgi', args.wsgi_url), ('asgi', args.asgi_url)):
+                await run(client, base_url, scenario, customer_id, args.concurrency, args.warmup)
+                result = await run(client, base_url, scenario, customer_id, args.concurrency, args.requests)
+                results.append({'scenario': scenario, 'server': server, 'concurrency': args.concurrency, **result})
+                print(f"{scenario:<18} {server:<5} {result['rps']:>9} rps  p50 {result['p50_ms']:>8} ms  "
+                      f"p95 {result['p95_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  errors {result['errors']}")
+
+        await client.delete(args.wsgi_url + f'customers/{customer_id}/')
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wsgi-url', default='http://127.0.0.1:1337/balance/')
+    parser.add_argument('--asgi-url', default='http://127.0.0.1:1337/balance/async/')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--json', help='file for results in JSON')
+    asyncio.run(main(parser.parse_args()))
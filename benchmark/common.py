@@ -0,0 +1,23 @@
+"""
+Общие функции скриптов нагрузочного тестирования
+"""
+import statistics
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def latency_summary(latencies, elapsed):
+    """
+    Пропускная способность и задержки p50/p95/p99 (мс) по списку задержек в секундах
+    """
+    if not latencies:
+        return {'rps': 0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    return {
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
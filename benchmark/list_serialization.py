@@ -0,0 +1,117 @@
+"""
+Микробенчмарк сериализации страницы списка: сериализаторы DRF и JSONRenderer против строк values_list,
+TransactionRowSerializer / CustomerRowSerializer и FastJSONRenderer (balanceapp/renderers.py).
+
+База не нужна: строки страницы строятся в памяти, для пути DRF экземпляры моделей создаются так же,
+как их создает ORM (Model.from_db). Перед замером проверяется, что оба пути дают одинаковые байты.
+
+Запуск из корня репозитория:
+    python benchmark/list_serialization.py --rows 10 100 1000 --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'avito_tech_balance'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'avito_tech_balance.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db.models.utils import create_namedtuple_class  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from balanceapp import renderers  # noqa: E402
+from balanceapp.models import Customer, Transaction  # noqa: E402
+from balanceapp.serializers import (CustomerRowSerializer, CustomerSerializer, TransactionRowSerializer,  # noqa: E402
+                                    TransactionSerializer)
+
+
+def transaction_rows(count):
+    now = timezone.now()
+    return [(number, Decimal(random.randint(1, 10 ** 7)) / 100, now - timedelta(seconds=number, microseconds=number),
+             random.choice([None, 'Перевод за заказ', 'refund']), random.choice([None, 1]), 2)
+            for number in range(1, count + 1)]
+
+
+def customer_rows(count):
+    return [(number, f'Пользователь {number}', Decimal(random.randint(0, 10 ** 7)) / 100, number % 2,
+             Decimal(random.randint(0, 10 ** 5)) / 100 if number % 2 else None)
+            for number in range(1, count + 1)]
+
+
+def scenarios(count):
+    """
+    Пары (путь DRF, быстрый путь): функции от строк values_list, возвращающие тело ответа
+    """
+    transaction_fields = ['id', 'amount', 'timestamp', 'description', 'sender_id', 'recipient_id']
+    customer_fields = ['id', 'name', 'balance', 'balance_slots', 'slots_balance']
+
+    def drf_transactions(rows):
+        instances = [Transaction.from_db('default', transaction_fields, row) for row in rows]
+        return JSONRenderer().render({'results': TransactionSerializer(instances, many=True).data})
+
+    def drf_customers(rows):
+        instances = []
+        for pk, name, balance, balance_slots, slots_balance in rows:
+            instance = Customer.from_db('default', ['id', 'name', 'balance', 'balance_slots'],
+                                        (pk, name, balance, balance_slots))
+            instance.slots_balance = slots_balance  # аннотация with_total_balance
+            instances.append(instance)
+        return JSONRenderer().render({'results': CustomerSerializer(instances, many=True).data})
+
+    def fast(serializer, fields):
+        row_class = create_namedtuple_class(*fields)
+
+        def render(rows):
+            # values_list(named=True) создает именованные кортежи из строк курсора
+            rows = [row_class._make(row) for row in rows]
+            return renderers.FastJSONRenderer().render({'results': serializer.data(rows)})
+        return render
+
+    return {
+        'transactions': (transaction_rows(count), drf_transactions,
+                         fast(TransactionRowSerializer, TransactionRowSerializer.columns)),
+        'customers': (customer_rows(count), drf_customers, fast(CustomerRowSerializer, CustomerRowSerializer.columns)),
+    }
+
+
+def measure(function, rows, repeat, number):
+    return min(timeit.repeat(lambda: function(rows), repeat=repeat, number=number)) / number
+
+
+def main(args):
+    if renderers.orjson is None:
+        print('orjson is not installed: FastJSONRenderer falls back to JSONRenderer')
+    results = []
+    for count in args.rows:
+        number = max(1, args.budget // count)
+        for name, (rows, drf, fast) in scenarios(count).items():
+            if drf(rows) != fast(rows):
+                raise SystemExit(f'{name}: responses differ')
+            drf_time, fast_time = measure(drf, rows, args.repeat, number), measure(fast, rows, args.repeat, number)
+            result = {'scenario': name, 'rows': count, 'drf_us': round(drf_time * 10 ** 6, 1),
+                      'fast_us': round(fast_time * 10 ** 6, 1), 'speedup': round(drf_time / fast_time, 2)}
+            results.append(result)
+            print(f"{name:<13} {count:>6} rows  DRF {result['drf_us']:>10} us  fast {result['fast_us']:>10} us  "
+                  f"x{result['speedup']}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000], help='rows per page')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=int, default=20000, help='rows serialized per measurement')
+    parser.add_argument('--json', help='file for results in JSON')
+    main(parser.parse_args())
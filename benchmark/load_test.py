@@ -0,0 +1,273 @@
+"""
+Нагрузочный тест API баланса с проверкой корректности.
+
+Создает --customers пользователей с начальным балансом, затем --concurrency параллельных клиентов
+выполняют --requests запросов вперемешку (зачисления и списания, переводы, чтение истории и пользователя,
+доли задаются --mix). После нагрузки проверяются инварианты:
+
+- баланс каждого пользователя равен сумме его транзакций в журнале (выгрузка истории),
+  а сумма всех балансов - чистому итогу журнала: расхождение означает потерянное обновление;
+- баланс каждого пользователя совпадает с ожидаемым по успешным ответам API
+  (пользователи, у которых был ответ с ошибкой 5xx или таймаут, в этой проверке пропускаются);
+- балансы не отрицательные.
+
+Перед проверкой скрипт ждет --settle секунд: без общего кэша пользователей воркер может отдавать
+баланс из локального кэша до CUSTOMER_CACHE['LOCAL_TIMEOUT'] секунд после изменения в другом воркере.
+
+Запуск против docker compose (nginx на порту 1337):
+    python benchmark/load_test.py --customers 50 --requests 5000 --json results/$(git rev-parse --short HEAD).json
+против локального сервера (gunicorn или manage.py runserver с локальным PostgreSQL):
+    python benchmark/load_test.py --url http://127.0.0.1:8000/balance/
+сравнение с предыдущим прогоном:
+    python benchmark/load_test.py --json new.json --compare old.json
+
+Если инвариант нарушен, скрипт завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import httpx
+
+from common import latency_summary
+
+SCENARIOS = ('operation', 'transfer', 'transactions', 'customer')
+DEFAULT_MIX = 'operation=40,transfer=40,transactions=15,customer=5'
+
+
+class Workload:
+    """
+    Состояние нагрузки: ожидаемые балансы по успешным ответам и статистика по эндпоинтам
+    """
+
+    def __init__(self, client, base_url, customer_ids, initial, seed):
+        self.client = client
+        self.base_url = base_url
+        self.customer_ids = customer_ids
+        self.expected = {customer_id: Decimal(initial) for customer_id in customer_ids}
+        self.uncertain = set()  # исход операции неизвестен (5xx или таймаут)
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.random = random.Random(seed)
+
+    async def request(self, endpoint, method, path, body=None):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, self.base_url + path, json=body)
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, 'error'
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        self.statuses[endpoint][status] += 1
+        return response
+
+    async def operation(self):
+        customer_id = self.random.choice(self.customer_ids)
+        amount = self.random.randint(1, 100)
+        # 'withdraw' - зачисление, 'deposit' - списание
+        kind = self.random.choice(('withdraw', 'deposit'))
+        response = await self.request('operation', 'POST', f'customers/{customer_id}/operations/',
+                                      {'amount': amount, 'operation': kind})
+        if response is not None and response.status_code == 200:
+            self.expected[customer_id] += amount if kind == 'withdraw' else -amount
+        elif response is None or response.status_code >= 500:
+            self.uncertain.add(customer_id)
+
+    async def transfer(self):
+        sender, recipient = self.random.sample(self.customer_ids, 2)
+        amount = self.random.randint(1, 100)
+        response = await self.request('transfer', 'POST', 'transfer/',
+                                      {'sender': sender, 'recipient': recipient, 'amount': amount})
+        if response is not None and response.status_code == 200:
+            self.expected[sender] -= amount
+            self.expected[recipient] += amount
+        elif response is None or response.status_code >= 500:
+            self.uncertain.update((sender, recipient))
+
+    async def transactions(self):
+        customer_id = self.random.choice(self.customer_ids)
+        order = self.random.choice(('timestamp', '-timestamp', '-amount'))
+        await self.request('transactions', 'GET', f'customers/{customer_id}/transactions/?order={order}')
+
+    async def customer(self):
+        await self.request('customer', 'GET', f'customers/{self.random.choice(self.customer_ids)}/')
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                'requests': len(latencies),
+                'ok': sum(count for status, count in statuses.items() if status != 'error' and status < 400),
+                # 400 - ожидаемый отказ (например, недостаточно средств), а не сбой
+                'rejected': sum(count for status, count in statuses.items() if status != 'error' and
+                                400 <= status < 500),
+                'errors': sum(count for status, count in statuses.items() if status == 'error' or status >= 500),
+                **latency_summary(latencies, elapsed),
+            }
+        return endpoints
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'unknown scenario {name!r}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def setup(client, base_url, count, initial):
+    customer_ids = []
+    for number in range(count):
+        response = await client.post(base_url + 'customers/', json={'name': f'load test {number}'})
+        response.raise_for_status()
+        customer_id = response.json()['id']
+        if initial:
+            response = await client.post(base_url + f'customers/{customer_id}/operations/',
+                                         json={'amount': initial, 'operation': 'withdraw'})
+            response.raise_for_status()
+        customer_ids.append(customer_id)
+    return customer_ids
+
+
+async def ledger_net(client, base_url, customer_id):
+    """
+    Чистый итог журнала пользователя: полученные минус отправленные
+    """
+    response = await client.get(base_url + f'customers/{customer_id}/transactions/export/?format=ndjson')
+    response.raise_for_status()
+    net = Decimal(0)
+    for line in response.text.splitlines():
+        row = json.loads(line)
+        if row['recipient'] == customer_id:
+            net += Decimal(row['amount'])
+        if row['sender'] == customer_id:
+            net -= Decimal(row['amount'])
+    return net
+
+
+async def check_invariants(workload):
+    client, base_url = workload.client, workload.base_url
+    balances, nets = {}, {}
+    for customer_id in workload.customer_ids:
+        response = await client.get(base_url + f'customers/{customer_id}/')
+        response.raise_for_status()
+        balances[customer_id] = Decimal(response.json()['balance'])
+        nets[customer_id] = await ledger_net(client, base_url, customer_id)
+
+    checked = [customer_id for customer_id in workload.customer_ids if customer_id not in workload.uncertain]
+    ledger_mismatch = [customer_id for customer_id in workload.customer_ids
+                       if balances[customer_id] != nets[customer_id]]
+    expected_mismatch = [customer_id for customer_id in checked
+                         if balances[customer_id] != workload.expected[customer_id]]
+    negative = [customer_id for customer_id, balance in balances.items() if balance < 0]
+    return {
+        'balances_total': str(sum(balances.values())),
+        'ledger_net_total': str(sum(nets.values())),
+        'total_matches_ledger': sum(balances.values()) == sum(nets.values()),
+        'ledger_mismatch': ledger_mismatch,
+        'expected_mismatch': expected_mismatch,
+        'expected_checked': len(checked),
+        'negative_balances': negative,
+        'passed': (sum(balances.values()) == sum(nets.values()) and not ledger_mismatch
+                   and not expected_mismatch and not negative),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(result, previous):
+    print(f"\ncompared with {previous.get('label') or previous.get('revision')}:")
+    for endpoint, current in result['endpoints'].items():
+        before = previous.get('endpoints', {}).get(endpoint)
+        if not before or not before['rps'] or current['p99_ms'] is None or before['p99_ms'] is None:
+            continue
+        print(f"{endpoint:<14} rps {before['rps']:>9} -> {current['rps']:<9} ({current['rps'] / before['rps'] - 1:+.1%})"
+              f"  p99 {before['p99_ms']:>8} -> {current['p99_ms']:<8} ms")
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        customer_ids = await setup(client, args.url, args.customers, args.initial)
+        workload = Workload(client, args.url, customer_ids, args.initial, args.seed)
+        scenarios, weights = zip(*args.mix.items())
+        plan = iter(workload.random.choices(scenarios, weights, k=args.requests))
+
+        async def worker():
+            for scenario in plan:
+                await getattr(workload, scenario)()
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+
+        endpoints = workload.summary(elapsed)
+        await asyncio.sleep(args.settle)
+        invariants = await check_invariants(workload)
+        if not args.keep:
+            for customer_id in customer_ids:
+                await client.delete(args.url + f'customers/{customer_id}/')
+
+    result = {
+        'label': args.label,
+        'revision': git_revision(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'config': {'url': args.url, 'customers': args.customers, 'initial': args.initial,
+                   'concurrency': args.concurrency, 'requests': args.requests, 'mix': args.mix, 'seed': args.seed},
+        'elapsed_s': round(elapsed, 3),
+        'total': {'requests': args.requests, 'rps': round(args.requests / elapsed, 1)},
+        'endpoints': endpoints,
+        'invariants': invariants,
+    }
+
+    for endpoint, stats in endpoints.items():
+        print(f"{endpoint:<14} {stats['requests']:>7} req {stats['rps']:>9} ops/s  p50 {stats['p50_ms']:>8} ms  "
+              f"p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  "
+              f"rejected {stats['rejected']}  errors {stats['errors']}")
+    print(f"{'total':<14} {args.requests:>7} req {result['total']['rps']:>9} ops/s")
+    print(f"invariants: {'passed' if invariants['passed'] else 'FAILED'} (balances {invariants['balances_total']}, "
+          f"ledger {invariants['ledger_net_total']})")
+
+    if args.compare:
+        with open(args.compare) as file:
+            print_comparison(result, json.load(file))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(result, file, indent=2)
+    return 0 if invariants['passed'] else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:1337/balance/')
+    parser.add_argument('--customers', type=int, default=50)
+    parser.add_argument('--initial', type=int, default=10000, help='initial balance of each customer')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'scenario weights, default {DEFAULT_MIX}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--settle', type=float, default=1.5,
+                        help='seconds to wait before checking invariants (local customer cache timeout)')
+    parser.add_argument('--label', help='name of the run in the JSON results')
+    parser.add_argument('--keep', action='store_true', help='do not delete the customers after the run')
+    parser.add_argument('--json', help='file for results in JSON')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -190,6 +190,64 @@ ALTER TABLE public.auth_user_user_permissions ALTER COLUMN id ADD GENERATED BY D
 );
 
 
+--
+-- Name: balanceapp_balancecheckpoint; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_balancecheckpoint (
+    id bigint NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    transaction_id bigint,
+    balance numeric(99,2) NOT NULL,
+    customer_id bigint NOT NULL
+);
+
+
+ALTER TABLE public.balanceapp_balancecheckpoint OWNER TO postgres;
+
+--
+-- Name: balanceapp_balancecheckpoint_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.balanceapp_balancecheckpoint ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (
+    SEQUENCE NAME public.balanceapp_balancecheckpoint_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1
+);
+
+
+--
+-- Name: balanceapp_balanceslot; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_balanceslot (
+    id bigint NOT NULL,
+    slot smallint NOT NULL,
+    balance numeric(99,2) NOT NULL,
+    customer_id bigint NOT NULL,
+    CONSTRAINT balanceapp_balanceslot_slot_check CHECK ((slot >= 0))
+);
+
+
+ALTER TABLE public.balanceapp_balanceslot OWNER TO postgres;
+
+--
+-- Name: balanceapp_balanceslot_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.balanceapp_balanceslot ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (
+    SEQUENCE NAME public.balanceapp_balanceslot_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1
+);
+
+
 --
 -- Name: balanceapp_customer; Type: TABLE; Schema: public; Owner: postgres
 --
@@ -197,7 +255,10 @@ ALTER TABLE public.auth_user_user_permissions ALTER COLUMN id ADD GENERATED BY D
 CREATE TABLE public.balanceapp_customer (
     id bigint NOT NULL,
     name character varying(100) NOT NULL,
-    balance numeric(99,2) NOT NULL
+    balance numeric(99,2) NOT NULL,
+    version bigint NOT NULL,
+    balance_slots smallint NOT NULL,
+    CONSTRAINT balanceapp_customer_balance_slots_check CHECK ((balance_slots >= 0))
 );
 
 
@@ -217,6 +278,134 @@ ALTER TABLE public.balanceapp_customer ALTER COLUMN id ADD GENERATED BY DEFAULT
 );
 
 
+--
+-- Name: balanceapp_customerimport; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_customerimport (
+    id bigint NOT NULL,
+    created timestamp with time zone NOT NULL,
+    finished timestamp with time zone,
+    source character varying(255) NOT NULL,
+    checksum character varying(64) NOT NULL,
+    status character varying(8) NOT NULL,
+    rows bigint NOT NULL,
+    invalid bigint NOT NULL,
+    merged_line bigint NOT NULL,
+    customers bigint NOT NULL,
+    error text NOT NULL
+);
+
+
+ALTER TABLE public.balanceapp_customerimport OWNER TO postgres;
+
+--
+-- Name: balanceapp_customerimport_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.balanceapp_customerimport ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (
+    SEQUENCE NAME public.balanceapp_customerimport_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1
+);
+
+
+--
+-- Name: balanceapp_exchangerate; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_exchangerate (
+    id bigint NOT NULL,
+    code character varying(3) NOT NULL,
+    date date NOT NULL,
+    rate numeric(20,8) NOT NULL
+);
+
+
+ALTER TABLE public.balanceapp_exchangerate OWNER TO postgres;
+
+--
+-- Name: balanceapp_exchangerate_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.balanceapp_exchangerate ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (
+    SEQUENCE NAME public.balanceapp_exchangerate_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1
+);
+
+
+--
+-- Name: balanceapp_reconciliationrun; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_reconciliationrun (
+    id bigint NOT NULL,
+    started timestamp with time zone NOT NULL,
+    finished timestamp with time zone,
+    "full" boolean NOT NULL,
+    last_transaction_id bigint,
+    customers bigint NOT NULL,
+    discrepancies bigint NOT NULL
+);
+
+
+ALTER TABLE public.balanceapp_reconciliationrun OWNER TO postgres;
+
+--
+-- Name: balanceapp_reconciliationrun_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.balanceapp_reconciliationrun ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (
+    SEQUENCE NAME public.balanceapp_reconciliationrun_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1
+);
+
+
+--
+-- Name: balanceapp_statementrollup; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_statementrollup (
+    id bigint NOT NULL,
+    period character varying(5) NOT NULL,
+    start date NOT NULL,
+    inflow numeric(99,2) NOT NULL,
+    outflow numeric(99,2) NOT NULL,
+    inflow_count integer NOT NULL,
+    outflow_count integer NOT NULL,
+    customer_id bigint NOT NULL,
+    slot smallint NOT NULL,
+    CONSTRAINT balanceapp_statementrollup_slot_check CHECK ((slot >= 0))
+);
+
+
+ALTER TABLE public.balanceapp_statementrollup OWNER TO postgres;
+
+--
+-- Name: balanceapp_statementrollup_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.balanceapp_statementrollup ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (
+    SEQUENCE NAME public.balanceapp_statementrollup_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1
+);
+
+
 --
 -- Name: balanceapp_transaction; Type: TABLE; Schema: public; Owner: postgres
 --
@@ -228,11 +417,28 @@ CREATE TABLE public.balanceapp_transaction (
     description character varying(150),
     recipient_id bigint,
     sender_id bigint
-);
+)
+PARTITION BY RANGE ("timestamp");
 
 
 ALTER TABLE public.balanceapp_transaction OWNER TO postgres;
 
+--
+-- Name: balanceapp_transaction_default; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_transaction_default (
+    id bigint NOT NULL,
+    amount numeric(99,2) NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    description character varying(150),
+    recipient_id bigint,
+    sender_id bigint
+);
+
+
+ALTER TABLE public.balanceapp_transaction_default OWNER TO postgres;
+
 --
 -- Name: balanceapp_transaction_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
 --
@@ -247,6 +453,70 @@ ALTER TABLE public.balanceapp_transaction ALTER COLUMN id ADD GENERATED BY DEFAU
 );
 
 
+--
+-- Name: balanceapp_transaction_p202610; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_transaction_p202610 (
+    id bigint NOT NULL,
+    amount numeric(99,2) NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    description character varying(150),
+    recipient_id bigint,
+    sender_id bigint
+);
+
+
+ALTER TABLE public.balanceapp_transaction_p202610 OWNER TO postgres;
+
+--
+-- Name: balanceapp_transaction_p202611; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_transaction_p202611 (
+    id bigint NOT NULL,
+    amount numeric(99,2) NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    description character varying(150),
+    recipient_id bigint,
+    sender_id bigint
+);
+
+
+ALTER TABLE public.balanceapp_transaction_p202611 OWNER TO postgres;
+
+--
+-- Name: balanceapp_transaction_p202612; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_transaction_p202612 (
+    id bigint NOT NULL,
+    amount numeric(99,2) NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    description character varying(150),
+    recipient_id bigint,
+    sender_id bigint
+);
+
+
+ALTER TABLE public.balanceapp_transaction_p202612 OWNER TO postgres;
+
+--
+-- Name: balanceapp_transaction_p202701; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.balanceapp_transaction_p202701 (
+    id bigint NOT NULL,
+    amount numeric(99,2) NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    description character varying(150),
+    recipient_id bigint,
+    sender_id bigint
+);
+
+
+ALTER TABLE public.balanceapp_transaction_p202701 OWNER TO postgres;
+
 --
 -- Name: django_admin_log; Type: TABLE; Schema: public; Owner: postgres
 --
@@ -348,6 +618,41 @@ CREATE TABLE public.django_session (
 
 ALTER TABLE public.django_session OWNER TO postgres;
 
+--
+-- Name: balanceapp_transaction_default; Type: TABLE ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_transaction ATTACH PARTITION public.balanceapp_transaction_default DEFAULT;
+
+
+--
+-- Name: balanceapp_transaction_p202610; Type: TABLE ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_transaction ATTACH PARTITION public.balanceapp_transaction_p202610 FOR VALUES FROM ('2026-10-01 00:00:00+00') TO ('2026-11-01 00:00:00+00');
+
+
+--
+-- Name: balanceapp_transaction_p202611; Type: TABLE ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_transaction ATTACH PARTITION public.balanceapp_transaction_p202611 FOR VALUES FROM ('2026-11-01 00:00:00+00') TO ('2026-12-01 00:00:00+00');
+
+
+--
+-- Name: balanceapp_transaction_p202612; Type: TABLE ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_transaction ATTACH PARTITION public.balanceapp_transaction_p202612 FOR VALUES FROM ('2026-12-01 00:00:00+00') TO ('2027-01-01 00:00:00+00');
+
+
+--
+-- Name: balanceapp_transaction_p202701; Type: TABLE ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_transaction ATTACH PARTITION public.balanceapp_transaction_p202701 FOR VALUES FROM ('2027-01-01 00:00:00+00') TO ('2027-02-01 00:00:00+00');
+
+
 --
 -- Name: auth_group auth_group_name_key; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -445,136 +750,543 @@ ALTER TABLE ONLY public.auth_user
 
 
 --
--- Name: balanceapp_customer balanceapp_customer_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: balanceapp_balanceslot balance_slot_customer_slot_uniq; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.balanceapp_customer
-    ADD CONSTRAINT balanceapp_customer_pkey PRIMARY KEY (id);
+ALTER TABLE ONLY public.balanceapp_balanceslot
+    ADD CONSTRAINT balance_slot_customer_slot_uniq UNIQUE (customer_id, slot);
 
 
 --
--- Name: balanceapp_transaction balanceapp_transaction_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: balanceapp_balancecheckpoint balanceapp_balancecheckpoint_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.balanceapp_transaction
-    ADD CONSTRAINT balanceapp_transaction_pkey PRIMARY KEY (id);
+ALTER TABLE ONLY public.balanceapp_balancecheckpoint
+    ADD CONSTRAINT balanceapp_balancecheckpoint_pkey PRIMARY KEY (id);
 
 
 --
--- Name: django_admin_log django_admin_log_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: balanceapp_balanceslot balanceapp_balanceslot_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.django_admin_log
-    ADD CONSTRAINT django_admin_log_pkey PRIMARY KEY (id);
+ALTER TABLE ONLY public.balanceapp_balanceslot
+    ADD CONSTRAINT balanceapp_balanceslot_pkey PRIMARY KEY (id);
 
 
 --
--- Name: django_content_type django_content_type_app_label_model_76bd3d3b_uniq; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: balanceapp_customer balanceapp_customer_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.django_content_type
-    ADD CONSTRAINT django_content_type_app_label_model_76bd3d3b_uniq UNIQUE (app_label, model);
+ALTER TABLE ONLY public.balanceapp_customer
+    ADD CONSTRAINT balanceapp_customer_pkey PRIMARY KEY (id);
 
 
 --
--- Name: django_content_type django_content_type_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: balanceapp_customerimport balanceapp_customerimport_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.django_content_type
-    ADD CONSTRAINT django_content_type_pkey PRIMARY KEY (id);
+ALTER TABLE ONLY public.balanceapp_customerimport
+    ADD CONSTRAINT balanceapp_customerimport_pkey PRIMARY KEY (id);
 
 
 --
--- Name: django_migrations django_migrations_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: balanceapp_exchangerate balanceapp_exchangerate_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.django_migrations
-    ADD CONSTRAINT django_migrations_pkey PRIMARY KEY (id);
+ALTER TABLE ONLY public.balanceapp_exchangerate
+    ADD CONSTRAINT balanceapp_exchangerate_pkey PRIMARY KEY (id);
 
 
 --
--- Name: django_session django_session_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: balanceapp_reconciliationrun balanceapp_reconciliationrun_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.django_session
-    ADD CONSTRAINT django_session_pkey PRIMARY KEY (session_key);
+ALTER TABLE ONLY public.balanceapp_reconciliationrun
+    ADD CONSTRAINT balanceapp_reconciliationrun_pkey PRIMARY KEY (id);
 
 
 --
--- Name: auth_group_name_a6ea08ec_like; Type: INDEX; Schema: public; Owner: postgres
+-- Name: balanceapp_statementrollup balanceapp_statementrollup_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_group_name_a6ea08ec_like ON public.auth_group USING btree (name varchar_pattern_ops);
+ALTER TABLE ONLY public.balanceapp_statementrollup
+    ADD CONSTRAINT balanceapp_statementrollup_pkey PRIMARY KEY (id);
 
 
 --
--- Name: auth_group_permissions_group_id_b120cbf9; Type: INDEX; Schema: public; Owner: postgres
+-- Name: balanceapp_transaction balanceapp_transaction_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_group_permissions_group_id_b120cbf9 ON public.auth_group_permissions USING btree (group_id);
+ALTER TABLE ONLY public.balanceapp_transaction
+    ADD CONSTRAINT balanceapp_transaction_pkey PRIMARY KEY (id, "timestamp");
 
 
 --
--- Name: auth_group_permissions_permission_id_84c5c92e; Type: INDEX; Schema: public; Owner: postgres
+-- Name: balanceapp_transaction_default balanceapp_transaction_default_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_group_permissions_permission_id_84c5c92e ON public.auth_group_permissions USING btree (permission_id);
+ALTER TABLE ONLY public.balanceapp_transaction_default
+    ADD CONSTRAINT balanceapp_transaction_default_pkey PRIMARY KEY (id, "timestamp");
 
 
 --
--- Name: auth_permission_content_type_id_2f476e4b; Type: INDEX; Schema: public; Owner: postgres
+-- Name: balanceapp_transaction_p202610 balanceapp_transaction_p202610_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_permission_content_type_id_2f476e4b ON public.auth_permission USING btree (content_type_id);
+ALTER TABLE ONLY public.balanceapp_transaction_p202610
+    ADD CONSTRAINT balanceapp_transaction_p202610_pkey PRIMARY KEY (id, "timestamp");
 
 
 --
--- Name: auth_user_groups_group_id_97559544; Type: INDEX; Schema: public; Owner: postgres
+-- Name: balanceapp_transaction_p202611 balanceapp_transaction_p202611_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_user_groups_group_id_97559544 ON public.auth_user_groups USING btree (group_id);
+ALTER TABLE ONLY public.balanceapp_transaction_p202611
+    ADD CONSTRAINT balanceapp_transaction_p202611_pkey PRIMARY KEY (id, "timestamp");
 
 
 --
--- Name: auth_user_groups_user_id_6a12ed8b; Type: INDEX; Schema: public; Owner: postgres
+-- Name: balanceapp_transaction_p202612 balanceapp_transaction_p202612_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_user_groups_user_id_6a12ed8b ON public.auth_user_groups USING btree (user_id);
+ALTER TABLE ONLY public.balanceapp_transaction_p202612
+    ADD CONSTRAINT balanceapp_transaction_p202612_pkey PRIMARY KEY (id, "timestamp");
 
 
 --
--- Name: auth_user_user_permissions_permission_id_1fbb5f2c; Type: INDEX; Schema: public; Owner: postgres
+-- Name: balanceapp_transaction_p202701 balanceapp_transaction_p202701_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_user_user_permissions_permission_id_1fbb5f2c ON public.auth_user_user_permissions USING btree (permission_id);
+ALTER TABLE ONLY public.balanceapp_transaction_p202701
+    ADD CONSTRAINT balanceapp_transaction_p202701_pkey PRIMARY KEY (id, "timestamp");
 
 
 --
--- Name: auth_user_user_permissions_user_id_a95ead1b; Type: INDEX; Schema: public; Owner: postgres
+-- Name: balanceapp_balancecheckpoint checkpoint_customer_time_uniq; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_user_user_permissions_user_id_a95ead1b ON public.auth_user_user_permissions USING btree (user_id);
+ALTER TABLE ONLY public.balanceapp_balancecheckpoint
+    ADD CONSTRAINT checkpoint_customer_time_uniq UNIQUE (customer_id, "timestamp");
 
 
 --
--- Name: auth_user_username_6821ab7c_like; Type: INDEX; Schema: public; Owner: postgres
+-- Name: django_admin_log django_admin_log_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX auth_user_username_6821ab7c_like ON public.auth_user USING btree (username varchar_pattern_ops);
+ALTER TABLE ONLY public.django_admin_log
+    ADD CONSTRAINT django_admin_log_pkey PRIMARY KEY (id);
 
 
 --
--- Name: balanceapp_transaction_recipient_id_327b5bb3; Type: INDEX; Schema: public; Owner: postgres
+-- Name: django_content_type django_content_type_app_label_model_76bd3d3b_uniq; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX balanceapp_transaction_recipient_id_327b5bb3 ON public.balanceapp_transaction USING btree (recipient_id);
+ALTER TABLE ONLY public.django_content_type
+    ADD CONSTRAINT django_content_type_app_label_model_76bd3d3b_uniq UNIQUE (app_label, model);
 
 
 --
--- Name: balanceapp_transaction_sender_id_cfa0067b; Type: INDEX; Schema: public; Owner: postgres
+-- Name: django_content_type django_content_type_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX balanceapp_transaction_sender_id_cfa0067b ON public.balanceapp_transaction USING btree (sender_id);
+ALTER TABLE ONLY public.django_content_type
+    ADD CONSTRAINT django_content_type_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: django_migrations django_migrations_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.django_migrations
+    ADD CONSTRAINT django_migrations_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: django_session django_session_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.django_session
+    ADD CONSTRAINT django_session_pkey PRIMARY KEY (session_key);
+
+
+--
+-- Name: balanceapp_exchangerate exchange_rate_code_date_uniq; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_exchangerate
+    ADD CONSTRAINT exchange_rate_code_date_uniq UNIQUE (code, date);
+
+
+--
+-- Name: balanceapp_statementrollup rollup_customer_period_uniq; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_statementrollup
+    ADD CONSTRAINT rollup_customer_period_uniq UNIQUE (customer_id, period, start, slot);
+
+
+--
+-- Name: auth_group_name_a6ea08ec_like; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_group_name_a6ea08ec_like ON public.auth_group USING btree (name varchar_pattern_ops);
+
+
+--
+-- Name: auth_group_permissions_group_id_b120cbf9; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_group_permissions_group_id_b120cbf9 ON public.auth_group_permissions USING btree (group_id);
+
+
+--
+-- Name: auth_group_permissions_permission_id_84c5c92e; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_group_permissions_permission_id_84c5c92e ON public.auth_group_permissions USING btree (permission_id);
+
+
+--
+-- Name: auth_permission_content_type_id_2f476e4b; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_permission_content_type_id_2f476e4b ON public.auth_permission USING btree (content_type_id);
+
+
+--
+-- Name: auth_user_groups_group_id_97559544; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_user_groups_group_id_97559544 ON public.auth_user_groups USING btree (group_id);
+
+
+--
+-- Name: auth_user_groups_user_id_6a12ed8b; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_user_groups_user_id_6a12ed8b ON public.auth_user_groups USING btree (user_id);
+
+
+--
+-- Name: auth_user_user_permissions_permission_id_1fbb5f2c; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_user_user_permissions_permission_id_1fbb5f2c ON public.auth_user_user_permissions USING btree (permission_id);
+
+
+--
+-- Name: auth_user_user_permissions_user_id_a95ead1b; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_user_user_permissions_user_id_a95ead1b ON public.auth_user_user_permissions USING btree (user_id);
+
+
+--
+-- Name: auth_user_username_6821ab7c_like; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX auth_user_username_6821ab7c_like ON public.auth_user USING btree (username varchar_pattern_ops);
+
+
+--
+-- Name: tx_recipient_amount_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX tx_recipient_amount_idx ON ONLY public.balanceapp_transaction USING btree (recipient_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_default_recipient_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_default_recipient_id_amount_id_idx ON public.balanceapp_transaction_default USING btree (recipient_id, amount, id);
+
+
+--
+-- Name: tx_recipient_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX tx_recipient_id_idx ON ONLY public.balanceapp_transaction USING btree (recipient_id, id);
+
+
+--
+-- Name: balanceapp_transaction_default_recipient_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_default_recipient_id_id_idx ON public.balanceapp_transaction_default USING btree (recipient_id, id);
+
+
+--
+-- Name: tx_recipient_time_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX tx_recipient_time_idx ON ONLY public.balanceapp_transaction USING btree (recipient_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_default_recipient_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_default_recipient_id_timestamp_id_idx ON public.balanceapp_transaction_default USING btree (recipient_id, "timestamp", id);
+
+
+--
+-- Name: tx_sender_amount_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX tx_sender_amount_idx ON ONLY public.balanceapp_transaction USING btree (sender_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_default_sender_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_default_sender_id_amount_id_idx ON public.balanceapp_transaction_default USING btree (sender_id, amount, id);
+
+
+--
+-- Name: tx_sender_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX tx_sender_id_idx ON ONLY public.balanceapp_transaction USING btree (sender_id, id);
+
+
+--
+-- Name: balanceapp_transaction_default_sender_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_default_sender_id_id_idx ON public.balanceapp_transaction_default USING btree (sender_id, id);
+
+
+--
+-- Name: tx_sender_time_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX tx_sender_time_idx ON ONLY public.balanceapp_transaction USING btree (sender_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_default_sender_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_default_sender_id_timestamp_id_idx ON public.balanceapp_transaction_default USING btree (sender_id, "timestamp", id);
+
+
+--
+-- Name: tx_timestamp_brin; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX tx_timestamp_brin ON ONLY public.balanceapp_transaction USING brin ("timestamp");
+
+
+--
+-- Name: balanceapp_transaction_default_timestamp_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_default_timestamp_idx ON public.balanceapp_transaction_default USING brin ("timestamp");
+
+
+--
+-- Name: balanceapp_transaction_p202610_recipient_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202610_recipient_id_amount_id_idx ON public.balanceapp_transaction_p202610 USING btree (recipient_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_p202610_recipient_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202610_recipient_id_id_idx ON public.balanceapp_transaction_p202610 USING btree (recipient_id, id);
+
+
+--
+-- Name: balanceapp_transaction_p202610_recipient_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202610_recipient_id_timestamp_id_idx ON public.balanceapp_transaction_p202610 USING btree (recipient_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_p202610_sender_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202610_sender_id_amount_id_idx ON public.balanceapp_transaction_p202610 USING btree (sender_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_p202610_sender_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202610_sender_id_id_idx ON public.balanceapp_transaction_p202610 USING btree (sender_id, id);
+
+
+--
+-- Name: balanceapp_transaction_p202610_sender_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202610_sender_id_timestamp_id_idx ON public.balanceapp_transaction_p202610 USING btree (sender_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_p202610_timestamp_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202610_timestamp_idx ON public.balanceapp_transaction_p202610 USING brin ("timestamp");
+
+
+--
+-- Name: balanceapp_transaction_p202611_recipient_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202611_recipient_id_amount_id_idx ON public.balanceapp_transaction_p202611 USING btree (recipient_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_p202611_recipient_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202611_recipient_id_id_idx ON public.balanceapp_transaction_p202611 USING btree (recipient_id, id);
+
+
+--
+-- Name: balanceapp_transaction_p202611_recipient_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202611_recipient_id_timestamp_id_idx ON public.balanceapp_transaction_p202611 USING btree (recipient_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_p202611_sender_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202611_sender_id_amount_id_idx ON public.balanceapp_transaction_p202611 USING btree (sender_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_p202611_sender_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202611_sender_id_id_idx ON public.balanceapp_transaction_p202611 USING btree (sender_id, id);
+
+
+--
+-- Name: balanceapp_transaction_p202611_sender_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202611_sender_id_timestamp_id_idx ON public.balanceapp_transaction_p202611 USING btree (sender_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_p202611_timestamp_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202611_timestamp_idx ON public.balanceapp_transaction_p202611 USING brin ("timestamp");
+
+
+--
+-- Name: balanceapp_transaction_p202612_recipient_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202612_recipient_id_amount_id_idx ON public.balanceapp_transaction_p202612 USING btree (recipient_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_p202612_recipient_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202612_recipient_id_id_idx ON public.balanceapp_transaction_p202612 USING btree (recipient_id, id);
+
+
+--
+-- Name: balanceapp_transaction_p202612_recipient_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202612_recipient_id_timestamp_id_idx ON public.balanceapp_transaction_p202612 USING btree (recipient_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_p202612_sender_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202612_sender_id_amount_id_idx ON public.balanceapp_transaction_p202612 USING btree (sender_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_p202612_sender_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202612_sender_id_id_idx ON public.balanceapp_transaction_p202612 USING btree (sender_id, id);
+
+
+--
+-- Name: balanceapp_transaction_p202612_sender_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202612_sender_id_timestamp_id_idx ON public.balanceapp_transaction_p202612 USING btree (sender_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_p202612_timestamp_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202612_timestamp_idx ON public.balanceapp_transaction_p202612 USING brin ("timestamp");
+
+
+--
+-- Name: balanceapp_transaction_p202701_recipient_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202701_recipient_id_amount_id_idx ON public.balanceapp_transaction_p202701 USING btree (recipient_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_p202701_recipient_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202701_recipient_id_id_idx ON public.balanceapp_transaction_p202701 USING btree (recipient_id, id);
+
+
+--
+-- Name: balanceapp_transaction_p202701_recipient_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202701_recipient_id_timestamp_id_idx ON public.balanceapp_transaction_p202701 USING btree (recipient_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_p202701_sender_id_amount_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202701_sender_id_amount_id_idx ON public.balanceapp_transaction_p202701 USING btree (sender_id, amount, id);
+
+
+--
+-- Name: balanceapp_transaction_p202701_sender_id_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202701_sender_id_id_idx ON public.balanceapp_transaction_p202701 USING btree (sender_id, id);
+
+
+--
+-- Name: balanceapp_transaction_p202701_sender_id_timestamp_id_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202701_sender_id_timestamp_id_idx ON public.balanceapp_transaction_p202701 USING btree (sender_id, "timestamp", id);
+
+
+--
+-- Name: balanceapp_transaction_p202701_timestamp_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX balanceapp_transaction_p202701_timestamp_idx ON public.balanceapp_transaction_p202701 USING brin ("timestamp");
+
+
+--
+-- Name: checkpoint_time_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX checkpoint_time_idx ON public.balanceapp_balancecheckpoint USING btree ("timestamp");
 
 
 --
@@ -605,6 +1317,286 @@ CREATE INDEX django_session_expire_date_a5c62663 ON public.django_session USING
 CREATE INDEX django_session_session_key_c0390e0f_like ON public.django_session USING btree (session_key varchar_pattern_ops);
 
 
+--
+-- Name: balanceapp_transaction_default_pkey; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.balanceapp_transaction_pkey ATTACH PARTITION public.balanceapp_transaction_default_pkey;
+
+
+--
+-- Name: balanceapp_transaction_default_recipient_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_amount_idx ATTACH PARTITION public.balanceapp_transaction_default_recipient_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_default_recipient_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_id_idx ATTACH PARTITION public.balanceapp_transaction_default_recipient_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_default_recipient_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_time_idx ATTACH PARTITION public.balanceapp_transaction_default_recipient_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_default_sender_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_amount_idx ATTACH PARTITION public.balanceapp_transaction_default_sender_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_default_sender_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_id_idx ATTACH PARTITION public.balanceapp_transaction_default_sender_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_default_sender_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_time_idx ATTACH PARTITION public.balanceapp_transaction_default_sender_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_default_timestamp_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_timestamp_brin ATTACH PARTITION public.balanceapp_transaction_default_timestamp_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202610_pkey; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.balanceapp_transaction_pkey ATTACH PARTITION public.balanceapp_transaction_p202610_pkey;
+
+
+--
+-- Name: balanceapp_transaction_p202610_recipient_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_amount_idx ATTACH PARTITION public.balanceapp_transaction_p202610_recipient_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202610_recipient_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_id_idx ATTACH PARTITION public.balanceapp_transaction_p202610_recipient_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202610_recipient_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_time_idx ATTACH PARTITION public.balanceapp_transaction_p202610_recipient_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202610_sender_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_amount_idx ATTACH PARTITION public.balanceapp_transaction_p202610_sender_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202610_sender_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_id_idx ATTACH PARTITION public.balanceapp_transaction_p202610_sender_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202610_sender_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_time_idx ATTACH PARTITION public.balanceapp_transaction_p202610_sender_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202610_timestamp_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_timestamp_brin ATTACH PARTITION public.balanceapp_transaction_p202610_timestamp_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202611_pkey; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.balanceapp_transaction_pkey ATTACH PARTITION public.balanceapp_transaction_p202611_pkey;
+
+
+--
+-- Name: balanceapp_transaction_p202611_recipient_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_amount_idx ATTACH PARTITION public.balanceapp_transaction_p202611_recipient_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202611_recipient_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_id_idx ATTACH PARTITION public.balanceapp_transaction_p202611_recipient_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202611_recipient_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_time_idx ATTACH PARTITION public.balanceapp_transaction_p202611_recipient_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202611_sender_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_amount_idx ATTACH PARTITION public.balanceapp_transaction_p202611_sender_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202611_sender_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_id_idx ATTACH PARTITION public.balanceapp_transaction_p202611_sender_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202611_sender_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_time_idx ATTACH PARTITION public.balanceapp_transaction_p202611_sender_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202611_timestamp_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_timestamp_brin ATTACH PARTITION public.balanceapp_transaction_p202611_timestamp_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202612_pkey; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.balanceapp_transaction_pkey ATTACH PARTITION public.balanceapp_transaction_p202612_pkey;
+
+
+--
+-- Name: balanceapp_transaction_p202612_recipient_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_amount_idx ATTACH PARTITION public.balanceapp_transaction_p202612_recipient_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202612_recipient_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_id_idx ATTACH PARTITION public.balanceapp_transaction_p202612_recipient_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202612_recipient_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_time_idx ATTACH PARTITION public.balanceapp_transaction_p202612_recipient_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202612_sender_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_amount_idx ATTACH PARTITION public.balanceapp_transaction_p202612_sender_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202612_sender_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_id_idx ATTACH PARTITION public.balanceapp_transaction_p202612_sender_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202612_sender_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_time_idx ATTACH PARTITION public.balanceapp_transaction_p202612_sender_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202612_timestamp_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_timestamp_brin ATTACH PARTITION public.balanceapp_transaction_p202612_timestamp_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202701_pkey; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.balanceapp_transaction_pkey ATTACH PARTITION public.balanceapp_transaction_p202701_pkey;
+
+
+--
+-- Name: balanceapp_transaction_p202701_recipient_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_amount_idx ATTACH PARTITION public.balanceapp_transaction_p202701_recipient_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202701_recipient_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_id_idx ATTACH PARTITION public.balanceapp_transaction_p202701_recipient_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202701_recipient_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_recipient_time_idx ATTACH PARTITION public.balanceapp_transaction_p202701_recipient_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202701_sender_id_amount_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_amount_idx ATTACH PARTITION public.balanceapp_transaction_p202701_sender_id_amount_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202701_sender_id_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_id_idx ATTACH PARTITION public.balanceapp_transaction_p202701_sender_id_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202701_sender_id_timestamp_id_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_sender_time_idx ATTACH PARTITION public.balanceapp_transaction_p202701_sender_id_timestamp_id_idx;
+
+
+--
+-- Name: balanceapp_transaction_p202701_timestamp_idx; Type: INDEX ATTACH; Schema: public; Owner: postgres
+--
+
+ALTER INDEX public.tx_timestamp_brin ATTACH PARTITION public.balanceapp_transaction_p202701_timestamp_idx;
+
+
 --
 -- Name: auth_group_permissions auth_group_permissio_permission_id_84c5c92e_fk_auth_perm; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -661,11 +1653,35 @@ ALTER TABLE ONLY public.auth_user_user_permissions
     ADD CONSTRAINT auth_user_user_permissions_user_id_a95ead1b_fk_auth_user_id FOREIGN KEY (user_id) REFERENCES public.auth_user(id) DEFERRABLE INITIALLY DEFERRED;
 
 
+--
+-- Name: balanceapp_balancecheckpoint balanceapp_balancech_customer_id_673d197f_fk_balanceap; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_balancecheckpoint
+    ADD CONSTRAINT balanceapp_balancech_customer_id_673d197f_fk_balanceap FOREIGN KEY (customer_id) REFERENCES public.balanceapp_customer(id) DEFERRABLE INITIALLY DEFERRED;
+
+
+--
+-- Name: balanceapp_balanceslot balanceapp_balancesl_customer_id_5f236a5a_fk_balanceap; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_balanceslot
+    ADD CONSTRAINT balanceapp_balancesl_customer_id_5f236a5a_fk_balanceap FOREIGN KEY (customer_id) REFERENCES public.balanceapp_customer(id) DEFERRABLE INITIALLY DEFERRED;
+
+
+--
+-- Name: balanceapp_statementrollup balanceapp_statement_customer_id_3f12f59f_fk_balanceap; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.balanceapp_statementrollup
+    ADD CONSTRAINT balanceapp_statement_customer_id_3f12f59f_fk_balanceap FOREIGN KEY (customer_id) REFERENCES public.balanceapp_customer(id) DEFERRABLE INITIALLY DEFERRED;
+
+
 --
 -- Name: balanceapp_transaction balanceapp_transacti_recipient_id_327b5bb3_fk_balanceap; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.balanceapp_transaction
+ALTER TABLE public.balanceapp_transaction
     ADD CONSTRAINT balanceapp_transacti_recipient_id_327b5bb3_fk_balanceap FOREIGN KEY (recipient_id) REFERENCES public.balanceapp_customer(id) DEFERRABLE INITIALLY DEFERRED;
 
 
@@ -673,7 +1689,7 @@ ALTER TABLE ONLY public.balanceapp_transaction
 -- Name: balanceapp_transaction balanceapp_transacti_sender_id_cfa0067b_fk_balanceap; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.balanceapp_transaction
+ALTER TABLE public.balanceapp_transaction
     ADD CONSTRAINT balanceapp_transacti_sender_id_cfa0067b_fk_balanceap FOREIGN KEY (sender_id) REFERENCES public.balanceapp_customer(id) DEFERRABLE INITIALLY DEFERRED;
 
 